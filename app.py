@@ -3,12 +3,22 @@
 Aplicación Flask simple para generar archivos Excel CCB
 """
 
-from flask import Flask, jsonify, send_file, request
+from flask import Flask, Response, jsonify, send_file, request, stream_with_context
 from flask_cors import CORS
 import tempfile
+import json
 import logging
 import os
-from ccb import CCBDataExtractor
+import threading
+import time
+from ccb import CCBDataExtractor, EXPORT_FORMATS, export_format_error, file_digest
+from checkpoints import CheckpointStore, ExportCheckpoint
+from contact_store import ContactStore
+from dataset import RowDataset
+from jobs import JobExecutor, JobRegistry, MemoryJobStore, QueueFullError, SQLiteJobStore
+from export_cache import ExportCache
+import metrics
+import tracing
 
 # Configurar logging
 logging.basicConfig(
@@ -25,6 +35,8 @@ CORS(app)
 AUTH_TOKEN = os.getenv('HILOS_API_TOKEN')
 FLOW_ID = os.getenv('HILOS_FLOW_ID', '0684111b-3948-7ce2-8000-b20bbb1bd564')
 FRONTEND_TOKEN = os.getenv('FRONTEND_ACCESS_TOKEN')
+CONTACT_STORE_PATH = os.getenv('CCB_CONTACT_STORE', 'ccb_contacts.db')
+DATASET_PATH = os.getenv('CCB_DATASET_STORE', 'ccb_dataset.db')
 
 # Validar que las variables requeridas estén configuradas
 if not AUTH_TOKEN:
@@ -37,8 +49,63 @@ if not FRONTEND_TOKEN:
 
 logger.info("Variables de entorno configuradas correctamente")
 
-# Variable global para almacenar resultados de trabajos
-job_results = {}
+# Almacén local de contactos compartido por todas las peticiones (exportaciones incrementales)
+contact_store = ContactStore(
+    CONTACT_STORE_PATH,
+    max_age=float(os.getenv('CCB_CONTACT_STORE_MAX_AGE', '86400'))
+) if CONTACT_STORE_PATH else None
+
+# Copia local indexada de las filas de la última exportación completa, para servir
+# exportaciones filtradas o con menos columnas sin llamar a la API
+row_dataset = RowDataset(DATASET_PATH) if DATASET_PATH else None
+
+# Registro de trabajos con expiración: en memoria o en SQLite (CCB_JOB_STORE) para
+# conservar el estado tras reinicios y compartirlo entre workers de gunicorn
+JOB_STORE_PATH = os.getenv('CCB_JOB_STORE')
+job_registry = JobRegistry(
+    store=SQLiteJobStore(JOB_STORE_PATH) if JOB_STORE_PATH else MemoryJobStore(),
+    ttl=float(os.getenv('CCB_JOB_TTL', '3600')),
+    max_jobs=int(os.getenv('CCB_JOB_MAX', '100'))
+)
+
+# Trabajos en curso por (flujo, formato): las solicitudes idénticas se unen al trabajo existente
+active_jobs = {}
+active_jobs_lock = threading.Lock()
+
+# Checkpoints de los trabajos asíncronos: un trabajo reiniciado, reintentado o cancelado
+# continúa desde el último punto guardado en lugar de empezar de nuevo (vacío = sin checkpoints)
+CHECKPOINT_STORE_PATH = os.getenv('CCB_CHECKPOINT_STORE', 'ccb_checkpoints.db')
+CHECKPOINT_INTERVAL = float(os.getenv('CCB_CHECKPOINT_INTERVAL', '30'))
+checkpoint_store = CheckpointStore(
+    CHECKPOINT_STORE_PATH,
+    max_age=float(os.getenv('CCB_CHECKPOINT_MAX_AGE', '3600'))
+) if CHECKPOINT_STORE_PATH else None
+
+# Extractores de los trabajos en ejecución en este proceso, para poder cancelarlos, y
+# cancelaciones pedidas para trabajos de este proceso (también antes de crear su extractor)
+running_extractors = {}
+cancel_requests = set()
+running_extractors_lock = threading.Lock()
+
+# Caché de la última exportación por (flujo, formato), con stale-while-revalidate
+export_cache = ExportCache(
+    directory=os.getenv('CCB_EXPORT_CACHE_DIR') or None,
+    ttl=float(os.getenv('CCB_EXPORT_CACHE_TTL', '300')),
+    max_bytes=int(float(os.getenv('CCB_EXPORT_CACHE_MAX_MB', '200')) * 1024 * 1024)
+)
+
+# Ejecutor de trabajos asíncronos: hilos fijos y cola acotada
+job_executor = JobExecutor(
+    max_workers=int(os.getenv('CCB_JOB_WORKERS', '2')),
+    max_queue=int(os.getenv('CCB_JOB_QUEUE_SIZE', '10'))
+)
+metrics.JOB_QUEUE_DEPTH.set_function(job_executor.queue_depth)
+metrics.JOBS_RUNNING.set_function(job_executor.running_count)
+
+# Perfiles de exportación (?profile=1): traces de Chrome, se conservan los más recientes
+PROFILE_DIR = os.getenv('CCB_PROFILE_DIR') or tempfile.mkdtemp(prefix='ccb_profiles_')
+PROFILE_MAX = int(os.getenv('CCB_PROFILE_MAX', '20'))
+os.makedirs(PROFILE_DIR, exist_ok=True)
 
 def validate_frontend_token(request_obj):
     """
@@ -82,6 +149,433 @@ def validate_frontend_token(request_obj):
         logger.error(f"Error al validar token: {e}")
         return False
 
+def get_export_format(request_obj):
+    """
+    Obtener el formato de exportación solicitado (parámetro ?format= o campo "format" del JSON).
+    
+    Args:
+        request_obj: Objeto request de Flask
+        
+    Returns:
+        str: Formato solicitado en minúsculas (xlsx por defecto)
+    """
+    body = request_obj.get_json(silent=True) or {}
+    export_format = request_obj.args.get('format') or body.get('format') or 'xlsx'
+    return str(export_format).lower()
+
+def invalid_format_response(export_format):
+    """
+    Respuesta 400 si el formato de exportación no está soportado o le falta su
+    dependencia opcional (por ejemplo, parquet sin pyarrow); None si está disponible.
+    Se comprueba antes de llamar a la API de Hilos.
+    """
+    format_error = export_format_error(export_format)
+    if format_error is None:
+        return None
+    return jsonify({
+        'success': False,
+        'error': format_error
+    }), 400
+
+def request_flag(request_obj, name):
+    """Indica si la petición activa una opción (?name=1 o "name": true en el JSON)"""
+    body = request_obj.get_json(silent=True) or {}
+    value = request_obj.args.get(name, body.get(name, False))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def wants_stream(request_obj):
+    """Indica si se pidió la respuesta en streaming (?stream=1 o "stream": true en el JSON)"""
+    return request_flag(request_obj, 'stream')
+
+def wants_profile(request_obj):
+    """Indica si se pidió perfilar la exportación (?profile=1 o "profile": true en el JSON)"""
+    return request_flag(request_obj, 'profile')
+
+def get_row_query(request_obj):
+    """
+    Obtener la proyección y los filtros de una exportación desde el dataset local.
+    Query: ?columns=a,b y ?filter[columna]=valor (repetido para IN).
+    JSON: "columns": [...] y "filters": {"columna": valor o [valores]}.
+    
+    Args:
+        request_obj: Objeto request de Flask
+        
+    Returns:
+        tuple: (lista de columnas o None, diccionario columna -> lista de valores)
+    """
+    body = request_obj.get_json(silent=True) or {}
+    columns = request_obj.args.get('columns') or body.get('columns')
+    if isinstance(columns, str):
+        columns = [column.strip() for column in columns.split(',') if column.strip()]
+
+    filters = {}
+    for key, values in request_obj.args.lists():
+        if key.startswith('filter[') and key.endswith(']'):
+            filters.setdefault(key[len('filter['):-1], []).extend(values)
+    for column, value in (body.get('filters') or {}).items():
+        filters.setdefault(column, []).extend(value if isinstance(value, list) else [value])
+    return columns or None, filters
+
+def open_dataset_snapshot(extractor):
+    """Copia nueva del dataset local para las filas de una exportación completa (None si está desactivado)"""
+    return row_dataset.snapshot(FLOW_ID, extractor.required_columns) if row_dataset is not None else None
+
+def export_etag(digest, export_format):
+    """ETag de una exportación: digest de sus datos y formato (None si no se conoce el digest)"""
+    return f'{digest}-{export_format}' if digest else None
+
+def not_modified_response(etag, last_modified=None):
+    """
+    Respuesta 304 si el cliente ya tiene la exportación con este ETag (If-None-Match), o None.
+    werkzeug solo evalúa las condiciones en GET y HEAD; esto cubre también POST /api/generate-excel.
+    """
+    if not etag or not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def send_export(filename, export_format, etag=None, last_modified=None, download_name=None):
+    """
+    Enviar un archivo de exportación con ETag (digest de sus datos) y Last-Modified.
+    En GET y HEAD, werkzeug responde 304 a If-None-Match/If-Modified-Since y 206 a Range,
+    por lo que una descarga interrumpida se puede continuar sin volver a enviar lo recibido.
+    
+    Args:
+        filename: Archivo a enviar
+        export_format: Formato de la exportación (ver EXPORT_FORMATS)
+        etag: ETag de la exportación (opcional, por defecto uno derivado de la ruta y la fecha)
+        last_modified: Fecha de modificación (opcional, por defecto la del archivo)
+        download_name: Nombre del archivo descargado (opcional, ccb_data.<extensión>)
+        
+    Returns:
+        Response de Flask
+    """
+    return send_file(
+        filename,
+        as_attachment=True,
+        download_name=download_name or f"ccb_data{EXPORT_FORMATS[export_format]['extension']}",
+        mimetype=EXPORT_FORMATS[export_format]['mimetype'],
+        etag=etag or True,
+        last_modified=last_modified,
+        conditional=True
+    )
+
+def new_profile_id():
+    """Generar el ID con el que se guardará el perfil de una exportación"""
+    import uuid
+    return uuid.uuid4().hex
+
+def profile_path(profile_id):
+    """Ruta del trace de un perfil, o None si el ID no es válido"""
+    if not profile_id or not all(c in '0123456789abcdef' for c in profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, f'{profile_id}.json')
+
+def save_profile(profile_id, tracer):
+    """
+    Guardar el trace de una exportación perfilada y eliminar los perfiles más antiguos
+    si se supera CCB_PROFILE_MAX.
+    """
+    try:
+        tracer.write_chrome_trace(profile_path(profile_id))
+        logger.info("Perfil de la exportación guardado: %s", profile_id)
+
+        profiles = sorted(
+            (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith('.json')),
+            key=os.path.getmtime
+        )
+        for filename in profiles[:max(0, len(profiles) - PROFILE_MAX)]:
+            remove_file(filename)
+    except OSError as e:
+        logger.warning("No se pudo guardar el perfil %s: %s", profile_id, str(e))
+
+def stream_export(extractor, export_format, profile_id=None):
+    """
+    Enviar la exportación con transferencia chunked mientras se procesan los contactos.
+    Los encabezados salen de inmediato, lo que mantiene viva la conexión tras el proxy.
+    
+    Args:
+        extractor: Instancia de CCBDataExtractor
+        export_format: csv o ndjson
+        profile_id: ID con el que se guarda el perfil al terminar (opcional)
+        
+    Returns:
+        Response de Flask con el generador de bloques
+    """
+    snapshot = open_dataset_snapshot(extractor)
+    rows = extractor.iter_processed_contacts()
+    if snapshot is not None:
+        rows = snapshot.tee(rows)
+    if export_format == 'csv':
+        chunks = extractor.iter_csv_chunks(rows, rows_per_chunk=50)
+    else:
+        chunks = extractor.iter_ndjson_chunks(rows, rows_per_chunk=50)
+
+    def generate():
+        try:
+            for chunk in chunks:
+                yield chunk
+            logger.info("Exportación en streaming completada: %d registros", extractor.last_export_count)
+            metrics.ROWS_WRITTEN.inc(extractor.last_export_count, format=export_format)
+            if snapshot is not None:
+                snapshot.commit()
+        except Exception as e:
+            # Ya se enviaron los encabezados HTTP: solo queda registrar el error y cortar la respuesta
+            logger.error("Error durante la exportación en streaming: %s", str(e))
+            raise
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+            if profile_id:
+                save_profile(profile_id, extractor.tracer)
+
+    headers = {
+        'Content-Disposition': f"attachment; filename=ccb_data{EXPORT_FORMATS[export_format]['extension']}",
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'no-cache'
+    }
+    if profile_id:
+        headers['X-Profile-Id'] = profile_id
+
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format]['mimetype'],
+                    headers=headers)
+
+def submit_export_job(export_format, profile=False, job_id=None):
+    """
+    Encolar una exportación del flujo en el ejecutor de trabajos.
+    Si ya hay un trabajo en curso para el mismo flujo y formato, se reutiliza
+    (salvo en los trabajos perfilados, que siempre hacen su propia exportación).
+    Al terminar, el archivo generado se guarda en la caché de exportaciones.
+    
+    Con checkpoints (CCB_CHECKPOINT_STORE), el avance del trabajo se guarda periódicamente:
+    si se vuelve a encolar con el mismo job_id, continúa desde el último checkpoint.
+    
+    Args:
+        export_format: Formato de exportación
+        profile: Perfilar la exportación; el trabajo incluye el profile_id del trace
+        job_id: ID de un trabajo existente para continuarlo (opcional)
+        
+    Returns:
+        tuple: (job_id, posición en la cola, True si se unió a un trabajo existente)
+        
+    Raises:
+        QueueFullError: Si la cola de trabajos está llena
+    """
+    import uuid
+
+    job_key = (FLOW_ID, export_format)
+    resumed = job_id is not None
+    job_id = job_id or str(uuid.uuid4())
+    job_info = {'format': export_format}
+    if profile:
+        job_info['profile_id'] = new_profile_id()
+    if resumed:
+        job_info['resumed'] = True
+
+    # Procesamiento en segundo plano (lo ejecuta un hilo del ejecutor de trabajos)
+    def process_data():
+        current = job_registry.get(job_id)
+        if current is not None and current.get('status') == 'completed':
+            # Otro proceso ya terminó este trabajo (encolado de nuevo tras un reinicio)
+            release_active_job(job_key, job_id)
+            return
+
+        with running_extractors_lock:
+            cancelled_before_start = job_id in cancel_requests
+            cancel_requests.discard(job_id)
+        if cancelled_before_start:
+            # Cancelado después de salir de la cola pero antes de empezar
+            job_registry.set(job_id, dict(
+                job_info, status='cancelled',
+                resumable=checkpoint_store is not None and checkpoint_store.exists(job_id)
+            ))
+            release_active_job(job_key, job_id)
+            logger.info("Trabajo cancelado antes de empezar: %s", job_id)
+            return
+
+        checkpoint = ExportCheckpoint(checkpoint_store, job_id, interval=CHECKPOINT_INTERVAL) \
+            if checkpoint_store is not None else None
+        if checkpoint is not None and not checkpoint.claim():
+            logger.info("El trabajo %s ya se está ejecutando en otro proceso", job_id)
+            release_active_job(job_key, job_id)
+            return
+
+        job_registry.set(job_id, dict(job_info, status='processing'))
+        temp_filename = None
+        tracer = tracing.Tracer() if profile else None
+        extractor = None
+        snapshot = None
+
+        def publish_progress(progress):
+            # Cancelación pedida en este proceso mientras el trabajo arrancaba, o desde otro worker (ver cancel_job)
+            if extractor is not None and (job_id in cancel_requests or
+                                          (checkpoint is not None and checkpoint.cancel_requested())):
+                extractor.cancel()
+            job_registry.set(job_id, dict(job_info, status='processing', progress=progress))
+
+        try:
+            extractor = CCBDataExtractor(AUTH_TOKEN, store=contact_store, progress_callback=publish_progress,
+                                         tracer=tracer)
+            with running_extractors_lock:
+                running_extractors[job_id] = extractor
+
+            extension = EXPORT_FORMATS[export_format]['extension']
+            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
+                temp_filename = tmp_file.name
+            snapshot = open_dataset_snapshot(extractor)
+            rows = extractor.iter_processed_contacts(checkpoint)
+            record_count = extractor.export(snapshot.tee(rows) if snapshot is not None else rows,
+                                            temp_filename, export_format)
+            if snapshot is not None and not extractor.cancelled:
+                snapshot.commit()
+
+            if extractor.cancelled:
+                # Exportación parcial con lo procesado hasta la cancelación; se puede continuar
+                job_registry.set(job_id, dict(
+                    job_info,
+                    status='cancelled',
+                    filename=temp_filename,
+                    record_count=record_count,
+                    etag=export_etag(file_digest(temp_filename), export_format),
+                    partial=True,
+                    resumable=checkpoint is not None and checkpoint_store.exists(job_id),
+                    progress=extractor.get_progress()
+                ))
+                logger.info("Trabajo cancelado en ejecución: %s (%d registros exportados)", job_id, record_count)
+            elif record_count:
+                cached = export_cache.put(job_key, temp_filename, record_count, extractor.last_export_digest)
+                # El registro borra el archivo cuando el trabajo expira o es desalojado
+                job_registry.set(job_id, dict(
+                    job_info,
+                    status='completed',
+                    filename=temp_filename,
+                    record_count=record_count,
+                    etag=export_etag(cached['etag'], export_format),
+                    failed_contacts=extractor.last_run_stats.get('failed_contacts', 0),
+                    progress=extractor.get_progress()
+                ))
+            else:
+                remove_file(temp_filename)
+                job_registry.set(job_id, dict(job_info, status='error', error='No se encontraron datos',
+                                              record_count=0))
+        except Exception as e:
+            remove_file(temp_filename)
+            job_registry.set(job_id, dict(
+                job_info, status='error', error=str(e),
+                resumable=checkpoint is not None and checkpoint_store.exists(job_id)
+            ))
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+            with running_extractors_lock:
+                running_extractors.pop(job_id, None)
+                cancel_requests.discard(job_id)
+            if checkpoint is not None:
+                checkpoint.release()
+                checkpoint_store.expire()
+            if tracer is not None:
+                save_profile(job_info['profile_id'], tracer)
+            release_active_job(job_key, job_id)
+
+    with active_jobs_lock:
+        existing_job_id = active_jobs.get(job_key)
+        if existing_job_id is not None and not profile and not resumed:
+            return existing_job_id, job_executor.queue_position(existing_job_id), True
+
+        previous_job = job_registry.get(job_id) if resumed else None
+        job_registry.set(job_id, dict(job_info, status='queued'))
+        try:
+            queue_position = job_executor.submit(job_id, process_data)
+        except QueueFullError:
+            if previous_job is not None:
+                job_registry.set(job_id, previous_job)
+            else:
+                job_registry.delete(job_id)
+            raise
+        if not profile and existing_job_id is None:
+            active_jobs[job_key] = job_id
+
+    return job_id, queue_position, False
+
+def wait_for_job(job_id):
+    """
+    Esperar a que un trabajo termine (completado, con error o cancelado).
+    
+    Args:
+        job_id: ID del trabajo
+        
+    Returns:
+        dict: Estado final del trabajo, o None si ya no está en el registro
+    """
+    while True:
+        job = job_registry.get(job_id)
+        if job is None or job['status'] not in ('queued', 'processing'):
+            return job
+        job_registry.wait_for_change(timeout=2)
+
+def refresh_cached_export(export_format):
+    """Regenerar en segundo plano una exportación en caché que ya venció"""
+    try:
+        job_id, _, coalesced = submit_export_job(export_format)
+        if not coalesced:
+            logger.info("Actualizando en segundo plano la exportación %s (trabajo %s)", export_format, job_id)
+    except QueueFullError:
+        logger.warning("No se pudo actualizar la caché de %s: la cola de trabajos está llena", export_format)
+
+def create_cached_job(cached, export_format):
+    """Registrar un trabajo ya completado que apunta a una exportación en caché"""
+    import uuid
+
+    job_id = str(uuid.uuid4())
+    job_registry.set(job_id, {
+        'status': 'completed',
+        'filename': cached['filename'],
+        'format': export_format,
+        'record_count': cached['record_count'],
+        'etag': export_etag(cached['etag'], export_format),
+        'cached': True,
+        'stale': not cached['fresh']
+    })
+    return job_id
+
+def remove_file(filename):
+    """Eliminar un archivo temporal si existe"""
+    if filename and os.path.exists(filename):
+        try:
+            os.remove(filename)
+        except OSError as e:
+            logger.warning("No se pudo eliminar el archivo %s: %s", filename, str(e))
+
+def release_active_job(job_key, job_id):
+    """Dejar de unir nuevas solicitudes a un trabajo que terminó o se canceló"""
+    with active_jobs_lock:
+        if active_jobs.get(job_key) == job_id:
+            del active_jobs[job_key]
+
+def resume_interrupted_jobs():
+    """
+    Volver a encolar los trabajos que estaban en cola o en ejecución cuando se detuvo
+    el servidor (solo con CCB_JOB_STORE y checkpoints). Los que tenían checkpoint
+    continúan desde él; los que otro worker sigue ejecutando se dejan como están.
+    """
+    if not JOB_STORE_PATH or checkpoint_store is None:
+        return
+
+    for job_id, job in job_registry.unfinished():
+        if checkpoint_store.is_claimed(job_id):
+            continue
+        try:
+            submit_export_job(job.get('format', 'xlsx'), job_id=job_id)
+            logger.info("Trabajo interrumpido encolado de nuevo: %s", job_id)
+        except QueueFullError:
+            job_registry.set(job_id, dict(
+                job, status='error', error='El servidor se reinició durante el trabajo',
+                resumable=checkpoint_store.exists(job_id)
+            ))
+
 @app.route('/')
 def index():
     """Servir la página principal"""
@@ -94,9 +588,72 @@ def status():
     return jsonify({
         'status': 'ok',
         'message': 'Servicio CCB talento latam funcionando correctamente',
-        'auth_required': True
+        'auth_required': True,
+        'jobs': {
+            'running': job_executor.running_count(),
+            'queued': job_executor.queue_depth(),
+            'max_queue': job_executor.max_queue
+        },
+        'cache': export_cache.stats()
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métricas de la API de Hilos, fases de exportación, trabajos y caché en formato Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def dataset_export(export_format, columns, filters):
+    """
+    Exportar desde el dataset local solo las columnas y filas pedidas (sin llamar a la API).
+    
+    Args:
+        export_format: Formato de exportación
+        columns: Columnas a exportar, en ese orden (None = todas)
+        filters: Columna -> valores aceptados (igualdad o IN)
+        
+    Returns:
+        Response de Flask con el archivo (400 si una columna no existe o la copia ya no está,
+        409 si no hay datos locales)
+    """
+    info = row_dataset.info(FLOW_ID) if row_dataset is not None else None
+    if info is None:
+        return jsonify({
+            'success': False,
+            'error': 'Todavía no hay datos locales del flujo. Genera primero una exportación completa.'
+        }), 409
+
+    try:
+        extractor = CCBDataExtractor(AUTH_TOKEN, store=contact_store, columns=columns or info['columns'])
+        rows = row_dataset.query(FLOW_ID, extractor.required_columns, filters)
+    except (LookupError, ValueError) as e:
+        # LookupError: la copia del flujo desapareció entre info() y query()
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    extension = EXPORT_FORMATS[export_format]['extension']
+    with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
+        temp_filename = tmp_file.name
+    try:
+        # Sin export(): estas exportaciones no cuentan en las métricas de duración y filas escritas,
+        # que miden las exportaciones completas desde la API
+        record_count = extractor._write_file(rows, temp_filename, export_format)
+    except Exception:
+        remove_file(temp_filename)
+        raise
+    logger.info("Exportación %s desde el dataset local: %d registros", export_format, record_count)
+
+    # El archivo se genera de nuevo en cada petición (un .xlsx cambia de bytes aunque los datos
+    # sean los mismos): el ETag es el digest de los bytes, para que 304 y Range sean seguros
+    etag = export_etag(file_digest(temp_filename), export_format)
+    response = not_modified_response(etag, info['updated_at'])
+    if response is not None:
+        remove_file(temp_filename)
+    else:
+        response = send_export(temp_filename, export_format, etag, info['updated_at'])
+        response.call_on_close(lambda: remove_file(temp_filename))
+    response.headers['X-Record-Count'] = str(record_count)
+    response.headers['X-Data-Source'] = 'dataset'
+    return response
+
 @app.route('/api/generate-excel', methods=['POST'])
 def generate_excel():
     """
@@ -111,40 +668,163 @@ def generate_excel():
                 'error': 'Token de acceso requerido'
             }), 401
         
-        logger.info("Solicitud autorizada recibida para generar archivo Excel")
+        export_format = get_export_format(request)
+        format_response = invalid_format_response(export_format)
+        if format_response:
+            return format_response
+
+        logger.info("Solicitud autorizada recibida para generar archivo %s", export_format)
 
-        # Crear instancia del extractor
-        extractor = CCBDataExtractor(AUTH_TOKEN)
+        # Con columnas o filtros, la exportación sale del dataset local sin llamar a la API
+        columns, filters = get_row_query(request)
+        if columns or filters:
+            return dataset_export(export_format, columns, filters)
 
-        # Procesar todos los contactos
-        logger.info("Iniciando procesamiento de contactos...")
-        processed_data = extractor.process_all_contacts()
+        profile = wants_profile(request)
 
-        if not processed_data:
+        # Servir desde caché si hay una exportación reciente (o vencida, regenerándola en segundo plano).
+        # Una exportación perfilada siempre se genera de nuevo.
+        cached = export_cache.get((FLOW_ID, export_format)) if not profile else None
+        if cached is not None:
+            if not cached['fresh']:
+                refresh_cached_export(export_format)
+            etag = export_etag(cached['etag'], export_format)
+            response = not_modified_response(etag, cached['modified_at'])
+            if response is None:
+                logger.info("Enviando exportación %s desde caché (fresca: %s)", export_format, cached['fresh'])
+                response = send_export(cached['filename'], export_format, etag, cached['modified_at'])
+            response.headers['X-Cache'] = 'HIT' if cached['fresh'] else 'STALE'
+            return response
+
+        if wants_stream(request):
+            if export_format not in ('csv', 'ndjson'):
+                return jsonify({
+                    'success': False,
+                    'error': 'El modo streaming solo está disponible para los formatos csv y ndjson'
+                }), 400
+            tracer = tracing.Tracer() if profile else None
+            extractor = CCBDataExtractor(AUTH_TOKEN, store=contact_store, tracer=tracer)
+            logger.info("Enviando exportación %s en streaming...", export_format)
+            return stream_export(extractor, export_format, new_profile_id() if profile else None)
+
+        # La exportación pasa por el mismo trabajo que /api/generate-excel-async: si ya hay
+        # uno en curso para este flujo y formato, la solicitud espera su resultado
+        try:
+            job_id, _, coalesced = submit_export_job(export_format, profile=profile)
+        except QueueFullError as e:
+            logger.warning("Solicitud rechazada: %s", str(e))
+            response = jsonify({
+                'success': False,
+                'error': 'Hay demasiados trabajos en espera. Intenta de nuevo en unos minutos.'
+            })
+            response.headers['Retry-After'] = '60'
+            return response, 503
+
+        if coalesced:
+            logger.info("Solicitud unida al trabajo en curso %s", job_id)
+        else:
+            logger.info("Iniciando procesamiento de contactos (trabajo %s)...", job_id)
+        job = wait_for_job(job_id)
+
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'El trabajo de exportación ya no está disponible'
+            }), 500
+        if job['status'] == 'error' and job.get('record_count') == 0:
             return jsonify({
                 'success': False,
                 'error': 'No se encontraron datos para procesar'
             }), 400
+        if job['status'] != 'completed':
+            return jsonify({
+                'success': False,
+                'error': job.get('error') or 'La exportación fue cancelada'
+            }), 500
+
+        # Si los datos no cambiaron desde la copia que ya tiene el cliente, no reenviar el archivo.
+        # El archivo pertenece al trabajo: el registro lo borra cuando el trabajo expira
+        response = not_modified_response(job.get('etag'))
+        if response is None:
+            logger.info("Enviando archivo %s...", export_format)
+            response = send_export(job['filename'], export_format, job.get('etag'))
+        # Informar cuántos contactos quedaron sin datos tras los reintentos
+        response.headers['X-Failed-Contacts'] = str(job.get('failed_contacts', 0))
+        response.headers['X-Cache'] = 'MISS'
+        if job.get('profile_id'):
+            response.headers['X-Profile-Id'] = job['profile_id']
+        return response
+
+    except Exception as e:
+        logger.error("Error al generar archivo Excel: %s", str(e))
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/delta')
+def delta_export():
+    """
+    Exportar solo los contactos que entraron al flujo o cambiaron desde un cursor.
+    Devuelve las filas y el cursor para la siguiente sincronización; sin since, todo el flujo.
+    """
+    try:
+        if not validate_frontend_token(request):
+            logger.warning("Intento de acceso no autorizado (delta)")
+            return jsonify({
+                'success': False,
+                'error': 'Token de acceso requerido'
+            }), 401
+
+        export_format = (request.args.get('format') or 'json').lower()
+        format_response = invalid_format_response(export_format) if export_format != 'json' else None
+        if format_response:
+            return format_response
 
-        # Crear archivo temporal
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
+        since = request.args.get('since') or None
+        extractor = CCBDataExtractor(AUTH_TOKEN, store=contact_store)
+        try:
+            rows, cursor = extractor.get_changed_contacts(since)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        stats = extractor.last_run_stats
+        logger.info("Exportación delta: %d contactos nuevos o modificados (%d páginas)",
+                    stats['changed_contacts'], stats['pages_fetched'])
+
+        if export_format == 'json':
+            headers = extractor.get_column_headers()
+            data = [dict(zip(headers, values)) for values in extractor.iter_export_rows(rows)]
+            return jsonify({
+                'success': True,
+                'since': stats['since'],
+                'cursor': cursor,
+                'record_count': len(data),
+                'failed_contacts': stats['failed_contacts'],
+                'pages_fetched': stats['pages_fetched'],
+                'rows': data
+            })
+
+        extension = EXPORT_FORMATS[export_format]['extension']
+        with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
             temp_filename = tmp_file.name
+        try:
+            extractor.export(rows, temp_filename, export_format)
+        except Exception:
+            remove_file(temp_filename)
+            raise
 
-        # Generar Excel
-        logger.info("Generando archivo Excel con %d registros...", len(processed_data))
-        extractor.generate_excel(processed_data, temp_filename)
-
-        # Enviar archivo como respuesta
-        logger.info("Enviando archivo Excel...")
-        return send_file(
-            temp_filename,
-            as_attachment=True,
-            download_name='ccb_data.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # ETag de los bytes generados en esta petición, no de los datos (ver dataset_export)
+        response = send_export(temp_filename, export_format,
+                               export_etag(file_digest(temp_filename), export_format),
+                               download_name=f'ccb_delta{extension}')
+        response.headers['X-Delta-Cursor'] = cursor
+        response.headers['X-Failed-Contacts'] = str(stats['failed_contacts'])
+        response.call_on_close(lambda: remove_file(temp_filename))
+        return response
 
     except Exception as e:
-        logger.error("Error al generar archivo Excel: %s", str(e))
+        logger.error("Error en la exportación delta: %s", str(e))
         return jsonify({
             'success': False,
             'error': str(e)
@@ -165,49 +845,50 @@ def generate_excel_async():
                 'error': 'Token de acceso requerido'
             }), 401
         
-        import uuid
-        import threading
-
-        job_id = str(uuid.uuid4())
-
-        # Iniciar procesamiento en segundo plano
-        def process_data():
-            try:
-                extractor = CCBDataExtractor(AUTH_TOKEN)
-                processed_data = extractor.process_all_contacts()
-
-                if processed_data:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-                        temp_filename = tmp_file.name
-                    extractor.generate_excel(processed_data, temp_filename)
-
-                    # Guardar resultado (en producción usar Redis o similar)
-                    job_results[job_id] = {
-                        'status': 'completed',
-                        'filename': temp_filename,
-                        'record_count': len(processed_data)
-                    }
-                else:
-                    job_results[job_id] = {
-                        'status': 'error',
-                        'error': 'No se encontraron datos'
-                    }
-            except Exception as e:
-                job_results[job_id] = {
-                    'status': 'error',
-                    'error': str(e)
-                }
-
-        job_results[job_id] = {'status': 'processing'}
-
-        # Iniciar hilo
-        thread = threading.Thread(target=process_data)
-        thread.start()
+        export_format = get_export_format(request)
+        format_response = invalid_format_response(export_format)
+        if format_response:
+            return format_response
+
+        profile = wants_profile(request)
+
+        # Si hay una exportación en caché, el trabajo queda completado de inmediato
+        cached = export_cache.get((FLOW_ID, export_format)) if not profile else None
+        if cached is not None:
+            job_id = create_cached_job(cached, export_format)
+            if not cached['fresh']:
+                refresh_cached_export(export_format)
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'queue_position': None,
+                'coalesced': False,
+                'cached': True,
+                'message': 'Exportación servida desde caché'
+            })
+
+        try:
+            job_id, queue_position, coalesced = submit_export_job(export_format, profile=profile)
+        except QueueFullError as e:
+            logger.warning("Trabajo rechazado: %s", str(e))
+            response = jsonify({
+                'success': False,
+                'error': 'Hay demasiados trabajos en espera. Intenta de nuevo en unos minutos.'
+            })
+            response.headers['Retry-After'] = '60'
+            return response, 503
+
+        if coalesced:
+            logger.info("Solicitud unida al trabajo en curso %s", job_id)
 
         return jsonify({
             'success': True,
             'job_id': job_id,
-            'message': 'Procesamiento iniciado'
+            'queue_position': queue_position,
+            'coalesced': coalesced,
+            'cached': False,
+            'profile_id': job_registry.get(job_id).get('profile_id') if profile else None,
+            'message': 'Ya hay un procesamiento en curso para este flujo' if coalesced else 'Procesamiento en cola'
         })
 
     except Exception as e:
@@ -220,38 +901,209 @@ def generate_excel_async():
 @app.route('/api/job-status/<job_id>')
 def job_status(job_id):
     """Verificar el estado de un trabajo"""
-    if job_id not in job_results:
+    job = job_registry.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    if job['status'] == 'queued':
+        job['queue_position'] = job_executor.queue_position(job_id)
+    return jsonify(job)
+
+
+def format_job_event(job_id, job):
+    """
+    Convertir el estado de un trabajo en un evento SSE.
+
+    Returns:
+        str: Evento progress, completed, error o cancelled con los datos del trabajo en JSON
+             (cancelled incluye la URL de descarga si dejó una exportación parcial)
+    """
+    data = {key: value for key, value in job.items() if key != 'filename'}
+    data['job_id'] = job_id
+    event = 'progress' if job['status'] in ('queued', 'processing') else job['status']
+    if job['status'] == 'queued':
+        data['queue_position'] = job_executor.queue_position(job_id)
+    if job['status'] == 'completed' or (job['status'] == 'cancelled' and job.get('filename')):
+        data['download_url'] = f'/api/download/{job_id}'
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route('/api/job-events/<job_id>')
+def job_events(job_id):
+    """
+    Enviar el progreso de un trabajo con Server-Sent Events, en lugar de consultar su estado
+    periódicamente. El último evento (completed, error o cancelled) incluye la URL de descarga.
+    """
+    if job_registry.get(job_id) is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    def generate():
+        last_event = None
+        last_sent_at = time.time()
+        while True:
+            job = job_registry.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'job_id': job_id, 'error': 'Trabajo no encontrado'})}\n\n"
+                return
+
+            event = format_job_event(job_id, job)
+            if event != last_event:
+                yield event
+                last_event = event
+                last_sent_at = time.time()
+            elif time.time() - last_sent_at > 15:
+                # Comentario SSE para que el proxy no cierre la conexión inactiva
+                yield ": keepalive\n\n"
+                last_sent_at = time.time()
+
+            if job['status'] not in ('queued', 'processing'):
+                return
+
+            job_registry.wait_for_change(timeout=2)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/cancel-job/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Cancelar un trabajo. Si está en cola, se descarta; si está en ejecución, se detiene
+    tras el contacto en curso y queda como cancelado con una exportación parcial que se
+    puede descargar y continuar con /api/resume-job.
+    """
+    # Validar token del frontend
+    if not validate_frontend_token(request):
+        logger.warning("Intento de cancelación no autorizado")
+        return jsonify({'error': 'Token de acceso requerido'}), 401
+
+    job = job_registry.get(job_id)
+    if job is None:
         return jsonify({'error': 'Trabajo no encontrado'}), 404
 
-    return jsonify(job_results[job_id])
+    if job_executor.cancel(job_id):
+        release_active_job((FLOW_ID, job.get('format', 'xlsx')), job_id)
+        job_registry.set(job_id, dict(job, status='cancelled'))
+        logger.info("Trabajo cancelado: %s", job_id)
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'cancelled'})
+
+    # Un hilo puede haber tomado el trabajo de la cola sin que su estado diga todavía
+    # processing: la cancelación queda pedida y el trabajo la atiende al empezar
+    if job['status'] in ('queued', 'processing'):
+        with running_extractors_lock:
+            extractor = running_extractors.get(job_id)
+            local = extractor is not None or job_executor.is_running(job_id)
+            if local:
+                cancel_requests.add(job_id)
+        if extractor is not None:
+            extractor.cancel()
+        elif not local and (checkpoint_store is None or not checkpoint_store.request_cancel(job_id)):
+            return jsonify({'error': 'No se pudo cancelar el trabajo en ejecución'}), 409
+        # Sin nuevas uniones al trabajo mientras termina de cancelarse
+        release_active_job((FLOW_ID, job.get('format', 'xlsx')), job_id)
+        logger.info("Cancelación pedida para el trabajo en ejecución: %s", job_id)
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'cancelling'}), 202
+
+    return jsonify({'error': 'El trabajo ya terminó'}), 409
+
+
+@app.route('/api/resume-job/<job_id>', methods=['POST'])
+def resume_job(job_id):
+    """Continuar un trabajo cancelado o con error desde su último checkpoint"""
+    if not validate_frontend_token(request):
+        logger.warning("Intento de reanudación no autorizado")
+        return jsonify({'error': 'Token de acceso requerido'}), 401
+
+    job = job_registry.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    if job['status'] not in ('cancelled', 'error'):
+        return jsonify({'error': 'Solo se pueden continuar trabajos cancelados o con error'}), 409
+
+    if checkpoint_store is None or not checkpoint_store.exists(job_id):
+        return jsonify({'error': 'No hay un checkpoint para continuar este trabajo'}), 409
+
+    try:
+        _, queue_position, _ = submit_export_job(job.get('format', 'xlsx'), job_id=job_id)
+    except QueueFullError as e:
+        logger.warning("Reanudación rechazada: %s", str(e))
+        response = jsonify({
+            'success': False,
+            'error': 'Hay demasiados trabajos en espera. Intenta de nuevo en unos minutos.'
+        })
+        response.headers['Retry-After'] = '60'
+        return response, 503
+
+    # La exportación parcial anterior se reemplaza por la del trabajo reanudado
+    remove_file(job.get('filename'))
+    logger.info("Trabajo reanudado desde su checkpoint: %s", job_id)
+    return jsonify({'success': True, 'job_id': job_id, 'queue_position': queue_position, 'resumed': True})
 
 
 @app.route('/api/download/<job_id>')
 def download_file(job_id):
-    """Descargar archivo completado"""
+    """
+    Descargar archivo completado (o la exportación parcial de un trabajo cancelado en ejecución).
+    Responde 304 si el cliente ya tiene esa versión (If-None-Match) y 206 a peticiones Range.
+    """
     # Validar token del frontend
     if not validate_frontend_token(request):
         logger.warning("Intento de descarga no autorizado")
         return jsonify({'error': 'Token de acceso requerido'}), 401
     
-    if job_id not in job_results:
+    job = job_registry.get(job_id)
+    if job is None:
         return jsonify({'error': 'Trabajo no encontrado'}), 404
 
-    job = job_results[job_id]
-    if job['status'] != 'completed':
+    partial = job['status'] == 'cancelled' and bool(job.get('filename'))
+    if job['status'] != 'completed' and not partial:
         return jsonify({'error': 'Trabajo no completado'}), 400
 
+    if not os.path.exists(job['filename']):
+        return jsonify({'error': 'El archivo ya no está disponible. Genera la exportación de nuevo.'}), 410
+
+    export_format = job.get('format', 'xlsx')
     try:
-        return send_file(
+        return send_export(
             job['filename'],
-            as_attachment=True,
-            download_name='ccb_data.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            export_format,
+            job.get('etag'),
+            download_name=f"ccb_data{'_parcial' if partial else ''}{EXPORT_FORMATS[export_format]['extension']}"
         )
     except Exception as e:
         logger.error("Error al descargar archivo: %s", str(e))
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/profile/<profile_id>')
+def download_profile(profile_id):
+    """
+    Descargar el perfil de una exportación hecha con ?profile=1: trace de Chrome
+    (abrir en chrome://tracing o ui.perfetto.dev) o, con ?view=summary, el resumen por etapa.
+    """
+    if not validate_frontend_token(request):
+        logger.warning("Intento de acceso no autorizado al perfil")
+        return jsonify({'error': 'Token de acceso requerido'}), 401
+
+    filename = profile_path(profile_id)
+    if filename is None or not os.path.exists(filename):
+        return jsonify({'error': 'Perfil no encontrado (la exportación puede seguir en curso)'}), 404
+
+    if request.args.get('view') == 'summary':
+        with open(filename, 'r', encoding='utf-8') as f:
+            trace = json.load(f)
+        return jsonify({'profile_id': profile_id, 'stages': tracing.summarize(trace['traceEvents'])})
+
+    return send_file(filename, as_attachment=True, download_name=f'ccb_profile_{profile_id}.json',
+                     mimetype='application/json')
+
+
+# Retomar los trabajos que quedaron a medias si el servidor se reinició
+resume_interrupted_jobs()
+
 
 if __name__ == '__main__':
     logger.info("Iniciando aplicación Flask CCB Excel Generator")
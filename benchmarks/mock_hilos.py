@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita la API de Hilos para medir el rendimiento sin llamar
+a api.hilos.io. Responde flow-execution-contact (paginado con next, y en orden
+inverso con ordering=-created_on o -last_updated_on) y contact/<id> con
+contactos sintéticos deterministas, con latencia y errores 429 configurables.
+
+Uso independiente:
+    python benchmarks/mock_hilos.py --contacts 10000 --port 8765
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Any, List
+
+# Opciones de respuesta para las preguntas del flujo (valores típicos del bot)
+ANSWERS = {
+    'ccb_init': ['si'],
+    'ccb_adult': ['si', 'no'],
+    'ccb_question_1': ['si', 'no', 'tal_vez'],
+    'ccb_question_2': ['si', 'no', 'tal_vez'],
+    'ccb_question_3': ['trabajo', 'estudio', 'seguridad', 'costo_de_vida', 'otro'],
+    'ccb_question_4': ['otra_ciudad', 'otro_pais', 'municipio_cercano'],
+    'ccb_question_5': ['si', 'no', 'no_se'],
+    'ccb_question_6': ['inseguridad', 'movilidad', 'oportunidades', 'clima', 'otra'],
+    'ccb_question_7': ['cultura', 'gente', 'oportunidades', 'gastronomia', 'otro'],
+    'ccb_question_8': ['1', '2', '3', '4', '5'],
+    'ccb_question_8-1': ['1', '2', '3', '4', '5'],
+    'ccb_question_8-2': ['1', '2', '3', '4', '5'],
+    'ccb_question_11': ['mujer', 'hombre', 'no_binario', 'prefiero_no_decir'],
+    'ccb_question_12': ['localidad', 'municipio'],
+    'ccb_question_12-1': ['Chapinero', 'Suba', 'Kennedy', 'Usaquén', 'Engativá', 'Bosa'],
+    'ccb_question_13': ['bachillerato', 'tecnico', 'universitario', 'posgrado'],
+    'ccb_question_14': ['empleado', 'independiente', 'estudiante', 'desempleado'],
+    'ccb_question_15': ['familia', 'pareja', 'solo', 'amigos'],
+    'ccb_question_16': ['lgbtiq', 'afro', 'indigena', 'ninguna'],
+}
+
+# Fecha del primer registro del flujo; cada registro siguiente entra un minuto después
+FIRST_RECORD_AT = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+FREE_TEXT = ['Me gusta mucho la ciudad', 'Por la familia', 'No sé todavía', 'Quisiera conocer otros lugares',
+             'El transporte es complicado', 'Hay muchas oportunidades de trabajo']
+
+
+class MockHilosData:
+    def __init__(self, contacts: int = 1000, duplicate_rate: float = 0.1, seed: int = 42):
+        """
+        Datos sintéticos del flujo.
+
+        Args:
+            contacts: Número de contactos únicos
+            duplicate_rate: Fracción de registros del flujo que repiten un contacto anterior
+            seed: Semilla para que los datos sean iguales entre ejecuciones
+        """
+        self.contacts = contacts
+        self.duplicate_rate = min(max(duplicate_rate, 0.0), 0.95)
+        self.seed = seed
+
+        # Registros del flujo: cada contacto aparece una vez y los duplicados (re-entradas
+        # al flujo) repiten un contacto anterior, hasta llegar en promedio a duplicate_rate
+        rng = random.Random(seed)
+        self.records = []
+        for index in range(contacts):
+            self.records.append(index)
+            while rng.random() < self.duplicate_rate:
+                self.records.append(rng.randrange(0, index + 1))
+
+    def contact_id(self, index: int) -> str:
+        return f'00000000-0000-4000-8000-{index:012d}'
+
+    def flow_record(self, position: int) -> Dict[str, Any]:
+        """Registro de flow-execution-contact en la posición indicada"""
+        index = self.records[position]
+        created_on = (FIRST_RECORD_AT + timedelta(minutes=position)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return {
+            'id': f'fec-{position}',
+            'flow': 'bench-flow',
+            'status': 'COMPLETED',
+            'created_on': created_on,
+            'last_updated_on': created_on,
+            'contact': {
+                'id': self.contact_id(index),
+                'phone': f'+57300{index:07d}',
+                'first_name': f'Contacto {index}',
+                'last_updated_on': '2025-01-02T00:00:00Z'
+            }
+        }
+
+    def contact_detail(self, contact_id: str) -> Dict[str, Any]:
+        """Detalle de contacto con las respuestas en meta, como lo devuelve contact/<id>"""
+        index = int(contact_id.rsplit('-', 1)[-1])
+        rng = random.Random(self.seed * 1_000_003 + index)
+
+        meta = {}
+        for field, options in ANSWERS.items():
+            # Algunas preguntas se dejan sin responder, como en conversaciones abandonadas
+            if rng.random() < 0.9:
+                meta[field] = rng.choice(options)
+        meta['ccb_question_9'] = rng.choice(FREE_TEXT)
+        meta['ccb_question_10'] = str(rng.randint(18, 70))
+        if meta.get('ccb_question_3') == 'otro':
+            meta['ccb_otro_question_3'] = rng.choice(FREE_TEXT)
+        if meta.get('ccb_question_4') == 'otro_pais':
+            meta['ccb_pais_question_4'] = rng.choice(['España', 'Canadá', 'Chile', 'México'])
+        if meta.get('ccb_question_6') == 'otra':
+            meta['ccb_otro_question_6'] = rng.choice(FREE_TEXT)
+        # Variables del bot que no forman parte de la exportación
+        meta['last_node'] = f'node_{rng.randint(1, 60)}'
+        meta['utm_source'] = rng.choice(['whatsapp', 'instagram', 'facebook'])
+
+        return {
+            'id': contact_id,
+            'phone': f'+57300{index:07d}',
+            'first_name': f'Contacto {index}',
+            'last_name': '',
+            'email': None,
+            'created_on': '2025-01-01T00:00:00Z',
+            'last_updated_on': '2025-01-02T00:00:00Z',
+            'tags': [{'name': 'ccb'}],
+            'default_assignee': None,
+            'meta': meta
+        }
+
+
+class MockHilosServer:
+    def __init__(self, data: MockHilosData, page_size: int = 100, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, retry_after: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        Servidor HTTP con los endpoints de Hilos usados por el extractor.
+
+        Args:
+            data: Datos sintéticos del flujo
+            page_size: Registros por página de flow-execution-contact
+            latency: Segundos de espera por petición
+            jitter: Segundos aleatorios adicionales (0..jitter) por petición
+            error_rate: Probabilidad de responder 429 a una petición
+            retry_after: Valor del encabezado Retry-After en las respuestas 429
+            host: Dirección de escucha
+            port: Puerto (0 = uno libre)
+        """
+        self.data = data
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.stats = {'requests': 0, 'page_requests': 0, 'contact_requests': 0, 'throttled': 0}
+        self._lock = threading.Lock()
+        self._rng = random.Random(data.seed)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def start(self) -> 'MockHilosServer':
+        """Atender peticiones en un hilo de fondo"""
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Encabezados y cuerpo salen en escrituras separadas: con Nagle y el ACK retrasado,
+            # cada respuesta en una conexión keep-alive se demoraría ~40 ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        return Handler
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        url = urlparse(handler.path)
+        path = url.path.rstrip('/')
+
+        if path == '/__stats':
+            with self._lock:
+                return self._send(handler, 200, dict(self.stats))
+
+        with self._lock:
+            self.stats['requests'] += 1
+            throttled = self.error_rate and self._rng.random() < self.error_rate
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        if throttled:
+            with self._lock:
+                self.stats['throttled'] += 1
+            return self._send(handler, 429, {'detail': 'Request was throttled.'},
+                              {'Retry-After': f'{self.retry_after:g}'})
+
+        if path.endswith('/flow-execution-contact'):
+            with self._lock:
+                self.stats['page_requests'] += 1
+            return self._send(handler, 200, self._page(handler, parse_qs(url.query)))
+
+        if '/contact/' in path:
+            with self._lock:
+                self.stats['contact_requests'] += 1
+            return self._send(handler, 200, self.data.contact_detail(path.rsplit('/', 1)[-1]))
+
+        self._send(handler, 404, {'detail': 'Not found.'})
+
+    def _page(self, handler: BaseHTTPRequestHandler, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        page = int(query.get('page', ['1'])[0])
+        flow = query.get('flow', [''])[0]
+        ordering = query.get('ordering', [''])[0]
+        # Los registros entran en orden cronológico: ordenar por fecha descendente es invertirlos
+        descending = ordering in ('-created_on', '-last_updated_on')
+        total = len(self.data.records)
+        start = (page - 1) * self.page_size
+        end = min(start + self.page_size, total)
+
+        host, port = self.httpd.server_address[:2]
+        link = f'http://{host}:{port}/api/flow-execution-contact?flow={flow}'
+        if ordering:
+            link += f'&ordering={ordering}'
+        positions = range(start, end)
+        if descending:
+            positions = [total - 1 - position for position in positions]
+        return {
+            'count': total,
+            'next': f'{link}&page={page + 1}' if end < total else None,
+            'previous': f'{link}&page={page - 1}' if page > 1 else None,
+            'results': [self.data.flow_record(position) for position in positions]
+        }
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+        payload = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de Hilos")
+    parser.add_argument('--contacts', type=int, default=1000, help="Contactos únicos (por defecto: 1000)")
+    parser.add_argument('--duplicate-rate', type=float, default=0.1, help="Fracción de registros duplicados")
+    parser.add_argument('--page-size', type=int, default=100, help="Registros por página")
+    parser.add_argument('--latency', type=float, default=0.0, help="Segundos de latencia por petición")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Latencia aleatoria adicional máxima")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probabilidad de responder 429")
+    parser.add_argument('--retry-after', type=float, default=0.0, help="Retry-After de las respuestas 429")
+    parser.add_argument('--seed', type=int, default=42, help="Semilla de los datos sintéticos")
+    parser.add_argument('--port', type=int, default=8765, help="Puerto de escucha")
+    args = parser.parse_args()
+
+    data = MockHilosData(args.contacts, args.duplicate_rate, args.seed)
+    server = MockHilosServer(data, page_size=args.page_size, latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate, retry_after=args.retry_after, port=args.port)
+    print(f"API simulada de Hilos en {server.base_url} ({len(data.records)} registros, {args.contacts} contactos únicos)")
+    print(f"Usar con: HILOS_API_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
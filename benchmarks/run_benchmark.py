@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Benchmark de CCBDataExtractor.run contra la API simulada de Hilos (mock_hilos.py).
+Mide el rendimiento de extremo a extremo, la duración de cada fase y la memoria
+máxima (RSS) para comparar cada cambio de rendimiento con una línea base.
+
+Cada tamaño se ejecuta en procesos nuevos (servidor y extractor por separado),
+para que la memoria y la CPU medidas sean solo las del extractor.
+
+Uso:
+    python benchmarks/run_benchmark.py --contacts 1k 10k --latency 0.02 --output resultados.json
+    python benchmarks/run_benchmark.py --contacts 10k --baseline resultados.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_hilos import MockHilosData, MockHilosServer
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000}
+
+
+def parse_size(value: str) -> int:
+    """Convertir 1k/10k/100k (o un número) en número de contactos"""
+    if value.lower() in SIZES:
+        return SIZES[value.lower()]
+    return int(value)
+
+
+def _serve(config: Dict[str, Any], ready: multiprocessing.Queue):
+    """Proceso del servidor simulado: publica su URL en ready y atiende hasta que lo terminen"""
+    data = MockHilosData(config['contacts'], config['duplicate_rate'], config['seed'])
+    server = MockHilosServer(data, page_size=config['page_size'], latency=config['latency'],
+                             jitter=config['jitter'], error_rate=config['error_rate'],
+                             retry_after=config['retry_after'])
+    ready.put(server.base_url)
+    server.serve_forever()
+
+
+def _peak_rss_mb() -> float:
+    """Memoria máxima del proceso actual en MB (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(config: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    """
+    Ejecutar CCBDataExtractor.run una vez (en un proceso hijo).
+
+    Args:
+        config: Parámetros del caso
+        base_url: URL de la API simulada
+
+    Returns:
+        Resultados medidos
+    """
+    os.environ['HILOS_API_BASE_URL'] = base_url
+    os.environ['CCB_CONTACT_STORE'] = config['contact_store'] or ''
+    os.environ['CCB_STREAMING_WRITER'] = '1' if config['streaming_writer'] else '0'
+    if config['rate_limit'] is not None:
+        os.environ['HILOS_RATE_LIMIT'] = str(config['rate_limit'])
+    if config['rate_max'] is not None:
+        os.environ['HILOS_RATE_MAX'] = str(config['rate_max'])
+    os.chdir(REPO_DIR)
+
+    import logging
+    import ccb
+    import metrics
+    logging.getLogger().setLevel(config['log_level'])
+
+    extractor = ccb.CCBDataExtractor(auth_token='benchmark', flow_id='benchmark-flow',
+                                     max_workers=config['workers'])
+    rss_before = _peak_rss_mb()
+
+    with tempfile.TemporaryDirectory(prefix='ccb_benchmark_') as directory:
+        output = os.path.join(directory, f"benchmark{ccb.EXPORT_FORMATS[config['format']]['extension']}")
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        extractor.run(output, export_format=config['format'])
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        file_size = os.path.getsize(output) if os.path.exists(output) else 0
+
+    def phase(name):
+        count, total = metrics.PHASE_DURATION.summary(phase=name)
+        return round(total, 3) if count else None
+
+    stats = extractor.last_run_stats
+    rows = extractor.last_export_count
+    return {
+        'elapsed_seconds': round(elapsed, 3),
+        'cpu_seconds': round(cpu, 3),
+        'rows_written': rows,
+        'rows_per_second': round(rows / elapsed, 2) if elapsed else 0.0,
+        'flow_records': stats.get('total_contacts', 0),
+        'unique_contacts': stats.get('unique_contacts', 0),
+        'cached_contacts': stats.get('cached_contacts', 0),
+        'failed_contacts': stats.get('failed_contacts', 0),
+        'retries': int(metrics.HILOS_RETRIES.total()),
+        'rate_limit_wait_seconds': round(metrics.HILOS_RATE_LIMIT_WAIT.total(), 3),
+        'final_rate_limit': round(extractor.rate_limiter.rate, 2),
+        'phases': {
+            'pagination': phase('pagination'),
+            'process_contacts': phase('process_contacts'),
+            'retry': phase('retry'),
+            'export': phase(f"export_{config['format']}")
+        },
+        'file_bytes': file_size,
+        'rss_before_run_mb': round(rss_before, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1)
+    }
+
+
+def run_benchmark(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Levantar la API simulada y medir un caso en procesos independientes.
+
+    Args:
+        config: Parámetros del caso (contactos, duplicados, latencia, ...)
+
+    Returns:
+        Configuración y resultados del caso, con las peticiones vistas por el servidor
+    """
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(config, ready), daemon=True)
+    server.start()
+    try:
+        base_url = ready.get(timeout=120)
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_case, config, base_url).result()
+        with urllib.request.urlopen(f"{base_url.rsplit('/api', 1)[0]}/__stats", timeout=10) as response:
+            result['server'] = json.load(response)
+    finally:
+        server.terminate()
+        server.join()
+
+    return {'config': config, 'result': result}
+
+
+def print_report(results: List[Dict[str, Any]], baseline: Optional[List[Dict[str, Any]]] = None):
+    """Mostrar una tabla con los resultados (y la variación respecto a la línea base)"""
+    baseline_by_contacts = {item['config']['contacts']: item['result'] for item in baseline or []}
+
+    header = (f"{'contactos':>10} {'registros':>10} {'filas':>8} {'tiempo(s)':>10} {'filas/s':>9} "
+              f"{'paginar(s)':>10} {'procesar(s)':>11} {'exportar(s)':>11} {'reint.':>7} {'RSS(MB)':>8}")
+    print(header)
+    print('-' * len(header))
+    for item in results:
+        contacts = item['config']['contacts']
+        result = item['result']
+        phases = result['phases']
+        print(f"{contacts:>10} {result['flow_records']:>10} {result['rows_written']:>8} "
+              f"{result['elapsed_seconds']:>10.2f} {result['rows_per_second']:>9.1f} "
+              f"{phases['pagination'] or 0:>10.2f} {phases['process_contacts'] or 0:>11.2f} "
+              f"{phases['export'] or 0:>11.2f} {result['retries']:>7} {result['peak_rss_mb']:>8.1f}")
+
+        previous = baseline_by_contacts.get(contacts)
+        if previous:
+            def change(key):
+                before, after = previous[key], result[key]
+                return f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+            print(f"{'':>10} vs. línea base: tiempo {change('elapsed_seconds')}, "
+                  f"filas/s {change('rows_per_second')}, RSS {change('peak_rss_mb')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la exportación contra una API de Hilos simulada")
+    parser.add_argument('--contacts', nargs='+', default=['1k'],
+                        help="Contactos únicos por caso: 1k, 10k, 100k o un número (por defecto: 1k)")
+    parser.add_argument('--duplicate-rate', type=float, default=0.1,
+                        help="Fracción de registros del flujo duplicados (por defecto: 0.1)")
+    parser.add_argument('--page-size', type=int, default=100, help="Registros por página (por defecto: 100)")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="Segundos de latencia por petición (por defecto: 0.02)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Latencia aleatoria adicional máxima")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Probabilidad de que la API responda 429 (por defecto: 0)")
+    parser.add_argument('--retry-after', type=float, default=0.0, help="Retry-After de las respuestas 429")
+    parser.add_argument('--workers', type=int, default=None, help="Hilos del extractor (por defecto: HILOS_MAX_WORKERS)")
+    parser.add_argument('--format', dest='export_format', default='xlsx',
+                        choices=['xlsx', 'csv', 'ndjson', 'parquet'], help="Formato de salida (por defecto: xlsx)")
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help="Peticiones por segundo iniciales del límite adaptativo (por defecto: HILOS_RATE_LIMIT)")
+    parser.add_argument('--rate-max', type=float, default=None,
+                        help="Tasa máxima del límite adaptativo, 0 = sin máximo (por defecto: HILOS_RATE_MAX)")
+    parser.add_argument('--pandas-writer', action='store_true', help="Escribir el Excel con pandas (CCB_STREAMING_WRITER=0)")
+    parser.add_argument('--contact-store', default=None,
+                        help="Archivo del almacén local de contactos (por defecto: sin almacén)")
+    parser.add_argument('--seed', type=int, default=42, help="Semilla de los datos sintéticos")
+    parser.add_argument('--log-level', default='WARNING', help="Nivel de logging del extractor (por defecto: WARNING)")
+    parser.add_argument('--output', help="Guardar los resultados en este archivo JSON")
+    parser.add_argument('--baseline', help="Comparar con los resultados de un JSON anterior")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.contacts:
+        config = {
+            'contacts': parse_size(size),
+            'duplicate_rate': args.duplicate_rate,
+            'page_size': args.page_size,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate,
+            'retry_after': args.retry_after,
+            'workers': args.workers,
+            'format': args.export_format,
+            'streaming_writer': not args.pandas_writer,
+            'rate_limit': args.rate_limit,
+            'rate_max': args.rate_max,
+            'contact_store': args.contact_store,
+            'seed': args.seed,
+            'log_level': args.log_level.upper()
+        }
+        print(f"Ejecutando caso de {config['contacts']} contactos...", file=sys.stderr)
+        results.append(run_benchmark(config))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+        print(f"Resultados guardados en {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
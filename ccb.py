@@ -4,388 +4,2026 @@ Script para obtener datos de usuarios que han pasado por un flujo específico
 y generar un archivo Excel con la información requerida.
 """
 
+import argparse
+import base64
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from openpyxl import Workbook
+import csv
+import hashlib
+import importlib.util
+import io
 import json
+import math
+import os
+import random
+import re
+import threading
 import time
-from typing import List, Dict, Any
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs, urlencode
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Callable, Sequence, Union
 import logging
 
+from checkpoints import CheckpointStore, ExportCheckpoint
+from contact_store import ContactStore
+from rate_limiter import AdaptiveRateLimiter, get_rate_limiter
+import metrics
+import tracing
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class CCBDataExtractor:
-    def __init__(self, auth_token: str = None, flow_id: str = None):
+# Formatos de exportación soportados: extensión del archivo y tipo MIME
+EXPORT_FORMATS = {
+    'xlsx': {'extension': '.xlsx', 'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'},
+    'csv': {'extension': '.csv', 'mimetype': 'text/csv'},
+    'ndjson': {'extension': '.ndjson.gz', 'mimetype': 'application/gzip'},
+    'parquet': {'extension': '.parquet', 'mimetype': 'application/vnd.apache.parquet', 'requires': 'pyarrow'},
+}
+
+
+def export_format_error(export_format: str) -> Optional[str]:
+    """
+    Comprobar si se puede exportar en un formato: que esté soportado y que su
+    dependencia opcional (requires en EXPORT_FORMATS) esté instalada.
+    
+    Args:
+        export_format: Formato solicitado
+        
+    Returns:
+        Mensaje de error, o None si el formato está disponible
+    """
+    if export_format not in EXPORT_FORMATS:
+        return f"Formato no soportado: {export_format}. Usa uno de: {', '.join(EXPORT_FORMATS)}"
+    requirement = EXPORT_FORMATS[export_format].get('requires')
+    if requirement and importlib.util.find_spec(requirement) is None:
+        return f"El formato {export_format} requiere {requirement}. Instálalo con: pip install {requirement}"
+    return None
+
+# Fila de datos: valores en el orden de required_columns (como las produce el proceso)
+# o, por compatibilidad, un diccionario columna -> valor
+Row = Union[Sequence[Any], Dict[str, Any]]
+
+# Códigos HTTP que se reintentan con backoff exponencial
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Orden del listado del flujo en las exportaciones delta: los registros modificados más recientemente primero
+DELTA_ORDERING = '-last_updated_on'
+
+def _excel_value(value: Any) -> Any:
+    """Convertir valores no escalares (listas, diccionarios) a texto, igual que pandas al exportar"""
+    if isinstance(value, (list, dict, tuple, set)):
+        return str(value)
+    return value
+
+
+def file_digest(filename: str) -> str:
+    """SHA-256 del contenido de un archivo (validador de los bytes exactos que se envían)"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Convertir una fecha ISO 8601 de la API (con Z o sin zona, en UTC) a datetime, o None si no es válida"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _record_timestamp(record: Dict[str, Any]) -> Optional[datetime]:
+    """Fecha de la última modificación de un registro de flow-execution-contact (o de su creación)"""
+    return _parse_timestamp(record.get('last_updated_on') or record.get('created_on'))
+
+
+def encode_delta_cursor(flow_id: str, since: Optional[datetime], record_ids: Iterable[str] = ()) -> str:
+    """
+    Generar el cursor de una exportación delta.
+    
+    Args:
+        flow_id: ID del flujo al que pertenece el cursor
+        since: Fecha del registro más reciente entregado (None = todavía no se entregó ninguno)
+        record_ids: IDs de los registros entregados con exactamente esa fecha
+        
+    Returns:
+        Cursor opaco (base64 URL-safe)
+    """
+    state = {
+        'flow': flow_id,
+        'since': since.isoformat() if since else None,
+        'ids': sorted(str(record_id) for record_id in record_ids)
+    }
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_delta_cursor(value: Optional[str], flow_id: str) -> Tuple[Optional[datetime], set]:
+    """
+    Interpretar el parámetro since de una exportación delta.
+    
+    Args:
+        value: Cursor devuelto por una exportación delta anterior, fecha ISO 8601 o None
+        flow_id: ID del flujo que se está exportando
+        
+    Returns:
+        Tupla (fecha desde la que entregar registros o None para todos, IDs ya entregados con esa fecha)
+        
+    Raises:
+        ValueError: Si el valor no es un cursor ni una fecha válida, o el cursor es de otro flujo
+    """
+    if not value:
+        return None, set()
+    
+    since = _parse_timestamp(value)
+    if since is not None:
+        return since, set()
+    
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        since = _parse_timestamp(state['since']) if state['since'] else None
+        record_ids = set(state['ids'])
+        cursor_flow = state['flow']
+    except (ValueError, TypeError, KeyError, UnicodeEncodeError):
+        raise ValueError(f"Cursor no válido: {value}")
+    if cursor_flow != flow_id:
+        raise ValueError(f"El cursor pertenece a otro flujo ({cursor_flow})")
+    return since, record_ids
+
+
+class DuplicateTracker:
+    """
+    Acumulador incremental de duplicados en los contactos de un flujo.
+    Permite calcular las mismas estadísticas que analyze_duplicates sin
+    tener que guardar en memoria la lista completa de contactos.
+    """
+
+    def __init__(self):
+        self.total_contacts = 0
+        self.duplicate_instances = 0
+        self.contact_counts = {}
+        self.duplicate_details = {}
+
+    def add(self, contact: Dict[str, Any]) -> Optional[str]:
+        """
+        Registrar un contacto del flujo.
+        
+        Args:
+            contact: Registro de flow-execution-contact
+            
+        Returns:
+            El ID del contacto si es la primera vez que aparece, None si es
+            un duplicado o no tiene ID válido
+        """
+        self.total_contacts += 1
+        contact_info = contact.get('contact', {})
+        contact_id = contact_info.get('id')
+        
+        if not contact_id:
+            return None
+        
+        if contact_id in self.contact_counts:
+            self.contact_counts[contact_id] += 1
+            self.duplicate_instances += 1
+            self.duplicate_details.setdefault(contact_id, []).append(contact.get('id', 'N/A'))
+            return None
+        
+        self.contact_counts[contact_id] = 1
+        return contact_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Estado del acumulador serializable en JSON (para los checkpoints)
+        """
+        return {
+            'total_contacts': self.total_contacts,
+            'duplicate_instances': self.duplicate_instances,
+            'contact_counts': dict(self.contact_counts),
+            'duplicate_details': {contact_id: list(ids) for contact_id, ids in self.duplicate_details.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'DuplicateTracker':
+        """Reconstruir un acumulador guardado con to_dict"""
+        tracker = cls()
+        tracker.total_contacts = state['total_contacts']
+        tracker.duplicate_instances = state['duplicate_instances']
+        tracker.contact_counts = dict(state['contact_counts'])
+        tracker.duplicate_details = {contact_id: list(ids) for contact_id, ids in state['duplicate_details'].items()}
+        return tracker
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Diccionario con estadísticas de duplicados
+        """
+        return {
+            'total_contacts': self.total_contacts,
+            'unique_contacts': len(self.contact_counts),
+            'duplicate_contacts': len(self.duplicate_details),
+            'total_duplicate_instances': self.duplicate_instances,
+            'duplicate_details': self.duplicate_details
+        }
+
+
+class ExtractionPlan:
+    """
+    Plan de extracción de campos compilado una sola vez a partir de las columnas requeridas.
+    
+    Recorre cada estructura del detalle de un contacto una sola vez, buscando sus claves
+    en un índice de columnas, en lugar de revisar cada columna contra cada estructura.
+    Conserva la misma precedencia de búsqueda:
+    
+    1. phone desde el nivel raíz.
+    2. El primer valor no vacío en el nivel raíz y luego en fields, custom_fields,
+       responses, data, attributes y meta (solo si son diccionarios).
+    3. Para los campos aún vacíos, los diccionarios dentro de listas del nivel raíz.
+    4. Para los campos aún vacíos, el campo meta.
+    """
+
+    SEARCH_LOCATIONS = ('fields', 'custom_fields', 'responses', 'data', 'attributes', 'meta')
+
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        # Posición fija de cada columna en la lista de valores de una fila
+        self.slots = {column: slot for slot, column in enumerate(self.columns)}
+        self.phone_slot = self.slots.get('phone')
+        self.search_columns = frozenset(self.columns) - {'phone'}
+
+    def extract(self, contact_details: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extraer los campos requeridos de los detalles de un contacto.
+        
+        Args:
+            contact_details: Información completa del contacto
+            
+        Returns:
+            Diccionario con los campos requeridos (vacíos si no se encontraron)
+        """
+        return dict(zip(self.columns, self.extract_values(contact_details)))
+
+    def extract_values(self, contact_details: Dict[str, Any]) -> List[Any]:
+        """
+        Extraer los campos requeridos como una lista de valores en el orden de las columnas,
+        sin crear un diccionario por contacto.
+        
+        Args:
+            contact_details: Información completa del contacto
+            
+        Returns:
+            Lista de valores (vacíos si no se encontraron)
+        """
+        slots = self.slots
+        values = [''] * len(self.columns)
+        if self.phone_slot is not None:
+            values[self.phone_slot] = contact_details.get('phone', '')
+        
+        # Primer valor no vacío según el orden de las ubicaciones de búsqueda
+        pending = set(self.search_columns)
+        locations = [contact_details]
+        locations.extend(contact_details.get(key, {}) for key in self.SEARCH_LOCATIONS)
+        for location in locations:
+            if not pending:
+                break
+            if not isinstance(location, dict):
+                continue
+            
+            found = [key for key, value in location.items() if value and key in pending]
+            for key in found:
+                values[slots[key]] = location[key]
+            pending.difference_update(found)
+        
+        # Diccionarios dentro de listas del nivel raíz, solo para campos aún vacíos
+        for value in contact_details.values():
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict):
+                        self._fill_empty(values, item)
+        
+        # Campo meta, solo para campos aún vacíos
+        meta_data = contact_details.get('meta', {})
+        if isinstance(meta_data, dict):
+            self._fill_empty(values, meta_data)
+        
+        return values
+
+    def _fill_empty(self, values: List[Any], source: Dict[str, Any]):
+        """Copiar de source las columnas requeridas que aún no tienen valor"""
+        slots = self.slots
+        for key, value in source.items():
+            slot = slots.get(key)
+            if slot is not None and not values[slot]:
+                values[slot] = value
+
+
+class ColumnarBuffer:
+    """
+    Filas extraídas guardadas por columnas (una lista por columna) para las exportaciones
+    que necesitan todas las filas en memoria: el resultado de get_changed_contacts y el
+    DataFrame del escritor con pandas, que se construye desde estas listas sin pasar por
+    un diccionario por fila.
+
+    La exportación en streaming no las usa: cada contacto se extrae como una lista de
+    valores (ExtractionPlan.extract_values) que recorre el almacén local, el dataset y los
+    escritores fila a fila.
+    """
+
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        self.data = [[] for _ in self.columns]
+
+    def append(self, values: List[Any]):
+        """Agregar una fila (valores en el orden de las columnas)"""
+        for column, value in zip(self.data, values):
+            column.append(value)
+
+    def extend(self, rows: Iterable[List[Any]]):
+        """Agregar varias filas"""
+        for values in rows:
+            self.append(values)
+
+    def __len__(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        """Recorrer las filas como tuplas de valores en el orden de las columnas"""
+        return zip(*self.data)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns:
+            DataFrame de pandas construido directamente desde las listas de cada columna
+        """
+        return pd.DataFrame(dict(zip(self.columns, self.data)), columns=self.columns)
+
+
+class CCBDataExtractor:
+    def __init__(self, auth_token: str = None, flow_id: str = None, max_workers: int = None,
+                 store: ContactStore = None, progress_callback: Callable[[Dict[str, Any]], None] = None,
+                 tracer: 'tracing.Tracer' = None, rate_limiter: AdaptiveRateLimiter = None,
+                 columns: List[str] = None):
+        """
+        Inicializar el extractor con el token de autorización.
+        
+        Args:
+            auth_token: Token de autorización para la API (opcional, usa env var si no se proporciona)
+            flow_id: ID del flujo específico (opcional, usa env var si no se proporciona)
+            max_workers: Número de hilos para obtener detalles de contactos en paralelo
+                         (opcional, usa HILOS_MAX_WORKERS; 1 = modo secuencial)
+            store: Almacén local de contactos para exportaciones incrementales
+                   (opcional, usa CCB_CONTACT_STORE; vacío = sin almacén)
+            progress_callback: Función que recibe el progreso (ver get_progress) a medida que
+                               avanza el proceso, como máximo una vez por segundo (opcional)
+            tracer: tracing.Tracer que registra la duración de cada etapa (opcional, solo al perfilar)
+            rate_limiter: Límite de peticiones a la API (opcional, por defecto el compartido por
+                          todo el proceso, ver rate_limiter.get_rate_limiter)
+            columns: Subconjunto de las columnas requeridas a extraer y exportar, en ese orden
+                     (opcional, por defecto todas)
+            
+        Raises:
+            ValueError: Si falta el token o alguna de las columnas no es una columna requerida
+        """
+        # Usar variables de entorno si no se proporcionan parámetros
+        self.auth_token = auth_token or os.getenv('HILOS_API_TOKEN')
+        self.flow_id = flow_id or os.getenv('HILOS_FLOW_ID', '0684111b-3948-7ce2-8000-b20bbb1bd564')
+        
+        if not self.auth_token:
+            raise ValueError("HILOS_API_TOKEN es requerido. Configúralo como variable de entorno o pásalo como parámetro.")
+        
+        self.max_workers = max(1, int(max_workers or os.getenv('HILOS_MAX_WORKERS', '4')))
+        
+        # Paginación: páginas que se piden en paralelo
+        self.page_workers = max(1, int(os.getenv('HILOS_PAGE_WORKERS', '4')))
+        
+        # Ritmo de peticiones (páginas y contactos), compartido con los demás extractores del proceso
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        
+        self.base_url = os.getenv('HILOS_API_BASE_URL', 'https://api.hilos.io/api').rstrip('/')
+        self.headers = {
+            'Authorization': f'Token {self.auth_token}',
+            'Content-Type': 'application/json'
+        }
+        
+        # Configuración de reintentos para errores transitorios (429/5xx)
+        self.max_retries = int(os.getenv('HILOS_MAX_RETRIES', '4'))
+        self.backoff_base = float(os.getenv('HILOS_BACKOFF_BASE', '0.5'))
+        self.backoff_max = 30.0
+        self.request_timeout = 30
+        
+        # Sesión HTTP compartida: reutiliza conexiones keep-alive entre peticiones
+        self.session = self.create_session()
+        
+        # Almacén local: evita volver a pedir contactos que no han cambiado
+        if store is None and os.getenv('CCB_CONTACT_STORE', 'ccb_contacts.db'):
+            store = ContactStore(
+                os.getenv('CCB_CONTACT_STORE', 'ccb_contacts.db'),
+                max_age=float(os.getenv('CCB_CONTACT_STORE_MAX_AGE', '86400'))
+            )
+        self.store = store
+        
+        # Columnas requeridas para el Excel
+        self.required_columns = [
+            'phone', 'ccb_init', 'ccb_adult', 'ccb_question_1', 'ccb_question_2', 'ccb_question_3', 
+            'ccb_otro_question_3', 'ccb_question_4', 'ccb_pais_question_4', 'ccb_otra_question_4',
+            'ccb_question_5', 'ccb_question_6', 'ccb_otro_question_6', 'ccb_question_6-1', 
+            'ccb_otro_question_6-1', 'ccb_question_7', 'ccb_otro_question_7', 'ccb_question_7-1',
+            'ccb_other_question_7-1', 'ccb_question_8', 'ccb_question_8-1', 'ccb_question_8-2',
+            'ccb_question_9', 'ccb_question_10', 'ccb_question_11', 'ccb_gender_question_11',
+            'ccb_question_12', 'ccb_question_12-1', 'ccb_otro_question_12-1', 'ccb_question_12-2',
+            'ccb_cual_question_12-2', 'ccb_question_13', 'ccb_question_14', 'ccb_cual_question_14',
+            'ccb_question_15', 'ccb_cual_question_15', 'ccb_question_16', 'ccb_cual_question_16'
+        ]
+        # El almacén local guarda las filas con todas las columnas; un subconjunto se proyecta al leerlas
+        self.stored_columns = list(self.required_columns)
+        if columns:
+            unknown = [col for col in columns if col not in self.required_columns]
+            if unknown:
+                raise ValueError(f"Columnas no soportadas: {', '.join(unknown)}")
+            self.required_columns = list(dict.fromkeys(columns))
+        
+        # Cargar mapeo de campos a encabezados
+        self.field_mapping = self.load_field_mapping()
+        
+        # Plan de extracción precalculado a partir de las columnas requeridas
+        self.extraction_plan = ExtractionPlan(self.required_columns)
+        self.stored_plan = (self.extraction_plan if self.stored_columns == self.required_columns
+                            else ExtractionPlan(self.stored_columns))
+        # Posición de cada columna requerida en una fila guardada
+        self.stored_slots = [self.stored_columns.index(col) for col in self.required_columns]
+        
+        # Escritura del Excel fila a fila (memoria constante) en lugar de un DataFrame completo
+        self.streaming_writer = os.getenv('CCB_STREAMING_WRITER', '1') != '0'
+        
+        # Estado de la última ejecución (se actualiza durante el streaming)
+        self.flow_total_count = 0
+        self.cached_count = 0
+        self.last_run_stats = {}
+        self.last_batch_stats = {}
+        self.last_export_count = 0
+        self.last_export_digest = None
+        self._lock = threading.Lock()
+        
+        # Cancelación cooperativa de la ejecución en curso (ver cancel)
+        self._cancel_event = threading.Event()
+        
+        # Enlace next de la última página entregada por iter_flow_execution_pages
+        self.next_page_url = None
+        
+        # Progreso estructurado de la ejecución en curso
+        self.progress_callback = progress_callback
+        self._progress = {}
+        self._progress_started_at = time.time()
+        self._progress_published_at = 0.0
+        
+        # Perfilado por etapas (desactivado salvo que se pase un tracing.Tracer)
+        self.tracer = tracer if tracer is not None else tracing.NULL_TRACER
+
+    def create_session(self) -> requests.Session:
+        """
+        Crear una sesión HTTP con un pool de conexiones dimensionado según el
+        número de hilos, para no repetir el handshake TCP+TLS en cada contacto.
+        
+        Returns:
+            Sesión de requests configurada con los encabezados de la API
+        """
+        session = requests.Session()
+        session.headers.update(self.headers)
+        
+        # Los reintentos se gestionan en _get para poder respetar Retry-After y aplicar jitter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers + self.page_workers + 2,
+                              max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """
+        Calcular la espera antes de un reintento.
+        Usa el encabezado Retry-After si la API lo envía; si no, backoff exponencial con jitter.
+        
+        Args:
+            attempt: Número de intento fallido (empezando en 0)
+            response: Respuesta recibida, si la hubo
+            
+        Returns:
+            Segundos a esperar
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return min(self.backoff_max, max(0.0, retry_at.timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _get(self, url: str, params: Dict[str, Any] = None) -> requests.Response:
+        """
+        Hacer una petición GET a la API reintentando errores de conexión, 429 y 5xx.
+        
+        Args:
+            url: URL a consultar
+            params: Parámetros de la consulta (opcional)
+            
+        Returns:
+            Respuesta exitosa de la API
+            
+        Raises:
+            requests.exceptions.RequestException: Si la petición falla tras agotar los reintentos
+        """
+        endpoint = self._endpoint_label(url)
+        
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            
+            # Esperar el turno en el límite de peticiones compartido
+            wait = self.rate_limiter.reserve()
+            if wait:
+                metrics.HILOS_RATE_LIMIT_WAIT.inc(wait)
+                with self.tracer.span('sleep', 'wait'):
+                    time.sleep(wait)
+            
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.request_timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                elapsed = time.perf_counter() - started
+                metrics.HILOS_REQUEST_DURATION.observe(elapsed, endpoint=endpoint)
+                metrics.HILOS_REQUESTS.inc(endpoint=endpoint, status=type(e).__name__)
+                self.rate_limiter.record(None, elapsed)
+                if is_last_attempt:
+                    raise
+                metrics.HILOS_RETRIES.inc(endpoint=endpoint, reason='connection')
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Error de conexión en {url}: {e}. Reintentando en {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            
+            elapsed = time.perf_counter() - started
+            metrics.HILOS_REQUEST_DURATION.observe(elapsed, endpoint=endpoint)
+            metrics.HILOS_REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+            
+            delay = self._retry_delay(attempt, response) if response.status_code in RETRY_STATUS_CODES else 0.0
+            # Un Retry-After pausa todas las peticiones que compartan el límite, no solo esta
+            self.rate_limiter.record(response.status_code, elapsed,
+                                     retry_after=delay if response.headers.get('Retry-After') else 0.0)
+            
+            if response.status_code in RETRY_STATUS_CODES and not is_last_attempt:
+                metrics.HILOS_RETRIES.inc(endpoint=endpoint, reason=str(response.status_code))
+                logger.warning(f"Respuesta {response.status_code} en {url}. Reintentando en {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            
+            response.raise_for_status()
+            return response
+
+    def _endpoint_label(self, url: str) -> str:
+        """
+        Nombre del endpoint de Hilos para las métricas, sin IDs ni parámetros
+        (por ejemplo 'contact/<id>'), para no crear una serie por contacto.
+        
+        Args:
+            url: URL consultada
+            
+        Returns:
+            Etiqueta del endpoint
+        """
+        segments = [segment for segment in urlparse(url).path.split('/') if segment and segment != 'api']
+        if not segments:
+            return 'other'
+        if segments[0] == 'contact' and len(segments) > 1:
+            return 'contact/<id>'
+        return segments[0]
+
+    def load_field_mapping(self) -> Dict[str, str]:
+        """
+        Cargar el mapeo de campos a encabezados desde el archivo campos.json.
+        
+        Returns:
+            Diccionario con el mapeo de campo -> encabezado
+        """
+        try:
+            with open('campos.json', 'r', encoding='utf-8') as f:
+                mapping = json.load(f)
+            logger.info(f"Cargado mapeo de campos: {len(mapping)} entradas")
+            return mapping
+        except FileNotFoundError:
+            logger.error("Archivo campos.json no encontrado")
+            return {}
+        except json.JSONDecodeError as e:
+            logger.error(f"Error al parsear campos.json: {e}")
+            return {}
+
+    def _reset_progress(self):
+        """Reiniciar los contadores de progreso al comenzar una ejecución"""
+        with self._lock:
+            self._progress_started_at = time.time()
+            self._progress_published_at = 0.0
+            self._progress = {
+                'phase': 'pagination',
+                'pages_fetched': 0,
+                'total_pages': None,
+                'total_records': None,
+                'records_seen': 0,
+                'unique_contacts': 0,
+                'processed_contacts': 0,
+                'duplicates_skipped': 0,
+                'cached_contacts': 0,
+                'failed_contacts': 0,
+                'pagination_complete': False
+            }
+
+    def _update_progress(self, force: bool = False, **fields):
+        """
+        Actualizar los contadores de progreso y publicarlos en progress_callback.
+        
+        Args:
+            force: Publicar aunque no haya pasado un segundo desde la última vez
+            **fields: Contadores a reemplazar
+        """
+        with self._lock:
+            self._progress.update(fields)
+            now = time.time()
+            if self.progress_callback is None or (not force and now - self._progress_published_at < 1.0):
+                return
+            self._progress_published_at = now
+        
+        try:
+            self.progress_callback(self.get_progress())
+        except Exception as e:
+            logger.warning(f"Error al publicar el progreso: {e}")
+
+    def get_progress(self) -> Dict[str, Any]:
+        """
+        Obtener el progreso de la ejecución en curso.
+        
+        Returns:
+            Diccionario con la fase actual (pagination, resume, detail_fetch, retry, writing,
+            completed, cancelled),
+            páginas obtenidas y totales, contactos únicos procesados de los estimados, duplicados
+            omitidos, fallos, filas por segundo, porcentaje y ETA en segundos
+        """
+        with self._lock:
+            progress = dict(self._progress)
+            elapsed = time.time() - self._progress_started_at
+        
+        processed = progress.get('processed_contacts', 0) + progress.get('failed_contacts', 0)
+        
+        # Mientras se pagina, el total de únicos se estima con la proporción de únicos vista hasta ahora
+        unique_total = progress.get('unique_contacts', 0)
+        records_seen = progress.get('records_seen', 0)
+        total_records = progress.get('total_records')
+        if not progress.get('pagination_complete') and records_seen and total_records:
+            unique_total = max(unique_total, round(unique_total / records_seen * total_records))
+        
+        rows_per_second = processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, unique_total - processed)
+        
+        progress.update({
+            'estimated_unique_contacts': unique_total,
+            'elapsed_seconds': round(elapsed, 1),
+            'rows_per_second': round(rows_per_second, 2),
+            'eta_seconds': round(remaining / rows_per_second) if rows_per_second > 0 else None,
+            'percent': round(100 * processed / unique_total, 1) if unique_total else 0.0
+        })
+        return progress
+
+    def iter_flow_execution_pages(self, flow_id: str = None, start_url: str = None,
+                                  extra_params: Dict[str, Any] = None,
+                                  parallel: bool = True) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorrer las páginas de contactos que han pasado por el flujo específico.
+        Cada página se entrega en cuanto llega, sin esperar a las siguientes.
+        
+        Con la primera respuesta se conocen el total (count) y el tamaño de página: si la
+        paginación es por número de página u offset, las páginas restantes se piden en
+        paralelo (HILOS_PAGE_WORKERS) dentro del límite de peticiones. Con cursores se siguen
+        los enlaces next uno a uno.
+        
+        Antes de entregar cada página, self.next_page_url queda con su enlace next
+        (el punto desde el que continuar tras esa página).
+        
+        Args:
+            flow_id: ID del flujo (opcional, por defecto self.flow_id)
+            start_url: Página desde la que empezar, para continuar un recorrido (opcional)
+            extra_params: Parámetros adicionales de la primera petición, por ejemplo ordering (opcional)
+            parallel: Permitir pedir páginas en paralelo; False cuando el recorrido se puede
+                      detener antes del final y no conviene pedir páginas por adelantado
+            
+        Yields:
+            Lista de contactos de cada página, en el orden del flujo
+        """
+        flow_id = flow_id or self.flow_id
+        url = f"{self.base_url}/flow-execution-contact?flow={flow_id}"
+        next_url = start_url
+        pages_fetched = 0
+        
+        try:
+            logger.info(f"Obteniendo contactos del flujo {flow_id}")
+            if start_url:
+                logger.info(f"Continuando la paginación desde {start_url}")
+            
+            # Primera llamada
+            params = {
+                'flow': flow_id,
+                **(extra_params or {})
+            }
+            
+            while True:
+                with self.tracer.span('page_fetch', 'network', url=next_url or url):
+                    if next_url:
+                        # Usar la URL de la siguiente página
+                        logger.info(f"Obteniendo siguiente página: {next_url}")
+                        response = self._get(next_url)
+                    else:
+                        # Primera llamada o llamada con parámetros
+                        logger.info(f"Obteniendo página inicial...")
+                        response = self._get(url, params=params)
+                    
+                    data = response.json()
+                
+                contacts = self._read_flow_page(data)
+                if not contacts:
+                    break
+                pages_fetched += 1
+                
+                next_url = data.get('next')
+                self.next_page_url = next_url
+                yield contacts
+                
+                # Tras la primera página, pedir las restantes en paralelo si la paginación lo permite
+                if next_url and pages_fetched == 1 and parallel and self.page_workers > 1:
+                    page_urls = self.derive_page_urls(next_url, data.get('count', 0), len(contacts))
+                    if page_urls:
+                        next_url = yield from self._iter_parallel_pages(page_urls)
+                        if next_url:
+                            # Llegaron registros nuevos mientras se paginaba: continuar en secuencia
+                            logger.info("El flujo creció durante la paginación; continuando con next")
+                
+                # Si no hay siguiente página, terminamos
+                if not next_url:
+                    logger.info("Última página alcanzada")
+                    break
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error al obtener contactos del flujo: {e}")
+            raise
+
+    def _read_flow_page(self, data: Any) -> Optional[List[Dict[str, Any]]]:
+        """
+        Validar una página de flow-execution-contact y actualizar el total y el progreso.
+        
+        Args:
+            data: Respuesta JSON de la página
+            
+        Returns:
+            Contactos de la página, o None si la respuesta no tiene el formato esperado
+        """
+        # Verificar estructura de respuesta
+        if not isinstance(data, dict) or 'results' not in data:
+            logger.error(f"Formato de respuesta inesperado: {data}")
+            return None
+        
+        contacts = data['results']
+        total_count = data.get('count', 0)
+        self.flow_total_count = total_count
+        
+        with self._lock:
+            pages_fetched = self._progress.get('pages_fetched', 0) + 1
+            total_pages = self._progress.get('total_pages')
+        if total_pages is None and contacts:
+            # El tamaño de la primera página determina el número total de páginas
+            total_pages = max(1, math.ceil(total_count / len(contacts)))
+        self._update_progress(pages_fetched=pages_fetched, total_pages=total_pages,
+                              total_records=total_count)
+        
+        logger.info(f"Página actual: {len(contacts)} contactos de {total_count} total")
+        
+        if not contacts:
+            logger.info("No hay más contactos en esta página")
+        return contacts
+
+    def derive_page_urls(self, next_url: str, total_count: int, page_size: int) -> Optional[List[str]]:
+        """
+        Calcular las URLs de las páginas restantes a partir del enlace next de la primera página.
+        
+        Args:
+            next_url: Enlace next de la primera respuesta
+            total_count: Total de registros (count)
+            page_size: Número de registros de la primera página
+            
+        Returns:
+            URLs de las páginas restantes en orden, o None si la paginación es por cursor
+            (o por un esquema desconocido) y hay que seguir los enlaces next
+        """
+        if not page_size or not total_count:
+            return None
+        
+        parsed = urlparse(next_url)
+        query = parse_qs(parsed.query, keep_blank_values=True)
+        
+        try:
+            if 'page' in query:
+                # Paginación por número de página: ?page=2, ?page=3, ...
+                first_page = int(query['page'][0])
+                total_pages = math.ceil(total_count / page_size)
+                values = [('page', page) for page in range(first_page, total_pages + 1)]
+            elif 'offset' in query:
+                # Paginación por offset: ?offset=100&limit=100, ...
+                first_offset = int(query['offset'][0])
+                limit = int(query.get('limit', [page_size])[0])
+                values = [('offset', offset) for offset in range(first_offset, total_count, limit)]
+            else:
+                return None
+        except (ValueError, IndexError):
+            return None
+        
+        return [
+            parsed._replace(query=urlencode(dict(query, **{name: [str(value)]}), doseq=True)).geturl()
+            for name, value in values
+        ]
+
+    def _iter_parallel_pages(self, page_urls: List[str]) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Pedir varias páginas en paralelo (con una ventana acotada de peticiones en vuelo)
+        entregándolas en orden.
+        
+        Args:
+            page_urls: URLs de las páginas, en orden
+            
+        Yields:
+            Lista de contactos de cada página
+            
+        Returns:
+            Enlace next de la última página (None si el flujo no creció mientras tanto)
+        """
+        logger.info(f"Obteniendo {len(page_urls)} páginas restantes con {self.page_workers} hilos en paralelo")
+        
+        def fetch(page_url):
+            with self.tracer.span('page_fetch', 'network', url=page_url):
+                logger.info(f"Obteniendo página: {page_url}")
+                return self._get(page_url).json()
+        
+        window = self.page_workers * 2
+        pending = deque()
+        
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            def results():
+                for page_url in page_urls:
+                    pending.append(executor.submit(fetch, page_url))
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            
+            try:
+                next_url = None
+                for data in results():
+                    contacts = self._read_flow_page(data)
+                    if not contacts:
+                        return None
+                    next_url = data.get('next')
+                    self.next_page_url = next_url
+                    yield contacts
+                return next_url
+            finally:
+                # Si se interrumpe el recorrido, no seguir pidiendo las páginas en espera
+                for future in pending:
+                    future.cancel()
+
+    def get_flow_execution_contacts(self) -> List[Dict[str, Any]]:
+        """
+        Obtener todos los contactos que han pasado por el flujo específico.
+        Maneja la paginación para obtener todos los resultados.
+        
+        Returns:
+            Lista de contactos con sus IDs
+        """
+        all_contacts = []
+        for contacts in self.iter_flow_execution_pages():
+            all_contacts.extend(contacts)
+        
+        logger.info(f"Total de contactos encontrados: {len(all_contacts)}")
+        return all_contacts
+
+    def fetch_contact_details(self, contact_id: str) -> Dict[str, Any]:
+        """
+        Obtener información detallada de un contacto específico, propagando los errores.
+        
+        Args:
+            contact_id: ID del contacto
+            
+        Returns:
+            Información detallada del contacto
+            
+        Raises:
+            requests.exceptions.RequestException: Si la petición falla tras agotar los reintentos
+        """
+        url = f"{self.base_url}/contact/{contact_id}"
+        with self.tracer.span('contact_fetch', 'network', contact_id=contact_id):
+            response = self._get(url)
+            data = response.json()
+        
+        # Log de debug para entender la estructura de datos
+        logger.debug(f"Respuesta del contacto {contact_id}: {json.dumps(data, indent=2)[:500]}...")
+        
+        return data
+
+    def get_contact_details(self, contact_id: str) -> Dict[str, Any]:
+        """
+        Obtener información detallada de un contacto específico.
+        
+        Args:
+            contact_id: ID del contacto
+            
+        Returns:
+            Información detallada del contacto (vacía si hubo un error)
+        """
+        try:
+            return self.fetch_contact_details(contact_id)
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error al obtener detalles del contacto {contact_id}: {e}")
+            return {}
+
+    def extract_contact_data(self, contact_details: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extraer los campos específicos requeridos de los detalles del contacto.
+        Usa el plan de extracción precalculado en el constructor (ver ExtractionPlan).
+        
+        Args:
+            contact_details: Información completa del contacto
+            
+        Returns:
+            Diccionario con los campos requeridos
+        """
+        return dict(zip(self.required_columns, self.extract_contact_values(contact_details)))
+
+    def extract_contact_values(self, contact_details: Dict[str, Any]) -> List[Any]:
+        """
+        Extraer los campos requeridos como lista de valores en el orden de required_columns
+        (la forma en que las filas recorren el proceso y se escriben).
+        
+        Args:
+            contact_details: Información completa del contacto
+            
+        Returns:
+            Lista de valores de los campos requeridos
+        """
+        with self.tracer.span('extract', 'cpu'):
+            return self.extraction_plan.extract_values(contact_details)
+
+    def _extract_stored_values(self, contact_details: Dict[str, Any]) -> List[Any]:
+        """Extraer todas las columnas (stored_columns) para guardar la fila en el almacén local"""
+        with self.tracer.span('extract', 'cpu'):
+            return self.stored_plan.extract_values(contact_details)
+
+    def _project_stored_values(self, stored_values: List[Any]) -> List[Any]:
+        """Pasar una fila guardada (stored_columns) al orden de required_columns"""
+        if self.stored_plan is self.extraction_plan:
+            return stored_values
+        return [stored_values[slot] for slot in self.stored_slots]
+
+    def analyze_duplicates(self, flow_contacts: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Analizar los duplicados en la lista de contactos del flujo.
+        
+        Args:
+            flow_contacts: Lista de contactos del flujo
+            
+        Returns:
+            Diccionario con estadísticas de duplicados
+        """
+        tracker = DuplicateTracker()
+        for contact in flow_contacts:
+            tracker.add(contact)
+        
+        return tracker.stats()
+
+    def iter_unique_contacts(self, tracker: 'DuplicateTracker' = None, flow_id: str = None,
+                             start_url: str = None,
+                             on_page: Callable[[Optional[str]], None] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Recorrer los contactos del flujo página a página entregando cada contacto único
+        la primera vez que aparece. Los duplicados se contabilizan sobre la marcha.
+        
+        Args:
+            tracker: Acumulador de duplicados a actualizar (opcional)
+            flow_id: ID del flujo (opcional, por defecto self.flow_id)
+            start_url: Página desde la que continuar la paginación (opcional)
+            on_page: Función que recibe el enlace next de cada página tras deduplicarla y antes
+                     de entregar sus contactos; None al terminar la paginación (opcional)
+            
+        Yields:
+            Tupla (ID del contacto, registro de flow-execution-contact), en el orden del flujo
+        """
+        tracker = tracker if tracker is not None else DuplicateTracker()
+        started = time.perf_counter()
+        next_url = start_url
+        
+        for contacts in self.iter_flow_execution_pages(flow_id, start_url=start_url):
+            unique_contacts = []
+            with self.tracer.span('dedup', 'cpu', records=len(contacts)):
+                for contact in contacts:
+                    contact_id = tracker.add(contact)
+                    
+                    if contact_id is None:
+                        if not contact.get('contact', {}).get('id'):
+                            logger.warning(f"Contacto {tracker.total_contacts} no tiene ID válido. Datos: {contact}")
+                        else:
+                            logger.debug(f"Contacto duplicado omitido: {contact['contact']['id']}")
+                        continue
+                    
+                    unique_contacts.append((contact_id, contact))
+            
+            next_url = self.next_page_url
+            if on_page is not None:
+                on_page(next_url)
+            
+            yield from unique_contacts
+        
+        if on_page is not None and next_url is not None:
+            on_page(None)
+        
+        metrics.PHASE_DURATION.observe(time.perf_counter() - started, phase='pagination')
+        self._update_progress(pagination_complete=True, unique_contacts=len(tracker.contact_counts),
+                              records_seen=tracker.total_contacts)
+
+    def iter_processed_contacts(self, checkpoint: ExportCheckpoint = None) -> Iterator[List[Any]]:
+        """
+        Procesar los contactos del flujo en streaming: cada página se deduplica y sus
+        contactos únicos se envían a obtener detalles mientras se siguen pidiendo páginas.
+        Garantiza que cada contacto aparezca solo una vez y en el orden del flujo.
+        
+        Con un checkpoint, el avance se guarda periódicamente (página siguiente, contactos
+        vistos, fallidos y filas extraídas) y, si ya había uno guardado, se entregan primero
+        sus filas y la paginación continúa desde ese punto. Si se llama a cancel(), el
+        recorrido se detiene tras la fila en curso y el checkpoint se conserva.
+        
+        Al terminar, las estadísticas de duplicados quedan en self.last_run_stats.
+        
+        Args:
+            checkpoint: Checkpoint de la exportación (opcional)
+            
+        Yields:
+            Valores extraídos de cada contacto único, en el orden de required_columns
+        """
+        tracker = DuplicateTracker()
+        self.flow_total_count = 0
+        self.cached_count = 0
+        self._cancel_event.clear()
+        self._reset_progress()
+        started = time.perf_counter()
+        processed_count = 0
+        failed = []
+        start_url = None
+        pagination_complete = False
+        done_position = 0
+        signature = {'flow_id': self.flow_id, 'columns': self.required_columns}
+        
+        state = checkpoint.load(signature) if checkpoint is not None else None
+        if state is not None:
+            tracker = DuplicateTracker.from_dict(state['tracker'])
+            processed_count = state['processed_contacts']
+            self.cached_count = state['cached_contacts']
+            self.flow_total_count = state['total_records']
+            failed = [tuple(item) for item in state['failed']]
+            start_url = state['cursor']
+            pagination_complete = state['pagination_complete']
+            done_position = len(tracker.contact_counts)
+            logger.info(f"Continuando desde el checkpoint: {processed_count} contactos ya procesados, "
+                        f"{len(failed)} fallidos, {'paginación completa' if pagination_complete else start_url}")
+            self._update_progress(force=True, phase='resume', pages_fetched=state['pages_fetched'],
+                                  total_records=self.flow_total_count, records_seen=tracker.total_contacts,
+                                  unique_contacts=done_position, pagination_complete=pagination_complete,
+                                  processed_contacts=processed_count, failed_contacts=len(failed))
+            yield from checkpoint.rows(state)
+        
+        def save_checkpoint():
+            checkpoint.reached(done_position, processed_contacts=processed_count,
+                               cached_contacts=self.cached_count, failed=failed)
+        
+        def on_page(next_url):
+            # Marcar el final de la página como punto de guardado (siempre el de la última página)
+            if next_url is None or checkpoint.due():
+                checkpoint.mark(len(tracker.contact_counts), {
+                    'signature': signature,
+                    'cursor': next_url,
+                    'pagination_complete': next_url is None,
+                    'tracker': tracker.to_dict(),
+                    'total_records': self.flow_total_count,
+                    'pages_fetched': self._progress.get('pages_fetched', 0)
+                })
+                # Una página sin contactos nuevos puede cerrar un punto ya alcanzado
+                save_checkpoint()
+        
+        def fetch(position, unique_contact):
+            contact_id, flow_contact = unique_contact
+            version = self.contact_version(flow_contact)
+            logger.info(f"Procesando contacto único {position} (registros en el flujo: {self.flow_total_count}): {contact_id}")
+            return contact_id, version, self._fetch_contact_row(contact_id, version=version)
+        
+        if not pagination_complete:
+            unique_contacts = self.iter_unique_contacts(tracker, start_url=start_url,
+                                                        on_page=on_page if checkpoint is not None else None)
+            indexed_contacts = enumerate(unique_contacts, done_position + 1)
+            results = self._iter_fetch_results(fetch, indexed_contacts)
+            
+            try:
+                for contact_id, version, row in results:
+                    done_position += 1
+                    if row is None:
+                        failed.append((contact_id, version))
+                    else:
+                        processed_count += 1
+                    self._update_progress(
+                        phase='detail_fetch',
+                        records_seen=tracker.total_contacts,
+                        unique_contacts=len(tracker.contact_counts),
+                        duplicates_skipped=tracker.duplicate_instances,
+                        processed_contacts=processed_count,
+                        cached_contacts=self.cached_count,
+                        failed_contacts=len(failed)
+                    )
+                    if row is not None:
+                        if checkpoint is not None:
+                            checkpoint.add_row(row)
+                        yield row
+                    if checkpoint is not None:
+                        save_checkpoint()
+                    if self.cancelled:
+                        break
+            finally:
+                # Cancelar las peticiones en espera si el recorrido se interrumpe
+                results.close()
+        
+        # Pasada final: reintentar una vez los contactos que fallaron o llegaron vacíos.
+        # Se agregan al final para que el resto del archivo conserve el orden del flujo.
+        permanently_failed = []
+        if failed and not self.cancelled:
+            logger.info(f"Reintentando {len(failed)} contactos que fallaron...")
+            self._update_progress(force=True, phase='retry')
+            retry_started = time.perf_counter()
+            recovered = 0
+            for contact_id, version in failed:
+                if self.cancelled:
+                    break
+                row = self._fetch_contact_row(contact_id, permanently_failed, version)
+                if row is not None:
+                    processed_count += 1
+                    recovered += 1
+                    self._update_progress(processed_contacts=processed_count,
+                                          failed_contacts=len(failed) - recovered)
+                    yield row
+            metrics.PHASE_DURATION.observe(time.perf_counter() - retry_started, phase='retry')
+        
+        metrics.PHASE_DURATION.observe(time.perf_counter() - started, phase='process_contacts')
+        
+        duplicate_stats = tracker.stats()
+        self.last_run_stats = dict(
+            duplicate_stats,
+            processed_contacts=processed_count,
+            cached_contacts=self.cached_count,
+            retried_contacts=len(failed),
+            failed_contacts=len(permanently_failed),
+            failed_contact_ids=[contact_id for contact_id, _ in permanently_failed],
+            resumed=state is not None,
+            cancelled=self.cancelled
+        )
+        
+        if self.cancelled:
+            logger.warning(f"Exportación cancelada tras {processed_count} contactos procesados"
+                           f"{'; se puede continuar desde el último checkpoint' if checkpoint is not None else ''}")
+            self._update_progress(force=True, phase='cancelled', processed_contacts=processed_count)
+            return
+        
+        if checkpoint is not None:
+            checkpoint.finish()
+        
+        self._update_progress(force=True, phase='writing', processed_contacts=processed_count,
+                              failed_contacts=len(permanently_failed))
+        
+        logger.info(f"Análisis de duplicados:")
+        logger.info(f"  - Contactos únicos: {duplicate_stats['unique_contacts']}")
+        logger.info(f"  - Contactos con duplicados: {duplicate_stats['duplicate_contacts']}")
+        logger.info(f"  - Instancias duplicadas totales: {duplicate_stats['total_duplicate_instances']}")
+        
+        logger.info(f"Procesamiento completado:")
+        logger.info(f"  - Total de registros en el flujo: {duplicate_stats['total_contacts']}")
+        logger.info(f"  - Contactos únicos procesados: {processed_count}")
+        logger.info(f"  - Duplicados omitidos: {duplicate_stats['total_duplicate_instances']}")
+        logger.info(f"  - Contactos tomados del almacén local: {self.cached_count}")
+        logger.info(f"  - Contactos reintentados: {len(failed)}")
+        if permanently_failed:
+            logger.warning(f"  - Contactos sin datos tras reintentar: {len(permanently_failed)}")
+
+    def cancel(self):
         """
-        Inicializar el extractor con el token de autorización.
+        Pedir que la ejecución en curso se detenga (se puede llamar desde otro hilo).
+        iter_processed_contacts termina tras la fila en curso, de modo que la exportación
+        se cierra con las filas obtenidas hasta ese momento.
+        """
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Indica si se pidió cancelar la ejecución en curso"""
+        return self._cancel_event.is_set()
+
+    def _iter_fetch_results(self, fetch: Callable, indexed_contacts: Iterable[Tuple[int, Any]]) -> Iterator[Any]:
+        """
+        Ejecutar fetch para cada contacto (en paralelo si max_workers > 1) entregando
+        los resultados en el mismo orden de entrada.
         
         Args:
-            auth_token: Token de autorización para la API (opcional, usa env var si no se proporciona)
-            flow_id: ID del flujo específico (opcional, usa env var si no se proporciona)
+            fetch: Función (posición, contacto) -> resultado (por ejemplo, la fila o None)
+            indexed_contacts: Iterador de tuplas (posición, contacto)
+            
+        Yields:
+            Resultado de fetch para cada contacto
         """
-        import os
+        if self.max_workers <= 1:
+            for position, contact in indexed_contacts:
+                yield fetch(position, contact)
+            return
         
-        # Usar variables de entorno si no se proporcionan parámetros
-        self.auth_token = auth_token or os.getenv('HILOS_API_TOKEN')
-        self.flow_id = flow_id or os.getenv('HILOS_FLOW_ID', '0684111b-3948-7ce2-8000-b20bbb1bd564')
+        # Ventana acotada de peticiones en vuelo: la memoria no crece con el tamaño
+        # del flujo y los resultados se entregan en el mismo orden de entrada
+        logger.info(f"Obteniendo detalles con {self.max_workers} hilos en paralelo")
+        window = self.max_workers * 4
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for position, contact in indexed_contacts:
+                    pending.append(executor.submit(fetch, position, contact))
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # Si se interrumpe el recorrido, no seguir pidiendo los contactos en espera
+                for future in pending:
+                    future.cancel()
+
+    def get_changed_contacts(self, since: str = None) -> Tuple['ColumnarBuffer', str]:
+        """
+        Obtener solo los contactos que entraron al flujo o cambiaron después de un cursor,
+        para sincronizaciones incrementales que no recorran el flujo completo.
         
-        if not self.auth_token:
-            raise ValueError("HILOS_API_TOKEN es requerido. Configúralo como variable de entorno o pásalo como parámetro.")
+        El listado de flow-execution-contact se pide ordenado por fecha de modificación
+        (más recientes primero) y la paginación se detiene en la primera página anterior al
+        cursor, de modo que una sincronización diaria cuesta unas pocas peticiones. Si la API
+        no respeta el orden, se recorre el listado completo y se filtra localmente.
         
-        self.base_url = "https://api.hilos.io/api"
-        self.headers = {
-            'Authorization': f'Token {self.auth_token}',
-            'Content-Type': 'application/json'
-        }
+        Si algún contacto no se pudo obtener tras reintentarlo, el cursor no avanza y la
+        siguiente sincronización lo vuelve a incluir: una misma fila puede llegar en más de
+        una sincronización, por lo que conviene aplicarlas por teléfono.
         
-        # Columnas requeridas para el Excel
-        self.required_columns = [
-            'phone', 'ccb_init', 'ccb_adult', 'ccb_question_1', 'ccb_question_2', 'ccb_question_3', 
-            'ccb_otro_question_3', 'ccb_question_4', 'ccb_pais_question_4', 'ccb_otra_question_4',
-            'ccb_question_5', 'ccb_question_6', 'ccb_otro_question_6', 'ccb_question_6-1', 
-            'ccb_otro_question_6-1', 'ccb_question_7', 'ccb_otro_question_7', 'ccb_question_7-1',
-            'ccb_other_question_7-1', 'ccb_question_8', 'ccb_question_8-1', 'ccb_question_8-2',
-            'ccb_question_9', 'ccb_question_10', 'ccb_question_11', 'ccb_gender_question_11',
-            'ccb_question_12', 'ccb_question_12-1', 'ccb_otro_question_12-1', 'ccb_question_12-2',
-            'ccb_cual_question_12-2', 'ccb_question_13', 'ccb_question_14', 'ccb_cual_question_14',
-            'ccb_question_15', 'ccb_cual_question_15', 'ccb_question_16', 'ccb_cual_question_16'
-        ]
+        Al terminar, las estadísticas quedan en self.last_run_stats.
         
-        # Cargar mapeo de campos a encabezados
-        self.field_mapping = self.load_field_mapping()
+        Args:
+            since: Cursor devuelto por una llamada anterior o fecha ISO 8601 (None = todos los contactos)
+            
+        Returns:
+            Tupla (ColumnarBuffer con los contactos nuevos o modificados, cursor para la siguiente llamada)
+            
+        Raises:
+            ValueError: Si since no es un cursor ni una fecha válida, o el cursor es de otro flujo
+        """
+        since_at, since_ids = decode_delta_cursor(since, self.flow_id)
+        self.flow_total_count = 0
+        self.cached_count = 0
+        self._reset_progress()
+        started = time.perf_counter()
+        
+        changed = {}  # contact_id -> registro más reciente del contacto en el flujo
+        newest_at, newest_ids = since_at, set(since_ids)
+        records_seen = 0
+        ordered = True
+        stopped_early = False
+        previous_at = None
+        
+        for contacts in self.iter_flow_execution_pages(extra_params={'ordering': DELTA_ORDERING}, parallel=False):
+            for record in contacts:
+                records_seen += 1
+                updated_at = _record_timestamp(record)
+                if updated_at is not None:
+                    if ordered and previous_at is not None and updated_at > previous_at:
+                        ordered = False
+                        logger.warning("El listado del flujo no viene ordenado por fecha de modificación; "
+                                       "se recorrerá completo")
+                    previous_at = updated_at
+                    
+                    if since_at is not None and (updated_at < since_at or
+                                                 (updated_at == since_at and str(record.get('id')) in since_ids)):
+                        continue
+                    if newest_at is None or updated_at > newest_at:
+                        newest_at, newest_ids = updated_at, set()
+                    if updated_at == newest_at:
+                        newest_ids.add(str(record.get('id')))
+                # Un registro sin fecha no se puede comparar con el cursor: se incluye
+                
+                contact_id = (record.get('contact') or {}).get('id')
+                if contact_id and contact_id not in changed:
+                    changed[contact_id] = record
+            
+            # Con el listado ordenado, el resto de páginas es anterior al cursor
+            if ordered and since_at is not None and previous_at is not None and previous_at < since_at:
+                stopped_early = True
+                break
+        
+        pages_fetched = self._progress.get('pages_fetched', 0)
+        logger.info(f"Delta: {len(changed)} contactos nuevos o modificados en {records_seen} registros "
+                    f"({pages_fetched} páginas{', recorrido parcial' if stopped_early else ''})")
+        self._update_progress(force=True, phase='detail_fetch', unique_contacts=len(changed),
+                              records_seen=records_seen, pagination_complete=True)
+        
+        def fetch(position, item):
+            contact_id, record = item
+            # Misma versión que en la exportación completa aunque allí se use otro registro del contacto
+            version = self.contact_version(record)
+            return contact_id, version, self._fetch_contact_row(contact_id, version=version)
+        
+        buffer = ColumnarBuffer(self.required_columns)
+        failed = []
+        for contact_id, version, row in self._iter_fetch_results(fetch, enumerate(changed.items(), 1)):
+            if row is None:
+                failed.append((contact_id, version))
+            else:
+                buffer.append(row)
+            self._update_progress(processed_contacts=len(buffer), cached_contacts=self.cached_count,
+                                  failed_contacts=len(failed))
+        
+        permanently_failed = []
+        for contact_id, version in failed:
+            row = self._fetch_contact_row(contact_id, permanently_failed, version)
+            if row is not None:
+                buffer.append(row)
+        
+        if permanently_failed:
+            logger.warning(f"{len(permanently_failed)} contactos sin datos tras reintentar; "
+                           f"el cursor no avanza para volver a incluirlos")
+            cursor = encode_delta_cursor(self.flow_id, since_at, since_ids)
+        else:
+            cursor = encode_delta_cursor(self.flow_id, newest_at, newest_ids)
+        
+        metrics.PHASE_DURATION.observe(time.perf_counter() - started, phase='delta')
+        self._update_progress(force=True, phase='completed', processed_contacts=len(buffer),
+                              failed_contacts=len(permanently_failed))
+        self.last_run_stats = {
+            'since': since_at.isoformat() if since_at else None,
+            'records_seen': records_seen,
+            'pages_fetched': pages_fetched,
+            'full_scan': not stopped_early,
+            'changed_contacts': len(changed),
+            'processed_contacts': len(buffer),
+            'cached_contacts': self.cached_count,
+            'retried_contacts': len(failed),
+            'failed_contacts': len(permanently_failed),
+            'failed_contact_ids': [contact_id for contact_id, _ in permanently_failed]
+        }
+        return buffer, cursor
 
-    def load_field_mapping(self) -> Dict[str, str]:
+    def list_flows(self, flow_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        Cargar el mapeo de campos a encabezados desde el archivo campos.json.
+        Recorrer el listado de varios flujos, deduplicando cada uno por separado.
         
+        Args:
+            flow_ids: IDs de los flujos
+            
         Returns:
-            Diccionario con el mapeo de campo -> encabezado
+            Diccionario flow_id -> {'tracker': DuplicateTracker, 'contacts': [(contact_id, registro), ...]}
+            con los contactos únicos de cada flujo en su orden
         """
-        try:
-            with open('campos.json', 'r', encoding='utf-8') as f:
-                mapping = json.load(f)
-            logger.info(f"Cargado mapeo de campos: {len(mapping)} entradas")
-            return mapping
-        except FileNotFoundError:
-            logger.error("Archivo campos.json no encontrado")
-            return {}
-        except json.JSONDecodeError as e:
-            logger.error(f"Error al parsear campos.json: {e}")
-            return {}
+        flows = {}
+        for flow_id in flow_ids:
+            tracker = DuplicateTracker()
+            contacts = list(self.iter_unique_contacts(tracker, flow_id))
+            flows[flow_id] = {'tracker': tracker, 'contacts': contacts}
+            logger.info(f"Flujo {flow_id}: {tracker.total_contacts} registros, {len(contacts)} contactos únicos")
+        return flows
 
-    def get_flow_execution_contacts(self) -> List[Dict[str, Any]]:
+    def iter_batch_rows(self, flows: Dict[str, Dict[str, Any]]) -> Iterator[Tuple[str, Iterator[List[Any]]]]:
         """
-        Obtener todos los contactos que han pasado por el flujo específico.
-        Maneja la paginación para obtener todos los resultados.
+        Procesar varios flujos pidiendo a la API una sola vez cada contacto, aunque aparezca
+        en más de un flujo. Las filas de los contactos compartidos se conservan en memoria
+        solo hasta que las usa el último flujo que los contiene.
         
-        Returns:
-            Lista de contactos con sus IDs
+        Los flujos se entregan en orden y cada iterador de filas debe consumirse antes de
+        pasar al siguiente flujo. Las estadísticas quedan en self.last_batch_stats.
+        
+        Args:
+            flows: Resultado de list_flows
+            
+        Yields:
+            Tupla (flow_id, iterador de filas del flujo en su orden, sin duplicados)
         """
-        url = f"{self.base_url}/flow-execution-contact?flow={self.flow_id}"
-        all_contacts = []
-        next_url = None
+        remaining_uses = {}
+        for flow in flows.values():
+            for contact_id, _ in flow['contacts']:
+                remaining_uses[contact_id] = remaining_uses.get(contact_id, 0) + 1
+        shared_rows = {}
         
-        try:
-            logger.info(f"Obteniendo contactos del flujo {self.flow_id}")
+        self.last_batch_stats = {
+            'flows': {},
+            'unique_contacts': len(remaining_uses),
+            'shared_contacts': sum(1 for uses in remaining_uses.values() if uses > 1),
+            'fetches_saved': 0
+        }
+        
+        def flow_rows(flow_id, flow):
+            processed = 0
+            failed = []
             
-            # Primera llamada
-            params = {
-                'flow': self.flow_id
-            }
+            def fetch(position, unique_contact):
+                contact_id, flow_contact = unique_contact
+                row = shared_rows.get(contact_id)
+                if row is not None:
+                    # Ya se obtuvo para un flujo anterior
+                    with self._lock:
+                        self.last_batch_stats['fetches_saved'] += 1
+                    return row
+                row = self._fetch_contact_row(contact_id, failed, self.contact_version(flow_contact))
+                if row is not None and remaining_uses[contact_id] > 1:
+                    shared_rows[contact_id] = row
+                return row
             
-            while True:
-                if next_url:
-                    # Usar la URL de la siguiente página
-                    logger.info(f"Obteniendo siguiente página: {next_url}")
-                    response = requests.get(next_url, headers=self.headers)
-                else:
-                    # Primera llamada o llamada con parámetros
-                    logger.info(f"Obteniendo página inicial...")
-                    response = requests.get(url, headers=self.headers, params=params)
-                
-                response.raise_for_status()
-                data = response.json()
-                
-                # Verificar estructura de respuesta
-                if not isinstance(data, dict) or 'results' not in data:
-                    logger.error(f"Formato de respuesta inesperado: {data}")
-                    break
-                
-                contacts = data['results']
-                total_count = data.get('count', 0)
-                next_url = data.get('next')
-                
-                logger.info(f"Página actual: {len(contacts)} contactos de {total_count} total")
-                
-                if not contacts:
-                    logger.info("No hay más contactos en esta página")
-                    break
-                
-                all_contacts.extend(contacts)
-                
-                # Si no hay siguiente página, terminamos
-                if not next_url:
-                    logger.info("Última página alcanzada")
-                    break
-                
-                # Pequeña pausa entre páginas
-                time.sleep(0.2)
+            contacts = flow['contacts']
+            results = self._iter_fetch_results(fetch, enumerate(contacts, 1))
             
-            logger.info(f"Total de contactos encontrados: {len(all_contacts)}")
-            return all_contacts
+            for (contact_id, _), row in zip(contacts, results):
+                remaining_uses[contact_id] -= 1
+                if remaining_uses[contact_id] <= 0:
+                    shared_rows.pop(contact_id, None)
+                if row is not None:
+                    processed += 1
+                    yield row
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error al obtener contactos del flujo: {e}")
-            raise
+            # Reintentar una vez los contactos del flujo que fallaron
+            permanently_failed = []
+            for contact_id, version in failed:
+                row = self._fetch_contact_row(contact_id, permanently_failed, version)
+                if row is not None:
+                    processed += 1
+                    yield row
+            
+            self.last_batch_stats['flows'][flow_id] = dict(
+                flow['tracker'].stats(),
+                processed_contacts=processed,
+                retried_contacts=len(failed),
+                failed_contacts=len(permanently_failed),
+                failed_contact_ids=[contact_id for contact_id, _ in permanently_failed]
+            )
+        
+        for flow_id, flow in flows.items():
+            yield flow_id, flow_rows(flow_id, flow)
 
-    def get_contact_details(self, contact_id: str) -> Dict[str, Any]:
+    def export_batch(self, flow_ids: List[str], output_base: str = 'ccb_batch', export_format: str = 'xlsx',
+                     partitioned: bool = False) -> Dict[str, Any]:
         """
-        Obtener información detallada de un contacto específico.
+        Exportar varios flujos a la vez, pidiendo a la API una sola vez cada contacto.
+        
+        En xlsx se genera un libro con una hoja por flujo y una hoja Resumen con las estadísticas
+        de duplicados de cada flujo. En los demás formatos (o con partitioned) se genera un archivo
+        por flujo más un JSON con las estadísticas.
+        
+        Args:
+            flow_ids: IDs de los flujos
+            output_base: Nombre base de los archivos de salida (sin extensión)
+            export_format: xlsx, csv, ndjson (gzip) o parquet
+            partitioned: Un archivo por flujo también en xlsx
+            
+        Returns:
+            Diccionario con los archivos generados (files) y las estadísticas (stats, ver last_batch_stats)
+        """
+        format_error = export_format_error(export_format)
+        if format_error:
+            raise ValueError(format_error)
+        
+        flow_ids = list(dict.fromkeys(flow_ids))
+        started = time.perf_counter()
+        self._reset_progress()
+        
+        flows = self.list_flows(flow_ids)
+        self._update_progress(force=True, phase='detail_fetch')
+        files = []
+        
+        with self.tracer.span('export', 'run', format=export_format, flows=len(flow_ids)):
+            if export_format == 'xlsx' and not partitioned:
+                filename = f'{output_base}.xlsx'
+                written = self._generate_excel_workbook(self.iter_batch_rows(flows), filename)
+                files.append(filename)
+            else:
+                written = {}
+                extension = EXPORT_FORMATS[export_format]['extension']
+                for flow_id, rows in self.iter_batch_rows(flows):
+                    filename = f"{output_base}_{re.sub(r'[^A-Za-z0-9_-]', '_', flow_id)}{extension}"
+                    written[flow_id] = self._write_file(rows, filename, export_format)
+                    files.append(filename)
+        
+        stats = self.last_batch_stats
+        for flow_id, count in written.items():
+            stats['flows'][flow_id]['rows_written'] = count
+        
+        if export_format != 'xlsx' or partitioned:
+            stats_filename = f'{output_base}_stats.json'
+            with open(stats_filename, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, ensure_ascii=False, indent=2, default=str)
+            files.append(stats_filename)
+        
+        total_rows = sum(written.values())
+        metrics.PHASE_DURATION.observe(time.perf_counter() - started, phase=f'export_{export_format}')
+        metrics.ROWS_WRITTEN.inc(total_rows, format=export_format)
+        self._update_progress(force=True, phase='completed')
+        
+        logger.info(f"Exportación de {len(flow_ids)} flujos completada:")
+        for flow_id, flow_stats in stats['flows'].items():
+            logger.info(f"  - {flow_id}: {flow_stats['total_contacts']} registros, "
+                        f"{flow_stats['unique_contacts']} únicos, {flow_stats['rows_written']} filas escritas")
+        logger.info(f"  - Contactos únicos en todos los flujos: {stats['unique_contacts']}")
+        logger.info(f"  - Contactos en más de un flujo: {stats['shared_contacts']}")
+        logger.info(f"  - Peticiones a la API evitadas: {stats['fetches_saved']}")
+        
+        return {'files': files, 'stats': stats}
+
+    def contact_version(self, flow_contact: Dict[str, Any]) -> str:
+        """
+        Calcular la versión de un contacto a partir de los datos del contacto incluidos en
+        su registro del listado del flujo. Esos datos son los actuales del contacto en todos
+        sus registros, así que la exportación completa (primer registro) y la delta (el más
+        reciente) obtienen la misma versión, y cualquier cambio del contacto (nuevas respuestas
+        en meta, una nueva entrada al flujo) la cambia y hace que se vuelva a pedir a la API.
+        
+        Se usa su last_updated_on; si la API no lo incluye, una huella de los datos del contacto
+        (en ese caso CCB_CONTACT_STORE_MAX_AGE acota cuánto dura una copia sin cambios visibles).
+        
+        Args:
+            flow_contact: Registro de flow-execution-contact
+            
+        Returns:
+            Versión del contacto
+        """
+        contact = flow_contact.get('contact')
+        if not isinstance(contact, dict):
+            contact = {'id': contact}
+        if contact.get('last_updated_on'):
+            return f"updated:{contact['last_updated_on']}"
+        serialized = json.dumps(contact, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def _fetch_contact_row(self, contact_id: str, failed: List[Tuple[str, Optional[str]]] = None,
+                           version: str = None) -> Optional[List[Any]]:
+        """
+        Obtener y extraer los datos de un único contacto.
+        Si hay almacén local y el contacto no ha cambiado, se usa la copia guardada.
+        Los errores quedan aislados al contacto para no interrumpir el resto del proceso.
         
         Args:
             contact_id: ID del contacto
+            failed: Lista donde se anota (contact_id, version) si no se pudo obtener (opcional)
+            version: Versión del contacto según el listado del flujo (opcional)
             
         Returns:
-            Información detallada del contacto
+            Valores de los campos requeridos en el orden de required_columns, o None si no se pudo obtener
         """
-        url = f"{self.base_url}/contact/{contact_id}"
+        if self.store is not None and version is not None:
+            with self.tracer.span('store_lookup', 'io'):
+                cached = self.store.get_fresh(contact_id, version)
+            if cached is not None:
+                with self._lock:
+                    self.cached_count += 1
+                metrics.CONTACT_STORE_HITS.inc()
+                row = cached['row']
+                if list(row) == self.stored_columns:
+                    return self._project_stored_values(list(row.values()))
+                # Fila guardada con otras columnas: volver a extraer del detalle guardado
+                stored_values = self._extract_stored_values(cached['payload'])
+                self.store.save(contact_id, version, cached['payload'], dict(zip(self.stored_columns, stored_values)))
+                return self._project_stored_values(stored_values)
         
         try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
+            contact_details = self.fetch_contact_details(contact_id)
+            if not contact_details:
+                logger.warning(f"No se pudieron obtener detalles para el contacto {contact_id}")
+                if failed is not None:
+                    failed.append((contact_id, version))
+                return None
             
-            # Log de debug para entender la estructura de datos
-            logger.debug(f"Respuesta del contacto {contact_id}: {json.dumps(data, indent=2)[:500]}...")
+            if self.store is None or version is None:
+                return self.extract_contact_values(contact_details)
             
-            return data
+            # Extraer todas las columnas para el almacén y devolver solo las requeridas
+            stored_values = self._extract_stored_values(contact_details)
+            with self.tracer.span('store_save', 'io'):
+                self.store.save(contact_id, version, contact_details, dict(zip(self.stored_columns, stored_values)))
+            return self._project_stored_values(stored_values)
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error al obtener detalles del contacto {contact_id}: {e}")
-            return {}
+        except Exception as e:
+            logger.error(f"Error al procesar el contacto {contact_id}: {e}")
+            if failed is not None:
+                failed.append((contact_id, version))
+            return None
 
-    def extract_contact_data(self, contact_details: Dict[str, Any]) -> Dict[str, Any]:
+    def get_column_headers(self) -> List[str]:
         """
-        Extraer los campos específicos requeridos de los detalles del contacto.
+        Obtener los encabezados del archivo a partir de campos.json, en el orden de required_columns.
+        
+        Returns:
+            Lista de encabezados (el nombre del campo si no tiene mapeo)
+        """
+        headers = []
+        for col in self.required_columns:
+            if col in self.field_mapping:
+                headers.append(self.field_mapping[col])
+                logger.debug(f"Mapeo de columna: {col} -> {self.field_mapping[col]}")
+            else:
+                # Si no hay mapeo, usar el nombre original de la columna
+                headers.append(col)
+                logger.warning(f"No se encontró mapeo para la columna: {col}")
+        return headers
+
+    def iter_export_rows(self, data: Iterable[Row]) -> Iterator[List[Any]]:
+        """
+        Convertir las filas en listas de valores para escribir en el orden de required_columns,
+        omitiendo teléfonos repetidos (mismo criterio que drop_duplicates(subset=['phone'])).
+        
+        Al terminar, self.last_export_digest queda con el SHA-256 de los encabezados y las
+        filas entregadas: dos exportaciones con los mismos datos tienen el mismo digest
+        aunque los bytes del archivo difieran (por ejemplo, la fecha interna de un .xlsx).
         
         Args:
-            contact_details: Información completa del contacto
+            data: Iterador de filas (ver Row)
+            
+        Yields:
+            Lista de valores de cada fila única (el total queda en self.last_export_count)
+        """
+        seen_phones = set()
+        extra_duplicates = 0
+        self.last_export_count = 0
+        self.last_export_digest = None
+        phone_slot = self.extraction_plan.phone_slot
+        digest = hashlib.sha256(json.dumps(self.get_column_headers(), ensure_ascii=False).encode('utf-8'))
+        
+        for row in data:
+            values = self._row_values(row)
+            if phone_slot is not None:
+                phone = _excel_value(values[phone_slot])
+                if phone in seen_phones:
+                    extra_duplicates += 1
+                    continue
+                seen_phones.add(phone)
+            
+            self.last_export_count += 1
+            export_values = [_excel_value(value) for value in values]
+            digest.update(b'\n' + json.dumps(export_values, ensure_ascii=False, default=str).encode('utf-8'))
+            yield export_values
+        
+        self.last_export_digest = digest.hexdigest()
+        if extra_duplicates:
+            logger.warning(f"Se encontraron {extra_duplicates} duplicados adicionales al escribir el archivo")
+
+    def _row_values(self, row: Row) -> Sequence[Any]:
+        """Valores de una fila en el orden de required_columns (acepta diccionarios por compatibilidad)"""
+        if isinstance(row, dict):
+            return [row.get(col, '') for col in self.required_columns]
+        return row
+
+    def export(self, data: Iterable[Row], filename: str, export_format: str = 'xlsx') -> int:
+        """
+        Exportar los datos procesados en el formato indicado (ver EXPORT_FORMATS).
+        Todos los formatos usan el mismo orden de columnas y los encabezados de campos.json.
+        
+        Args:
+            data: Filas a exportar (iterador, lista o ColumnarBuffer; ver Row)
+            filename: Nombre del archivo de salida
+            export_format: xlsx, csv, ndjson (gzip) o parquet
             
         Returns:
-            Diccionario con los campos requeridos
+            Número de registros únicos escritos (el digest del contenido queda en self.last_export_digest)
         """
-        # Inicializar diccionario con valores vacíos para todas las columnas
-        extracted_data = {col: '' for col in self.required_columns}
-        
-        def extract_value(data, key):
-            """Función auxiliar para extraer valores de manera segura"""
-            if isinstance(data, dict):
-                return data.get(key, '')
-            elif isinstance(data, list):
-                # Si es una lista, buscar en cada elemento
-                for item in data:
-                    if isinstance(item, dict) and key in item:
-                        return item[key]
-            return ''
-        
-        # Extraer datos básicos del contacto
-        extracted_data['phone'] = extract_value(contact_details, 'phone')
-        
-        # Buscar en diferentes estructuras de datos posibles
-        search_locations = [
-            contact_details,  # Nivel raíz
-            contact_details.get('fields', {}),  # Campo fields
-            contact_details.get('custom_fields', {}),  # Campo custom_fields
-            contact_details.get('responses', {}),  # Campo responses
-            contact_details.get('data', {}),  # Campo data
-            contact_details.get('attributes', {}),  # Campo attributes
-            contact_details.get('meta', {}),  # Campo meta (importante para este API)
-        ]
+        format_error = export_format_error(export_format)
+        if format_error:
+            raise ValueError(format_error)
         
-        # Buscar cada campo requerido en todas las ubicaciones posibles
-        for field_name in self.required_columns:
-            if field_name == 'phone':  # Ya procesado arriba
-                continue
-                
-            for location in search_locations:
-                if isinstance(location, dict):
-                    value = extract_value(location, field_name)
-                    if value:  # Si encontramos un valor no vacío
-                        extracted_data[field_name] = value
-                        break
+        # Con data en streaming, la duración incluye también la obtención de los contactos
+        started = time.perf_counter()
         
-        # Buscar también en arrays o estructuras anidadas
-        for key, value in contact_details.items():
-            if isinstance(value, list):
-                for item in value:
-                    if isinstance(item, dict):
-                        for field_name in self.required_columns:
-                            if field_name in item and not extracted_data[field_name]:
-                                extracted_data[field_name] = item[field_name]
+        with self.tracer.span('export', 'run', format=export_format):
+            record_count = self._write_file(data, filename, export_format)
         
-        # Buscar específicamente en el campo 'meta' que parece contener datos importantes
-        meta_data = contact_details.get('meta', {})
-        if isinstance(meta_data, dict):
-            for field_name in self.required_columns:
-                if field_name in meta_data and not extracted_data[field_name]:
-                    extracted_data[field_name] = meta_data[field_name]
+        metrics.PHASE_DURATION.observe(time.perf_counter() - started, phase=f'export_{export_format}')
+        metrics.ROWS_WRITTEN.inc(record_count, format=export_format)
+        self._update_progress(force=True, phase='completed')
+        return record_count
+
+    def _write_file(self, data: Iterable[Row], filename: str, export_format: str) -> int:
+        """
+        Escribir un archivo en el formato indicado (sin validar el formato ni publicar progreso).
+        
+        Args:
+            data: Filas a exportar (iterador, lista o ColumnarBuffer; ver Row)
+            filename: Nombre del archivo de salida
+            export_format: xlsx, csv, ndjson (gzip) o parquet
+            
+        Returns:
+            Número de registros únicos escritos (el digest del contenido queda en self.last_export_digest)
+        """
+        self.last_export_digest = None
+        if export_format == 'xlsx':
+            record_count = self.generate_excel(data, filename)
+        elif export_format == 'parquet':
+            record_count = self._generate_parquet(data, filename)
+        else:
+            chunks = self.iter_csv_chunks(data) if export_format == 'csv' else self.iter_ndjson_chunks(data)
+            with open(filename, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            
+            record_count = self.last_export_count
+        if self.last_export_digest is None:
+            # El Excel generado con pandas no pasa por iter_export_rows: digest de los bytes del archivo
+            self.last_export_digest = file_digest(filename)
+        logger.info(f"Archivo {export_format.upper()} generado: {filename}")
+        logger.info(f"Total de registros únicos: {record_count}")
+        return record_count
+
+    def iter_csv_chunks(self, data: Iterable[Row], rows_per_chunk: int = 500) -> Iterator[bytes]:
+        """
+        Generar el CSV por bloques, listo para escribirse en disco o enviarse por HTTP.
+        
+        Args:
+            data: Iterador de filas (ver Row)
+            rows_per_chunk: Filas por bloque
+            
+        Yields:
+            Bloques del CSV codificados en UTF-8
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.get_column_headers())
+        
+        # Los encabezados se envían de inmediato, antes de procesar el primer contacto
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
         
-        return extracted_data
+        for i, values in enumerate(self.iter_export_rows(data), 1):
+            with self.tracer.span('write_row', 'write'):
+                writer.writerow(['' if value is None else value for value in values])
+            if i % rows_per_chunk == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        
+        yield buffer.getvalue().encode('utf-8')
 
-    def analyze_duplicates(self, flow_contacts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def iter_ndjson_chunks(self, data: Iterable[Row], rows_per_chunk: int = 500) -> Iterator[bytes]:
         """
-        Analizar los duplicados en la lista de contactos del flujo.
+        Generar NDJSON comprimido con gzip por bloques (un objeto JSON por línea,
+        con los encabezados de campos.json como claves).
         
         Args:
-            flow_contacts: Lista de contactos del flujo
+            data: Iterador de filas (ver Row)
+            rows_per_chunk: Filas por bloque
+            
+        Yields:
+            Bloques del archivo .ndjson.gz
+        """
+        headers = self.get_column_headers()
+        compressor = zlib.compressobj(wbits=31)  # wbits=31: formato gzip
+        lines = []
+        
+        # El encabezado gzip se envía de inmediato, antes de procesar el primer contacto
+        yield compressor.flush(zlib.Z_SYNC_FLUSH)
+        
+        for values in self.iter_export_rows(data):
+            with self.tracer.span('write_row', 'write'):
+                lines.append(json.dumps(dict(zip(headers, values)), ensure_ascii=False, default=str))
+            if len(lines) >= rows_per_chunk:
+                lines.append('')
+                with self.tracer.span('compress', 'write', rows=len(lines) - 1):
+                    chunk = compressor.compress('\n'.join(lines).encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                yield chunk
+                lines = []
+        
+        if lines:
+            lines.append('')
+            yield compressor.compress('\n'.join(lines).encode('utf-8'))
+        yield compressor.flush()
+
+    def _generate_parquet(self, data: Iterable[Row], filename: str, rows_per_batch: int = 5000) -> int:
+        """
+        Escribir un archivo Parquet por lotes (requiere pyarrow).
+        Todas las columnas se guardan como texto porque las respuestas no tienen un tipo fijo.
+        
+        Args:
+            data: Iterador de filas (ver Row)
+            filename: Nombre del archivo de salida
+            rows_per_batch: Filas por grupo de filas del archivo
             
         Returns:
-            Diccionario con estadísticas de duplicados
+            Número de registros únicos escritos
         """
-        contact_counts = {}
-        duplicate_details = {}
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("El formato parquet requiere pyarrow. Instálalo con: pip install pyarrow")
         
-        for contact in flow_contacts:
-            contact_info = contact.get('contact', {})
-            contact_id = contact_info.get('id')
-            
-            if contact_id:
-                if contact_id in contact_counts:
-                    contact_counts[contact_id] += 1
-                    if contact_id not in duplicate_details:
-                        duplicate_details[contact_id] = []
-                    duplicate_details[contact_id].append(contact.get('id', 'N/A'))
-                else:
-                    contact_counts[contact_id] = 1
-        
-        # Calcular estadísticas
-        total_contacts = len(flow_contacts)
-        unique_contacts = len(contact_counts)
-        duplicates = sum(1 for count in contact_counts.values() if count > 1)
-        total_duplicate_instances = sum(count - 1 for count in contact_counts.values() if count > 1)
-        
-        stats = {
-            'total_contacts': total_contacts,
-            'unique_contacts': unique_contacts,
-            'duplicate_contacts': duplicates,
-            'total_duplicate_instances': total_duplicate_instances,
-            'duplicate_details': duplicate_details
-        }
+        headers = self.get_column_headers()
+        schema = pa.schema([(header, pa.string()) for header in headers])
+        written = 0
+        
+        def to_batch(rows):
+            columns = [[None if row[i] is None else str(row[i]) for row in rows] for i in range(len(headers))]
+            return pa.RecordBatch.from_arrays([pa.array(column, type=pa.string()) for column in columns], schema=schema)
+        
+        def write_batch(writer, rows):
+            with self.tracer.span('write_batch', 'write', rows=len(rows)):
+                writer.write_batch(to_batch(rows))
         
-        return stats
+        with pq.ParquetWriter(filename, schema) as writer:
+            rows = []
+            for values in self.iter_export_rows(data):
+                rows.append(values)
+                if len(rows) >= rows_per_batch:
+                    write_batch(writer, rows)
+                    written += len(rows)
+                    rows = []
+            
+            if rows:
+                write_batch(writer, rows)
+                written += len(rows)
+        
+        logger.info(f"Archivo PARQUET generado: {filename}")
+        logger.info(f"Total de registros únicos: {written}")
+        return written
 
-    def process_all_contacts(self) -> List[Dict[str, Any]]:
+    def _generate_excel_workbook(self, sheets: Iterable[Tuple[str, Iterable[Row]]],
+                                 filename: str) -> Dict[str, int]:
         """
-        Procesar todos los contactos del flujo y extraer la información requerida.
-        Garantiza que cada contacto aparezca solo una vez en el resultado final.
+        Escribir un libro de Excel con una hoja por flujo (openpyxl en modo write-only) y una
+        hoja Resumen con las estadísticas de self.last_batch_stats.
         
+        Args:
+            sheets: Iterador de tuplas (flow_id, filas del flujo)
+            filename: Nombre del archivo Excel
+            
         Returns:
-            Lista de diccionarios con los datos extraídos (sin duplicados)
+            Diccionario flow_id -> número de registros únicos escritos en su hoja
         """
-        # Obtener lista de contactos del flujo
-        flow_contacts = self.get_flow_execution_contacts()
+        workbook = Workbook(write_only=True)
+        headers = self.get_column_headers()
+        written = {}
+        titles = set()
         
-        # Analizar duplicados antes del procesamiento
-        logger.info("Analizando duplicados en el flujo...")
-        duplicate_stats = self.analyze_duplicates(flow_contacts)
+        for flow_id, data in sheets:
+            # Los nombres de hoja admiten 31 caracteres y no pueden repetirse
+            title = re.sub(r'[\[\]:*?/\\]', '_', flow_id)[:31]
+            suffix = 1
+            while title.lower() in titles:
+                suffix += 1
+                title = f"{title[:31 - len(str(suffix)) - 1]}_{suffix}"
+            titles.add(title.lower())
+            
+            sheet = workbook.create_sheet(title)
+            sheet.append(headers)
+            for values in self.iter_export_rows(data):
+                with self.tracer.span('write_row', 'write'):
+                    sheet.append(values)
+            written[flow_id] = self.last_export_count
+            logger.info(f"Hoja {title}: {written[flow_id]} registros")
         
-        logger.info(f"Análisis de duplicados:")
-        logger.info(f"  - Total de registros en el flujo: {duplicate_stats['total_contacts']}")
-        logger.info(f"  - Contactos únicos: {duplicate_stats['unique_contacts']}")
-        logger.info(f"  - Contactos con duplicados: {duplicate_stats['duplicate_contacts']}")
-        logger.info(f"  - Instancias duplicadas totales: {duplicate_stats['total_duplicate_instances']}")
+        stats = self.last_batch_stats
+        summary = workbook.create_sheet('Resumen')
+        summary.append(['Flujo', 'Registros', 'Contactos únicos', 'Contactos con duplicados',
+                        'Instancias duplicadas', 'Filas escritas', 'Contactos sin datos'])
+        for flow_id, flow_stats in stats['flows'].items():
+            summary.append([flow_id, flow_stats['total_contacts'], flow_stats['unique_contacts'],
+                            flow_stats['duplicate_contacts'], flow_stats['total_duplicate_instances'],
+                            written.get(flow_id, 0), flow_stats['failed_contacts']])
+        summary.append([])
+        summary.append(['Contactos únicos en todos los flujos', stats['unique_contacts']])
+        summary.append(['Contactos en más de un flujo', stats['shared_contacts']])
+        summary.append(['Peticiones a la API evitadas', stats['fetches_saved']])
+        
+        with self.tracer.span('workbook_save', 'write', rows=sum(written.values())):
+            workbook.save(filename)
+        logger.info(f"Archivo Excel generado: {filename} ({len(written)} hojas)")
+        return written
+
+    def generate_excel(self, data: Iterable[Row], filename: str = "ccb_data.xlsx") -> int:
+        """
+        Generar archivo Excel con los datos procesados.
         
-        # Set para rastrear contactos únicos procesados
-        processed_contact_ids = set()
-        processed_data = []
-        duplicate_count = 0
+        Con el modo streaming (CCB_STREAMING_WRITER, activo por defecto) las filas se escriben
+        a medida que llegan y solo la fila actual permanece en memoria, por lo que se puede
+        pasar directamente iter_processed_contacts().
         
-        for i, contact in enumerate(flow_contacts, 1):
-            # Extraer el ID del contacto desde contact.id
-            contact_info = contact.get('contact', {})
-            contact_id = contact_info.get('id')
+        Args:
+            data: Filas a exportar (iterador, lista o ColumnarBuffer; ver Row)
+            filename: Nombre del archivo Excel
             
-            if not contact_id:
-                logger.warning(f"Contacto {i} no tiene ID válido. Datos: {contact}")
-                continue
+        Returns:
+            Número de registros únicos escritos
+        """
+        if self.streaming_writer:
+            return self._generate_excel_stream(data, filename)
+        return self._generate_excel_dataframe(data, filename)
+
+    def _generate_excel_stream(self, data: Iterable[Row], filename: str) -> int:
+        """
+        Escribir el Excel fila a fila con openpyxl en modo write-only.
+        
+        Args:
+            data: Iterador de filas (ver Row)
+            filename: Nombre del archivo Excel
             
-            # Verificar si ya procesamos este contacto
-            if contact_id in processed_contact_ids:
-                duplicate_count += 1
-                logger.debug(f"Contacto duplicado omitido: {contact_id}")
-                continue
+        Returns:
+            Número de registros únicos escritos
+        """
+        try:
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet('Sheet1')
             
-            # Marcar como procesado
-            processed_contact_ids.add(contact_id)
+            headers = self.get_column_headers()
+            sheet.append(headers)
             
-            logger.info(f"Procesando contacto único {len(processed_contact_ids)}/{duplicate_stats['unique_contacts']}: {contact_id}")
+            written = 0
+            for values in self.iter_export_rows(data):
+                with self.tracer.span('write_row', 'write'):
+                    sheet.append(values)
+                written += 1
             
-            # Obtener detalles del contacto
-            contact_details = self.get_contact_details(contact_id)
-            if not contact_details:
-                logger.warning(f"No se pudieron obtener detalles para el contacto {contact_id}")
-                continue
+            with self.tracer.span('workbook_save', 'write', rows=written):
+                workbook.save(filename)
+            logger.info(f"Archivo Excel generado: {filename}")
+            logger.info(f"Total de registros únicos: {written}")
+            logger.info(f"Total de columnas: {len(headers)}")
             
-            # Extraer datos requeridos
-            extracted_data = self.extract_contact_data(contact_details)
-            processed_data.append(extracted_data)
+            return written
             
-            # Pequeña pausa para no sobrecargar la API
-            time.sleep(0.1)
-        
-        logger.info(f"Procesamiento completado:")
-        logger.info(f"  - Total de registros en el flujo: {duplicate_stats['total_contacts']}")
-        logger.info(f"  - Contactos únicos procesados: {len(processed_data)}")
-        logger.info(f"  - Duplicados omitidos: {duplicate_count}")
-        
-        return processed_data
+        except Exception as e:
+            logger.error(f"Error al generar archivo Excel: {e}")
+            raise
 
-    def generate_excel(self, data: List[Dict[str, Any]], filename: str = "ccb_data.xlsx"):
+    def _generate_excel_dataframe(self, data: Iterable[Row], filename: str) -> int:
         """
-        Generar archivo Excel con los datos procesados.
+        Generar el Excel construyendo un DataFrame de pandas con todos los datos.
         
         Args:
-            data: Lista de diccionarios con los datos
+            data: Filas a exportar (iterador, lista o ColumnarBuffer; ver Row)
             filename: Nombre del archivo Excel
+            
+        Returns:
+            Número de registros únicos escritos
         """
         try:
-            # Crear DataFrame
-            df = pd.DataFrame(data)
-            
-            # Asegurar que todas las columnas requeridas estén presentes
-            for col in self.required_columns:
-                if col not in df.columns:
-                    df[col] = ''
-            
-            # Reordenar columnas según el orden requerido
-            df = df[self.required_columns]
-            
-            # Verificar duplicados en el DataFrame final (por si acaso)
-            initial_count = len(df)
-            df_unique = df.drop_duplicates(subset=['phone'], keep='first')
-            final_count = len(df_unique)
-            
-            if initial_count != final_count:
-                logger.warning(f"Se encontraron {initial_count - final_count} duplicados adicionales en el DataFrame final")
-                df = df_unique
-            
-            # Crear mapeo de nombres de columnas a encabezados
-            column_headers = {}
-            for col in df.columns:
-                if col in self.field_mapping:
-                    column_headers[col] = self.field_mapping[col]
-                    logger.debug(f"Mapeo de columna: {col} -> {self.field_mapping[col]}")
-                else:
-                    # Si no hay mapeo, usar el nombre original de la columna
-                    column_headers[col] = col
-                    logger.warning(f"No se encontró mapeo para la columna: {col}")
-            
-            # Renombrar las columnas con los encabezados
-            df_renamed = df.rename(columns=column_headers)
+            # Las filas ya vienen en columnas si son el resultado de get_changed_contacts
+            if isinstance(data, ColumnarBuffer) and data.columns == self.required_columns:
+                buffer = data
+            else:
+                buffer = ColumnarBuffer(self.required_columns)
+                buffer.extend(self._row_values(row) for row in data)
+
+            with self.tracer.span('build_dataframe', 'cpu', rows=len(buffer)):
+                # Crear DataFrame (una columna por lista, en el orden requerido)
+                df = buffer.to_dataframe()
+
+                # Verificar duplicados en el DataFrame final (por si acaso)
+                initial_count = len(df)
+                df_unique = df.drop_duplicates(subset=['phone'], keep='first') if 'phone' in df.columns else df
+                final_count = len(df_unique)
+                
+                if initial_count != final_count:
+                    logger.warning(f"Se encontraron {initial_count - final_count} duplicados adicionales en el DataFrame final")
+                    df = df_unique
+                
+                # Renombrar las columnas con los encabezados
+                df_renamed = df.rename(columns=dict(zip(self.required_columns, self.get_column_headers())))
             
             # Guardar en Excel
-            df_renamed.to_excel(filename, index=False)
+            with self.tracer.span('to_excel', 'write', rows=len(df_renamed)):
+                df_renamed.to_excel(filename, index=False)
             logger.info(f"Archivo Excel generado: {filename}")
             logger.info(f"Total de registros únicos: {len(df_renamed)}")
             logger.info(f"Total de columnas: {len(df_renamed.columns)}")
@@ -395,6 +2033,8 @@ class CCBDataExtractor:
             for i, header in enumerate(df_renamed.columns[:5]):
                 logger.info(f"  {i+1}. {header}")
             
+            return len(df_renamed)
+            
         except Exception as e:
             logger.error(f"Error al generar archivo Excel: {e}")
             raise
@@ -411,8 +2051,7 @@ class CCBDataExtractor:
             params = {'flow': self.flow_id}
             
             logger.info("Probando endpoint flow-execution-contact...")
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
+            response = self._get(url, params=params)
             data = response.json()
             
             logger.info(f"Estructura de flow-execution-contact:")
@@ -453,13 +2092,16 @@ class CCBDataExtractor:
         except Exception as e:
             logger.error(f"Error en prueba de API: {e}")
 
-    def run(self, output_filename: str = "ccb_data.xlsx", test_mode: bool = False):
+    def run(self, output_filename: str = "ccb_data.xlsx", test_mode: bool = False, export_format: str = 'xlsx',
+            checkpoint: ExportCheckpoint = None):
         """
         Ejecutar el proceso completo.
         
         Args:
             output_filename: Nombre del archivo de salida
             test_mode: Si es True, solo ejecuta pruebas sin generar Excel
+            export_format: Formato del archivo de salida (ver EXPORT_FORMATS)
+            checkpoint: Checkpoint para continuar una ejecución interrumpida (opcional)
         """
         try:
             logger.info("Iniciando proceso de extracción de datos CCB")
@@ -468,16 +2110,14 @@ class CCBDataExtractor:
                 self.test_api_response()
                 return
             
-            # Procesar todos los contactos
-            processed_data = self.process_all_contacts()
+            # Procesar los contactos y escribir el archivo a medida que llegan
+            record_count = self.export(self.iter_processed_contacts(checkpoint), output_filename, export_format)
             
-            if not processed_data:
+            if not record_count:
                 logger.warning("No se encontraron datos para procesar")
+                os.remove(output_filename)
                 return
             
-            # Generar archivo Excel
-            self.generate_excel(processed_data, output_filename)
-            
             logger.info("Proceso completado exitosamente")
             
         except Exception as e:
@@ -490,7 +2130,6 @@ def main():
     Función principal del script.
     """
     import sys
-    import os
     
     # Usar variables de entorno para configuración
     AUTH_TOKEN = os.getenv('HILOS_API_TOKEN')
@@ -500,18 +2139,76 @@ def main():
         logger.error("Configúralo con: export HILOS_API_TOKEN='tu-token-aqui'")
         sys.exit(1)
     
-    # Crear instancia del extractor (usará env vars automáticamente)
-    extractor = CCBDataExtractor()
+    parser = argparse.ArgumentParser(description="Exportar los datos del flujo CCB")
+    parser.add_argument('--test', action='store_true', help="Solo probar la estructura de la API")
+    parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='xlsx',
+                        help="Formato del archivo de salida (por defecto: xlsx)")
+    parser.add_argument('--flows', nargs='+', metavar='FLOW_ID',
+                        help="Exportar varios flujos a la vez pidiendo cada contacto una sola vez "
+                             "(xlsx: una hoja por flujo; otros formatos: un archivo por flujo)")
+    parser.add_argument('--partitioned', action='store_true',
+                        help="Con --flows, generar un archivo por flujo también en xlsx")
+    parser.add_argument('--since', metavar='CURSOR',
+                        help="Exportar solo los contactos nuevos o modificados desde un cursor (o fecha ISO) "
+                             "a ccb_delta.<formato>; imprime el cursor para la siguiente ejecución")
+    parser.add_argument('--resume', action='store_true',
+                        help="Guardar checkpoints en CCB_CHECKPOINT_STORE y, si una ejecución anterior "
+                             "quedó incompleta, continuar desde el último")
+    parser.add_argument('--profile', action='store_true',
+                        help="Perfilar cada etapa: guarda un trace de Chrome y muestra un resumen")
+    parser.add_argument('--profile-output', default='ccb_profile.json',
+                        help="Archivo del trace de Chrome (por defecto: ccb_profile.json)")
+    args = parser.parse_args()
+    format_error = export_format_error(args.export_format)
+    if format_error:
+        parser.error(format_error)
     
-    # Verificar si se solicita modo de prueba
-    test_mode = len(sys.argv) > 1 and sys.argv[1] == "--test"
+    # Crear instancia del extractor (usará env vars automáticamente)
+    tracer = tracing.Tracer() if args.profile else None
+    extractor = CCBDataExtractor(tracer=tracer)
+    output_filename = f"ccb_data{EXPORT_FORMATS[args.export_format]['extension']}"
     
-    if test_mode:
-        logger.info("Ejecutando en modo de prueba...")
-        extractor.run("ccb_data.xlsx", test_mode=True)
-    else:
-        logger.info("Ejecutando proceso completo...")
-        extractor.run("ccb_data.xlsx")
+    try:
+        if args.test:
+            logger.info("Ejecutando en modo de prueba...")
+            extractor.run(output_filename, test_mode=True)
+        elif args.flows:
+            flow_ids = [flow_id for value in args.flows for flow_id in value.split(',') if flow_id]
+            logger.info(f"Exportando {len(flow_ids)} flujos...")
+            result = extractor.export_batch(flow_ids, 'ccb_batch', args.export_format, args.partitioned)
+            for filename in result['files']:
+                logger.info(f"Archivo generado: {filename}")
+        elif args.since is not None:
+            try:
+                rows, cursor = extractor.get_changed_contacts(args.since or None)
+            except ValueError as e:
+                logger.error(str(e))
+                sys.exit(1)
+            delta_filename = f"ccb_delta{EXPORT_FORMATS[args.export_format]['extension']}"
+            record_count = extractor.export(rows, delta_filename, args.export_format)
+            logger.info(f"Archivo generado: {delta_filename} ({record_count} registros)")
+            print(cursor)
+        else:
+            logger.info("Ejecutando proceso completo...")
+            checkpoint = None
+            if args.resume:
+                store = CheckpointStore(os.getenv('CCB_CHECKPOINT_STORE') or 'ccb_checkpoints.db',
+                                        max_age=float(os.getenv('CCB_CHECKPOINT_MAX_AGE', '3600')))
+                checkpoint = ExportCheckpoint(store, f"cli:{extractor.flow_id}",
+                                              interval=float(os.getenv('CCB_CHECKPOINT_INTERVAL', '30')))
+                if not checkpoint.claim():
+                    logger.error("Otra ejecución está usando el checkpoint de este flujo")
+                    sys.exit(1)
+            try:
+                extractor.run(output_filename, export_format=args.export_format, checkpoint=checkpoint)
+            finally:
+                if checkpoint is not None:
+                    checkpoint.release()
+    finally:
+        if tracer is not None:
+            tracer.write_chrome_trace(args.profile_output)
+            print(tracing.format_summary(tracer.summary()))
+            logger.info(f"Trace guardado en {args.profile_output} (ábrelo en chrome://tracing o ui.perfetto.dev)")
 
 
 if __name__ == "__main__":
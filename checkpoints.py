@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Checkpoints de exportaciones (SQLite): guardan periódicamente hasta dónde llegó
+una exportación (página siguiente del flujo, contactos ya vistos, fallidos y filas
+extraídas) para que un trabajo reiniciado, reintentado o cancelado continúe desde
+ese punto en lugar de volver a empezar desde la primera página.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    def __init__(self, path: str = 'ccb_checkpoints.db', max_age: float = 3600):
+        """
+        Abrir (o crear) el almacén de checkpoints.
+
+        Args:
+            path: Ruta del archivo SQLite
+            max_age: Segundos tras los cuales un checkpoint sin actualizar se descarta
+                     (los datos del flujo pueden haber cambiado; 0 = sin expiración)
+        """
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        # Una sola conexión compartida entre hilos, serializada con el lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                row_count INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoint_rows (
+                key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                row TEXT NOT NULL,
+                PRIMARY KEY (key, seq)
+            )
+        """)
+        self._conn.commit()
+        logger.info(f"Almacén de checkpoints abierto: {path}")
+
+    def claim(self, key: str, owner: str, lease: float) -> bool:
+        """
+        Reservar un checkpoint para una ejecución, para que otro proceso no continúe
+        el mismo trabajo a la vez.
+
+        Args:
+            key: Identificador del checkpoint (ID del trabajo)
+            owner: Identificador de la ejecución que lo reserva
+            lease: Segundos que dura la reserva si no se renueva al guardar
+
+        Returns:
+            True si se obtuvo la reserva, False si otra ejecución la tiene vigente
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute("""
+                INSERT INTO checkpoints (key, owner, lease_until, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until,
+                                               cancel_requested = 0
+                WHERE checkpoints.owner IS NULL OR checkpoints.owner = excluded.owner
+                      OR checkpoints.lease_until < ?
+            """, (key, owner, now + lease, now, now))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def release(self, key: str, owner: str):
+        """Liberar la reserva de un checkpoint (el estado guardado se conserva)"""
+        with self._lock:
+            self._conn.execute('UPDATE checkpoints SET owner = NULL, lease_until = 0 WHERE key = ? AND owner = ?',
+                               (key, owner))
+            self._conn.commit()
+
+    def request_cancel(self, key: str) -> bool:
+        """
+        Pedir a la ejecución que tiene reservado el checkpoint (en cualquier proceso) que se detenga.
+
+        Args:
+            key: Identificador del checkpoint
+
+        Returns:
+            True si hay una ejecución en curso que recibirá la petición
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE checkpoints SET cancel_requested = 1 WHERE key = ? AND owner IS NOT NULL AND lease_until >= ?',
+                (key, time.time())
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def cancel_requested(self, key: str, owner: str) -> bool:
+        """Indica si se pidió cancelar la ejecución `owner` del checkpoint"""
+        with self._lock:
+            record = self._conn.execute('SELECT cancel_requested FROM checkpoints WHERE key = ? AND owner = ?',
+                                        (key, owner)).fetchone()
+        return bool(record and record[0])
+
+    def is_claimed(self, key: str) -> bool:
+        """Indica si alguna ejecución tiene reservado el checkpoint"""
+        with self._lock:
+            record = self._conn.execute('SELECT lease_until FROM checkpoints WHERE key = ? AND owner IS NOT NULL',
+                                        (key,)).fetchone()
+        return record is not None and record[0] >= time.time()
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            key: Identificador del checkpoint
+
+        Returns:
+            Estado guardado (con row_count), o None si no existe o expiró
+        """
+        with self._lock:
+            record = self._conn.execute('SELECT state, row_count, updated_at FROM checkpoints WHERE key = ?',
+                                        (key,)).fetchone()
+
+        if record is None or record[0] is None:
+            return None
+
+        state, row_count, updated_at = record
+        if self.max_age and time.time() - updated_at > self.max_age:
+            logger.info(f"Checkpoint {key} expirado, se descarta")
+            self.delete(key, keep_claim=True)
+            return None
+        return dict(json.loads(state), row_count=row_count)
+
+    def exists(self, key: str) -> bool:
+        """Indica si hay un estado guardado (vigente) para continuar"""
+        return self.load(key) is not None
+
+    def save(self, key: str, owner: str, lease: float, state: Dict[str, Any], rows: List[List[Any]]):
+        """
+        Guardar el estado y agregar las filas extraídas desde el checkpoint anterior,
+        en una sola transacción (el estado y las filas quedan siempre de acuerdo).
+
+        Args:
+            key: Identificador del checkpoint
+            owner: Ejecución que guarda (renueva su reserva)
+            lease: Segundos de la reserva renovada
+            state: Estado serializable en JSON
+            rows: Filas nuevas desde el último guardado
+        """
+        now = time.time()
+        with self._lock:
+            record = self._conn.execute('SELECT row_count FROM checkpoints WHERE key = ?', (key,)).fetchone()
+            row_count = record[0] if record else 0
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO checkpoint_rows (key, seq, row) VALUES (?, ?, ?)',
+                ((key, row_count + i, json.dumps(row, default=str)) for i, row in enumerate(rows))
+            )
+            self._conn.execute("""
+                INSERT INTO checkpoints (key, state, row_count, owner, lease_until, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, row_count = excluded.row_count,
+                                               owner = excluded.owner, lease_until = excluded.lease_until,
+                                               updated_at = excluded.updated_at
+            """, (key, json.dumps(state, default=str), row_count + len(rows), owner, now + lease, now))
+            self._conn.commit()
+
+    def iter_rows(self, key: str, limit: int, batch_size: int = 1000) -> Iterator[List[Any]]:
+        """
+        Recorrer las filas guardadas de un checkpoint, en orden.
+
+        Args:
+            key: Identificador del checkpoint
+            limit: Número de filas confirmadas por el último guardado (las posteriores se ignoran)
+            batch_size: Filas leídas por consulta
+
+        Yields:
+            Valores de cada fila
+        """
+        seq = 0
+        while seq < limit:
+            with self._lock:
+                records = self._conn.execute(
+                    'SELECT row FROM checkpoint_rows WHERE key = ? AND seq >= ? AND seq < ? ORDER BY seq',
+                    (key, seq, min(limit, seq + batch_size))
+                ).fetchall()
+            if not records:
+                return
+            for (row,) in records:
+                yield json.loads(row)
+            seq += len(records)
+
+    def delete(self, key: str, keep_claim: bool = False):
+        """
+        Eliminar el estado y las filas de un checkpoint.
+
+        Args:
+            key: Identificador del checkpoint
+            keep_claim: Conservar la reserva de la ejecución actual
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM checkpoint_rows WHERE key = ?', (key,))
+            if keep_claim:
+                self._conn.execute('UPDATE checkpoints SET state = NULL, row_count = 0 WHERE key = ?', (key,))
+            else:
+                self._conn.execute('DELETE FROM checkpoints WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def expire(self) -> int:
+        """
+        Eliminar los checkpoints expirados que nadie tiene reservados.
+
+        Returns:
+            Número de checkpoints eliminados
+        """
+        if not self.max_age:
+            return 0
+        now = time.time()
+        with self._lock:
+            keys = [key for (key,) in self._conn.execute(
+                'SELECT key FROM checkpoints WHERE updated_at < ? AND lease_until < ?', (now - self.max_age, now)
+            ).fetchall()]
+            for key in keys:
+                self._conn.execute('DELETE FROM checkpoint_rows WHERE key = ?', (key,))
+                self._conn.execute('DELETE FROM checkpoints WHERE key = ?', (key,))
+            self._conn.commit()
+        if keys:
+            logger.info(f"Checkpoints expirados eliminados: {len(keys)}")
+        return len(keys)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ExportCheckpoint:
+    """
+    Checkpoint de una exportación concreta. El extractor marca un límite al terminar
+    de deduplicar una página (marcando el estado de la paginación en ese punto) y el
+    checkpoint se guarda cuando todas las filas hasta ese límite se han procesado,
+    como mucho una vez cada `interval` segundos.
+    """
+
+    def __init__(self, store: CheckpointStore, key: str, interval: float = 30.0, lease: float = 300.0):
+        """
+        Args:
+            store: Almacén de checkpoints
+            key: Identificador del checkpoint (ID del trabajo)
+            interval: Segundos mínimos entre dos guardados
+            lease: Segundos de la reserva (se renueva en cada guardado)
+        """
+        self.store = store
+        self.key = key
+        self.interval = interval
+        self.lease = max(lease, interval * 2)
+        self.owner = f'{os.getpid()}:{uuid.uuid4().hex}'
+        self._rows = []
+        self._pending = None
+        self._saved_at = time.time()
+
+    def claim(self) -> bool:
+        """Reservar el checkpoint para esta ejecución (False si otra lo está usando)"""
+        return self.store.claim(self.key, self.owner, self.lease)
+
+    def release(self):
+        self.store.release(self.key, self.owner)
+
+    def cancel_requested(self) -> bool:
+        """Indica si otro proceso pidió cancelar esta ejecución (ver CheckpointStore.request_cancel)"""
+        return self.store.cancel_requested(self.key, self.owner)
+
+    def load(self, signature: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            signature: Datos que deben coincidir para continuar (flujo, columnas)
+
+        Returns:
+            Estado guardado, o None si no hay checkpoint o es de otra exportación
+        """
+        state = self.store.load(self.key)
+        if state is not None and state.get('signature') != signature:
+            logger.info(f"El checkpoint {self.key} es de otra exportación (flujo o columnas distintos), se descarta")
+            self.store.delete(self.key, keep_claim=True)
+            return None
+        return state
+
+    def rows(self, state: Dict[str, Any]) -> Iterator[List[Any]]:
+        """Filas ya extraídas hasta el checkpoint cargado"""
+        return self.store.iter_rows(self.key, state['row_count'])
+
+    def due(self) -> bool:
+        """Indica si conviene marcar un nuevo límite (pasó el intervalo y no hay otro pendiente)"""
+        return self._pending is None and time.time() - self._saved_at >= self.interval
+
+    def mark(self, position: int, state: Dict[str, Any]):
+        """
+        Marcar un límite: el estado se guardará cuando se procese la fila número `position`.
+
+        Args:
+            position: Número de contactos únicos hasta el final de la página
+            state: Estado de la paginación en ese punto
+        """
+        self._pending = (position, state)
+
+    def add_row(self, row: List[Any]):
+        """Anotar una fila extraída (se guarda con el próximo checkpoint)"""
+        self._rows.append(row)
+
+    def reached(self, position: int, **state) -> bool:
+        """
+        Guardar el checkpoint si `position` es el límite marcado.
+
+        Args:
+            position: Número de contactos únicos ya procesados
+            state: Estado del procesamiento en ese punto (contadores, fallidos)
+
+        Returns:
+            True si se guardó
+        """
+        if self._pending is None or self._pending[0] != position:
+            return False
+        self.store.save(self.key, self.owner, self.lease, dict(self._pending[1], **state), self._rows)
+        logger.info(f"Checkpoint guardado: {position} contactos únicos procesados")
+        self._rows = []
+        self._pending = None
+        self._saved_at = time.time()
+        return True
+
+    def finish(self):
+        """Eliminar el checkpoint (y su reserva) tras completar la exportación"""
+        self.store.delete(self.key)
+        self._rows = []
+        self._pending = None
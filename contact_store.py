@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Almacén local (SQLite) de contactos de Hilos para exportaciones incrementales.
+Guarda el detalle crudo de cada contacto, la fila extraída y la versión con la
+que se obtuvo, para que una nueva exportación solo pida a la API los contactos
+nuevos o modificados.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ContactStore:
+    def __init__(self, path: str = 'ccb_contacts.db', max_age: float = 0):
+        """
+        Abrir (o crear) el almacén de contactos.
+
+        Args:
+            path: Ruta del archivo SQLite
+            max_age: Segundos tras los cuales un contacto se vuelve a pedir aunque
+                     no haya cambiado (0 = sin expiración)
+        """
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        # Una sola conexión compartida entre hilos, serializada con el lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS contacts (
+                contact_id TEXT PRIMARY KEY,
+                version TEXT,
+                payload TEXT NOT NULL,
+                row TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        logger.info(f"Almacén de contactos abierto: {path}")
+
+    def get(self, contact_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtener un contacto guardado.
+
+        Args:
+            contact_id: ID del contacto
+
+        Returns:
+            Diccionario con version, payload, row, fetched_at y updated_at, o None si no existe
+        """
+        with self._lock:
+            record = self._conn.execute(
+                'SELECT version, payload, row, fetched_at, updated_at FROM contacts WHERE contact_id = ?',
+                (contact_id,)
+            ).fetchone()
+
+        if record is None:
+            return None
+
+        version, payload, row, fetched_at, updated_at = record
+        return {
+            'version': version,
+            'payload': json.loads(payload),
+            'row': json.loads(row),
+            'fetched_at': fetched_at,
+            'updated_at': updated_at
+        }
+
+    def get_fresh(self, contact_id: str, version: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtener un contacto guardado solo si sigue vigente: misma versión y,
+        si hay max_age configurado, obtenido hace menos de max_age segundos.
+
+        Args:
+            contact_id: ID del contacto
+            version: Versión actual del contacto según el listado del flujo
+
+        Returns:
+            Contacto guardado, o None si hay que volver a pedirlo a la API
+        """
+        cached = self.get(contact_id)
+        if cached is None or cached['version'] != version:
+            return None
+
+        if self.max_age and time.time() - cached['fetched_at'] > self.max_age:
+            return None
+
+        return cached
+
+    def save(self, contact_id: str, version: str, payload: Dict[str, Any], row: Dict[str, Any]):
+        """
+        Guardar (o actualizar) un contacto.
+        updated_at solo cambia cuando el detalle del contacto es distinto al guardado.
+
+        Args:
+            contact_id: ID del contacto
+            version: Versión del contacto según el listado del flujo
+            payload: Detalle crudo devuelto por la API
+            row: Fila extraída con los campos requeridos
+        """
+        now = time.time()
+        payload_json = json.dumps(payload, sort_keys=True, default=str)
+        row_json = json.dumps(row, default=str)
+
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO contacts (contact_id, version, payload, row, fetched_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(contact_id) DO UPDATE SET
+                    version = excluded.version,
+                    row = excluded.row,
+                    fetched_at = excluded.fetched_at,
+                    updated_at = CASE WHEN contacts.payload = excluded.payload
+                                      THEN contacts.updated_at ELSE excluded.updated_at END,
+                    payload = excluded.payload
+            """, (contact_id, version, payload_json, row_json, now, now))
+            self._conn.commit()
+
+    def count(self) -> int:
+        """
+        Returns:
+            Número de contactos guardados
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM contacts').fetchone()[0]
+
+    def close(self):
+        """Cerrar la conexión con la base de datos"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Copia local (SQLite) de las filas extraídas en la última exportación completa
+de cada flujo, indexada por columna y valor. Permite servir exportaciones con
+solo algunas columnas o filtradas por igualdad/IN (por ejemplo, las personas
+de una localidad) en milisegundos, sin volver a llamar a la API de Hilos.
+
+Cada exportación completa escribe una generación nueva de filas y, al terminar,
+la publica como la vigente del flujo en una sola transacción: las consultas
+nunca ven una copia a medias, y una exportación cancelada o fallida se descarta.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List, Iterable, Iterator, Sequence, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Generaciones sin publicar más antiguas que esto se consideran abandonadas (proceso detenido a mitad)
+ABANDONED_GENERATION_AGE = 24 * 3600
+
+
+def _index_value(value: Any) -> str:
+    """Valor de una celda tal como se compara en los filtros (texto; vacío si no hay valor)"""
+    return '' if value is None else str(value)
+
+
+class RowDataset:
+    def __init__(self, path: str = 'ccb_dataset.db'):
+        """
+        Abrir (o crear) la copia local de filas.
+
+        Args:
+            path: Ruta del archivo SQLite
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        # Una sola conexión compartida entre hilos, serializada con el lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS generations (
+                generation INTEGER PRIMARY KEY AUTOINCREMENT,
+                flow_id TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                flow_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                columns TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dataset_rows (
+                generation INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                row TEXT NOT NULL,
+                PRIMARY KEY (generation, seq)
+            );
+            CREATE TABLE IF NOT EXISTS dataset_values (
+                generation INTEGER NOT NULL,
+                column_name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                seq INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_dataset_values
+                ON dataset_values (generation, column_name, value, seq);
+        """)
+        self._conn.commit()
+        logger.info(f"Dataset local abierto: {path}")
+
+    def snapshot(self, flow_id: str, columns: List[str]) -> 'DatasetSnapshot':
+        """
+        Empezar una copia nueva de las filas de un flujo (ver DatasetSnapshot).
+
+        Args:
+            flow_id: ID del flujo
+            columns: Columnas de las filas, en su orden (required_columns del extractor)
+
+        Returns:
+            DatasetSnapshot sin publicar
+        """
+        with self._lock:
+            cursor = self._conn.execute('INSERT INTO generations (flow_id, created_at) VALUES (?, ?)',
+                                        (flow_id, time.time()))
+            self._conn.commit()
+        return DatasetSnapshot(self, flow_id, list(columns), cursor.lastrowid)
+
+    def info(self, flow_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Datos de la copia vigente de un flujo.
+
+        Args:
+            flow_id: ID del flujo
+
+        Returns:
+            Diccionario con columns, row_count y updated_at, o None si todavía no hay copia
+        """
+        with self._lock:
+            record = self._conn.execute(
+                'SELECT columns, row_count, updated_at FROM snapshots WHERE flow_id = ?', (flow_id,)
+            ).fetchone()
+        if record is None:
+            return None
+        columns, row_count, updated_at = record
+        return {'columns': json.loads(columns), 'row_count': row_count, 'updated_at': updated_at}
+
+    def query(self, flow_id: str, columns: List[str] = None,
+              filters: Dict[str, Sequence[Any]] = None) -> List[List[Any]]:
+        """
+        Obtener las filas de la copia vigente de un flujo que cumplen los filtros,
+        en el orden de la exportación. Cada filtro usa el índice por columna y valor.
+
+        Args:
+            flow_id: ID del flujo
+            columns: Columnas a devolver, en ese orden (opcional, todas)
+            filters: Columna -> valores aceptados (igualdad con uno, IN con varios); se
+                     cumplen todos a la vez. Los valores se comparan como texto
+
+        Returns:
+            Valores de cada fila en el orden de columns
+
+        Raises:
+            LookupError: Si el flujo todavía no tiene copia local
+            ValueError: Si una columna pedida o filtrada no existe en la copia
+        """
+        with self._lock:
+            record = self._conn.execute(
+                'SELECT generation, columns FROM snapshots WHERE flow_id = ?', (flow_id,)
+            ).fetchone()
+        if record is None:
+            raise LookupError(f"No hay datos locales del flujo {flow_id}")
+
+        generation, available = record[0], json.loads(record[1])
+        columns = list(columns or available)
+        filters = {column: list(values) for column, values in (filters or {}).items()}
+        unknown = [column for column in list(columns) + list(filters) if column not in available]
+        if unknown:
+            raise ValueError(f"Columnas no disponibles: {', '.join(dict.fromkeys(unknown))}")
+
+        sql = 'SELECT row FROM dataset_rows WHERE generation = ?'
+        params = [generation]
+        for column, values in filters.items():
+            if not values:
+                return []
+            placeholders = ', '.join('?' * len(values))
+            sql += (f' AND seq IN (SELECT seq FROM dataset_values WHERE generation = ?'
+                    f' AND column_name = ? AND value IN ({placeholders}))')
+            params.extend([generation, column])
+            params.extend(_index_value(value) for value in values)
+        sql += ' ORDER BY seq'
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        result = []
+        for (row_json,) in rows:
+            row = json.loads(row_json)
+            result.append([row.get(column, '') for column in columns])
+        return result
+
+    def close(self):
+        """Cerrar la conexión con la base de datos"""
+        with self._lock:
+            self._conn.close()
+
+
+class DatasetSnapshot:
+    """
+    Copia en construcción de las filas de un flujo. Se llena con tee() mientras se
+    exporta y solo reemplaza a la vigente al llamar a commit(); close() la descarta
+    si no se publicó.
+
+    Como la exportación, omite las filas con un teléfono ya visto, para que la copia
+    tenga exactamente las filas del archivo exportado.
+    """
+
+    def __init__(self, dataset: RowDataset, flow_id: str, columns: List[str], generation: int,
+                 batch_size: int = 1000):
+        self.dataset = dataset
+        self.flow_id = flow_id
+        self.columns = columns
+        self.generation = generation
+        self.batch_size = batch_size
+        self.row_count = 0
+        self.committed = False
+        self._phone_slot = columns.index('phone') if 'phone' in columns else None
+        self._seen_phones = set()
+        self._pending = []
+
+    def tee(self, rows: Iterable[Union[Sequence[Any], Dict[str, Any]]]) -> Iterator[Any]:
+        """
+        Guardar cada fila en la copia y entregarla sin cambios.
+
+        Args:
+            rows: Filas de la exportación (valores en el orden de columns o diccionarios)
+
+        Yields:
+            Las mismas filas
+        """
+        for row in rows:
+            self.add(row)
+            yield row
+
+    def add(self, row: Union[Sequence[Any], Dict[str, Any]]):
+        """Agregar una fila a la copia (se escribe por lotes)"""
+        values = [row.get(column, '') for column in self.columns] if isinstance(row, dict) else list(row)
+        if self._phone_slot is not None:
+            # Mismo criterio que CCBDataExtractor.iter_export_rows
+            phone = values[self._phone_slot]
+            if isinstance(phone, (list, dict, tuple, set)):
+                phone = str(phone)
+            if phone in self._seen_phones:
+                return
+            self._seen_phones.add(phone)
+
+        self.row_count += 1
+        self._pending.append((self.row_count, values))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def commit(self):
+        """Publicar la copia como la vigente del flujo y eliminar la anterior"""
+        self._flush()
+        dataset = self.dataset
+        now = time.time()
+        with dataset._lock:
+            conn = dataset._conn
+            previous = conn.execute('SELECT generation FROM snapshots WHERE flow_id = ?',
+                                    (self.flow_id,)).fetchone()
+            conn.execute("""
+                INSERT INTO snapshots (flow_id, generation, columns, row_count, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(flow_id) DO UPDATE SET generation = excluded.generation, columns = excluded.columns,
+                                                   row_count = excluded.row_count, updated_at = excluded.updated_at
+            """, (self.flow_id, self.generation, json.dumps(self.columns), self.row_count, now))
+            stale = [previous[0]] if previous else []
+            stale.extend(generation for (generation,) in conn.execute(
+                'SELECT generation FROM generations WHERE flow_id = ? AND generation != ? AND created_at < ?'
+                ' AND generation NOT IN (SELECT generation FROM snapshots)',
+                (self.flow_id, self.generation, now - ABANDONED_GENERATION_AGE)
+            ))
+            for generation in stale:
+                self._delete_generation(conn, generation)
+            conn.commit()
+        self.committed = True
+        self._seen_phones.clear()
+        logger.info(f"Dataset local del flujo {self.flow_id} actualizado: {self.row_count} filas")
+
+    def close(self):
+        """Descartar la copia si no se publicó (exportación cancelada o con error)"""
+        if self.committed:
+            return
+        self._pending = []
+        with self.dataset._lock:
+            self._delete_generation(self.dataset._conn, self.generation)
+            self.dataset._conn.commit()
+
+    def _flush(self):
+        """Escribir las filas pendientes y sus entradas del índice"""
+        if not self._pending:
+            return
+        rows = [(self.generation, seq, json.dumps(dict(zip(self.columns, values)), default=str))
+                for seq, values in self._pending]
+        index = [(self.generation, column, _index_value(value), seq)
+                 for seq, values in self._pending for column, value in zip(self.columns, values)]
+        with self.dataset._lock:
+            conn = self.dataset._conn
+            conn.executemany('INSERT INTO dataset_rows (generation, seq, row) VALUES (?, ?, ?)', rows)
+            conn.executemany('INSERT INTO dataset_values (generation, column_name, value, seq) VALUES (?, ?, ?, ?)',
+                             index)
+            conn.commit()
+        self._pending = []
+
+    @staticmethod
+    def _delete_generation(conn: sqlite3.Connection, generation: int):
+        conn.execute('DELETE FROM dataset_values WHERE generation = ?', (generation,))
+        conn.execute('DELETE FROM dataset_rows WHERE generation = ?', (generation,))
+        conn.execute('DELETE FROM generations WHERE generation = ?', (generation,))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Caché en disco de la última exportación generada por flujo y formato.
+Las entradas dentro del TTL se consideran frescas; las vencidas se siguen
+sirviendo (stale-while-revalidate) mientras se regeneran en segundo plano.
+
+Los archivos se guardan con el digest de su contenido como nombre: si una
+exportación nueva tiene los mismos datos que la anterior, se conserva el mismo
+archivo (mismos bytes, ETag y fecha de modificación), de modo que los clientes
+pueden revalidar con If-None-Match o continuar una descarga por rangos.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Hashable, Optional
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ExportCache:
+    def __init__(self, directory: str = None, ttl: float = 300, max_bytes: int = 200 * 1024 * 1024):
+        """
+        Inicializar la caché.
+
+        Args:
+            directory: Carpeta donde se guardan los archivos (opcional, usa una carpeta temporal)
+            ttl: Segundos durante los cuales una exportación se considera fresca
+            max_bytes: Tamaño máximo total de los archivos en caché
+        """
+        self.directory = directory or tempfile.mkdtemp(prefix='ccb_export_cache_')
+        os.makedirs(self.directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Buscar la última exportación de una clave.
+
+        Args:
+            key: Clave de la exportación, por ejemplo (flow_id, formato)
+
+        Returns:
+            Copia de la entrada con filename, record_count, etag, created_at, modified_at y fresh,
+            o None si no hay
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry['filename']):
+                self._entries.pop(key, None)
+                self.misses += 1
+                metrics.EXPORT_CACHE_REQUESTS.inc(result='miss')
+                return None
+
+            entry['last_access'] = time.time()
+            fresh = time.time() - entry['created_at'] <= self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            metrics.EXPORT_CACHE_REQUESTS.inc(result='hit' if fresh else 'stale')
+            return dict(entry, fresh=fresh)
+
+    def put(self, key: Hashable, source_filename: str, record_count: int, digest: str = None) -> Dict[str, Any]:
+        """
+        Guardar una exportación recién generada, reemplazando la anterior de la misma clave.
+        La caché guarda su propia copia (enlace duro si es posible) del archivo.
+
+        Con digest, el archivo se guarda como <digest>.<extensión>. Si ya existe (mismos datos
+        que una exportación anterior), se conserva el existente y el archivo de origen se
+        reemplaza por él, para que ambos tengan exactamente los mismos bytes.
+
+        Args:
+            key: Clave de la exportación
+            source_filename: Archivo generado
+            record_count: Número de registros del archivo
+            digest: Digest del contenido de la exportación (opcional)
+
+        Returns:
+            Entrada guardada
+        """
+        extension = os.path.basename(source_filename).split('.', 1)[-1]
+
+        with self._lock:
+            if digest:
+                cached_filename = os.path.join(self.directory, f'{digest}.{extension}')
+            else:
+                fd, cached_filename = tempfile.mkstemp(dir=self.directory, suffix=f'.{extension}')
+                os.close(fd)
+                os.remove(cached_filename)
+
+            if os.path.exists(cached_filename):
+                logger.info(f"Exportación sin cambios, se reutiliza el archivo en caché: {key}")
+                self._link(cached_filename, source_filename)
+            else:
+                self._link(source_filename, cached_filename)
+
+            now = time.time()
+            entry = {
+                'filename': cached_filename,
+                'record_count': record_count,
+                'size': os.path.getsize(cached_filename),
+                'etag': digest,
+                'created_at': now,
+                'modified_at': os.path.getmtime(cached_filename),
+                'last_access': now
+            }
+
+            previous = self._entries.pop(key, None)
+            self._entries[key] = entry
+            if previous is not None:
+                self._release_file(previous['filename'])
+            self._evict()
+
+        return dict(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Contadores de aciertos y fallos, número de entradas y tamaño total
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size_bytes': sum(entry['size'] for entry in self._entries.values()),
+                'ttl_seconds': self.ttl
+            }
+
+    def _evict(self):
+        """Eliminar las entradas usadas hace más tiempo hasta respetar max_bytes (con el lock tomado)"""
+        total = sum(entry['size'] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]['last_access']):
+            if total <= self.max_bytes or len(self._entries) == 1:
+                break
+            entry = self._entries.pop(key)
+            total -= entry['size']
+            self._release_file(entry['filename'])
+            logger.info(f"Exportación eliminada de la caché por tamaño: {key}")
+
+    def _release_file(self, filename: str):
+        """Eliminar el archivo de una entrada si ninguna otra lo usa (con el lock tomado)"""
+        if all(entry['filename'] != filename for entry in self._entries.values()):
+            self._remove_file(filename)
+
+    @staticmethod
+    def _link(source: str, target: str):
+        """
+        Hacer que target tenga el contenido de source: enlace duro si es posible (o copia
+        con la misma fecha de modificación), reemplazando target de forma atómica.
+        """
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(target) or '.', prefix='.ccb_')
+        os.close(fd)
+        os.remove(partial)
+        try:
+            try:
+                os.link(source, partial)
+            except OSError:
+                shutil.copy2(source, partial)
+            os.replace(partial, target)
+        except OSError:
+            ExportCache._remove_file(partial)
+            raise
+
+    @staticmethod
+    def _remove_file(filename: str):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
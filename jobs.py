@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Ejecución de trabajos de exportación en segundo plano con un número fijo de
+hilos y una cola acotada, para que las exportaciones simultáneas no compitan
+sin límite por el rate limit de la API de Hilos, y registro de su estado con
+expiración y limpieza de los archivos generados.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """La cola de trabajos está llena y no admite más trabajos"""
+
+
+class JobExecutor:
+    def __init__(self, max_workers: int = 2, max_queue: int = 10):
+        """
+        Inicializar el ejecutor y arrancar sus hilos.
+
+        Args:
+            max_workers: Número de trabajos que se ejecutan a la vez
+            max_queue: Número máximo de trabajos en espera (0 = solo se aceptan trabajos
+                       si hay un hilo libre que los ejecute de inmediato)
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._queue = deque()
+        self._running = set()
+        self._condition = threading.Condition()
+
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, name=f'job-worker-{i + 1}', daemon=True)
+            worker.start()
+
+        logger.info(f"Ejecutor de trabajos iniciado: {self.max_workers} hilos, cola de {self.max_queue}")
+
+    def submit(self, job_id: str, fn: Callable[[], None]) -> int:
+        """
+        Encolar un trabajo.
+
+        Args:
+            job_id: ID del trabajo
+            fn: Función sin argumentos que ejecuta el trabajo
+
+        Returns:
+            Posición del trabajo en la cola (1 = el próximo en ejecutarse)
+
+        Raises:
+            QueueFullError: Si la cola está llena
+        """
+        with self._condition:
+            # Los trabajos que un hilo libre va a tomar enseguida no cuentan como en espera
+            idle_workers = self.max_workers - len(self._running)
+            if len(self._queue) >= self.max_queue + idle_workers:
+                raise QueueFullError(f"La cola de trabajos está llena ({self.max_queue} en espera)")
+
+            self._queue.append((job_id, fn))
+            self._condition.notify()
+            return len(self._queue)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """
+        Args:
+            job_id: ID del trabajo
+
+        Returns:
+            Posición del trabajo en la cola (empezando en 1), o None si no está en espera
+        """
+        with self._condition:
+            for position, (queued_id, _) in enumerate(self._queue, 1):
+                if queued_id == job_id:
+                    return position
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancelar un trabajo que todavía está en la cola.
+
+        Args:
+            job_id: ID del trabajo
+
+        Returns:
+            True si el trabajo se sacó de la cola, False si no estaba en espera
+        """
+        with self._condition:
+            for item in self._queue:
+                if item[0] == job_id:
+                    self._queue.remove(item)
+                    return True
+        return False
+
+    def is_running(self, job_id: str) -> bool:
+        """
+        Args:
+            job_id: ID del trabajo
+
+        Returns:
+            True si un hilo ya tomó el trabajo de la cola (aunque todavía no haya empezado a
+            actualizar su estado), False si está en espera o no es de este ejecutor
+        """
+        with self._condition:
+            return job_id in self._running
+
+    def queue_depth(self) -> int:
+        """
+        Returns:
+            Número de trabajos en espera
+        """
+        with self._condition:
+            return len(self._queue)
+
+    def running_count(self) -> int:
+        """
+        Returns:
+            Número de trabajos en ejecución
+        """
+        with self._condition:
+            return len(self._running)
+
+    def _worker(self):
+        """Bucle de cada hilo: tomar el siguiente trabajo de la cola y ejecutarlo"""
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job_id, fn = self._queue.popleft()
+                self._running.add(job_id)
+
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Error no controlado en el trabajo {job_id}: {e}")
+            finally:
+                with self._condition:
+                    self._running.discard(job_id)
+
+
+# Estados en los que un trabajo ya no va a cambiar y puede expirar
+FINISHED_STATUSES = {'completed', 'error', 'cancelled'}
+
+
+class MemoryJobStore:
+    """Almacén de trabajos en memoria (solo visible para el proceso actual)"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(job_id)
+            return dict(record, job=dict(record['job'])) if record is not None else None
+
+    def put(self, job_id: str, job: Dict[str, Any], updated_at: float):
+        with self._lock:
+            self._records[job_id] = {'job': dict(job), 'updated_at': updated_at, 'last_access': updated_at}
+
+    def touch(self, job_id: str, last_access: float):
+        with self._lock:
+            if job_id in self._records:
+                self._records[job_id]['last_access'] = last_access
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._records.pop(job_id, None)
+
+    def records(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return [(job_id, dict(record)) for job_id, record in self._records.items()]
+
+
+class SQLiteJobStore:
+    """
+    Almacén de trabajos en SQLite: el estado sobrevive a reinicios y se comparte
+    entre los workers de gunicorn que usen el mismo archivo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                job TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT job, updated_at, last_access FROM jobs WHERE job_id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'job': json.loads(row[0]), 'updated_at': row[1], 'last_access': row[2]}
+
+    def put(self, job_id: str, job: Dict[str, Any], updated_at: float):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO jobs (job_id, job, updated_at, last_access) VALUES (?, ?, ?, ?)
+                ON CONFLICT(job_id) DO UPDATE SET job = excluded.job, updated_at = excluded.updated_at,
+                                                  last_access = excluded.last_access
+            """, (job_id, json.dumps(job, default=str), updated_at, updated_at))
+            self._conn.commit()
+
+    def touch(self, job_id: str, last_access: float):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET last_access = ? WHERE job_id = ?', (last_access, job_id))
+            self._conn.commit()
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+            self._conn.commit()
+
+    def records(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute('SELECT job_id, job, updated_at, last_access FROM jobs').fetchall()
+        return [(job_id, {'job': json.loads(job), 'updated_at': updated_at, 'last_access': last_access})
+                for job_id, job, updated_at, last_access in rows]
+
+
+class JobRegistry:
+    def __init__(self, store=None, ttl: float = 3600, max_jobs: int = 100):
+        """
+        Registro de trabajos con expiración y límite de tamaño.
+
+        Los trabajos terminados expiran ttl segundos después de su última actualización y,
+        si se supera max_jobs, se eliminan primero los consultados hace más tiempo (LRU).
+        Al eliminar un trabajo se borra también el archivo que generó.
+
+        Args:
+            store: MemoryJobStore o SQLiteJobStore (por defecto, en memoria)
+            ttl: Segundos que se conserva un trabajo terminado
+            max_jobs: Número máximo de trabajos registrados
+        """
+        self.store = store if store is not None else MemoryJobStore()
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._changed = threading.Condition()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            job_id: ID del trabajo
+
+        Returns:
+            Estado del trabajo, o None si no existe o ya expiró
+        """
+        record = self.store.get(job_id)
+        if record is None:
+            return None
+
+        if self._is_expired(record, time.time()):
+            self._remove(job_id, record['job'])
+            return None
+
+        self.store.touch(job_id, time.time())
+        return record['job']
+
+    def set(self, job_id: str, job: Dict[str, Any]):
+        """
+        Guardar el estado de un trabajo y aplicar la política de expiración.
+
+        Args:
+            job_id: ID del trabajo
+            job: Estado del trabajo (status, filename, ...)
+        """
+        self.store.put(job_id, job, time.time())
+        if job.get('status') in FINISHED_STATUSES:
+            self.evict()
+
+        with self._changed:
+            self._changed.notify_all()
+
+    def unfinished(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Returns:
+            Trabajos en cola o en ejecución como tuplas (job_id, estado), por ejemplo
+            para volver a encolarlos tras un reinicio
+        """
+        return [(job_id, record['job']) for job_id, record in self.store.records()
+                if record['job'].get('status') in ('queued', 'processing')]
+
+    def wait_for_change(self, timeout: float) -> bool:
+        """
+        Esperar a que algún trabajo de este proceso cambie de estado.
+        Los cambios hechos por otros procesos (almacén SQLite compartido) se
+        detectan al volver a consultar el trabajo tras el timeout.
+
+        Args:
+            timeout: Segundos máximos de espera
+
+        Returns:
+            True si hubo un cambio antes del timeout
+        """
+        with self._changed:
+            return self._changed.wait(timeout)
+
+    def delete(self, job_id: str):
+        """Eliminar un trabajo y su archivo"""
+        record = self.store.get(job_id)
+        if record is not None:
+            self._remove(job_id, record['job'])
+
+    def evict(self) -> int:
+        """
+        Eliminar los trabajos expirados y, si sobran, los terminados usados hace más tiempo.
+
+        Returns:
+            Número de trabajos eliminados
+        """
+        now = time.time()
+        records = self.store.records()
+        removed = 0
+
+        alive = []
+        for job_id, record in records:
+            if self._is_expired(record, now):
+                self._remove(job_id, record['job'])
+                removed += 1
+            else:
+                alive.append((job_id, record))
+
+        # Solo se desalojan trabajos terminados: los que están en cola o en ejecución se conservan
+        excess = len(alive) - self.max_jobs
+        if excess > 0:
+            finished = [(job_id, record) for job_id, record in alive
+                        if record['job'].get('status') in FINISHED_STATUSES]
+            finished.sort(key=lambda item: item[1]['last_access'])
+            for job_id, record in finished[:excess]:
+                self._remove(job_id, record['job'])
+                removed += 1
+
+        if removed:
+            logger.info(f"Trabajos eliminados del registro: {removed}")
+        return removed
+
+    def _is_expired(self, record: Dict[str, Any], now: float) -> bool:
+        return record['job'].get('status') in FINISHED_STATUSES and now - record['updated_at'] > self.ttl
+
+    def _remove(self, job_id: str, job: Dict[str, Any]):
+        """Eliminar un trabajo del almacén y borrar su archivo (salvo que pertenezca a la caché)"""
+        self.store.delete(job_id)
+        filename = job.get('filename')
+        if filename and not job.get('cached'):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
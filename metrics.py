@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Métricas del proceso de extracción en formato de texto de Prometheus.
+Implementación mínima (contadores, histogramas y gauges con etiquetas) para
+no depender de prometheus_client.
+"""
+
+import threading
+from typing import Callable, List, Tuple
+
+# Límites de los histogramas de latencia, en segundos
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contador que solo aumenta"""
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self, **labels) -> float:
+        """
+        Args:
+            labels: Etiquetas a filtrar (sin etiquetas, suma todas las series)
+
+        Returns:
+            Suma de las series que tienen esas etiquetas
+        """
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for key, value in self._values.items() if wanted <= set(key))
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja; puede leerse de una función en cada consulta"""
+    metric_type = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values = {}
+        self._callbacks = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        """Leer el valor de fn cada vez que se consultan las métricas"""
+        with self._lock:
+            self._callbacks[tuple(sorted(labels.items()))] = fn
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for key, fn in callbacks.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Distribución de valores (latencias) en buckets acumulativos"""
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def summary(self, **labels) -> Tuple[int, float]:
+        """
+        Args:
+            labels: Etiquetas exactas de la serie
+
+        Returns:
+            Tupla (número de observaciones, suma de los valores) de la serie
+        """
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            return (series['count'], series['sum']) if series else (0, 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series_items = [(key, dict(series, counts=list(series['counts'])))
+                            for key, series in sorted(self._series.items())]
+        lines = []
+        for key, series in series_items:
+            for bound, count in zip(self.buckets, series['counts']):
+                bucket_labels = key + (('le', _format_value(bound)),)
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(series["sum"])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {series["count"]}')
+        return lines
+
+
+def render() -> str:
+    """
+    Returns:
+        Todas las métricas registradas en formato de texto de Prometheus
+    """
+    with _registry_lock:
+        registered = list(_registry)
+    lines = []
+    for metric in registered:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Métricas del cliente de Hilos y del proceso de extracción
+HILOS_REQUESTS = Counter(
+    'ccb_hilos_requests_total', 'Peticiones a la API de Hilos por endpoint y código de estado')
+HILOS_REQUEST_DURATION = Histogram(
+    'ccb_hilos_request_duration_seconds', 'Latencia de las peticiones a la API de Hilos por endpoint',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+HILOS_RETRIES = Counter(
+    'ccb_hilos_retries_total', 'Reintentos de peticiones a la API de Hilos por endpoint y motivo')
+HILOS_RATE_LIMIT = Gauge(
+    'ccb_hilos_rate_limit', 'Peticiones por segundo a la API de Hilos permitidas por el límite adaptativo')
+HILOS_RATE_LIMIT_WAIT = Counter(
+    'ccb_hilos_rate_limit_wait_seconds_total', 'Segundos esperados por el límite de peticiones antes de llamar a Hilos')
+PHASE_DURATION = Histogram(
+    'ccb_phase_duration_seconds', 'Duración de cada fase de la exportación')
+ROWS_WRITTEN = Counter(
+    'ccb_rows_written_total', 'Filas escritas en archivos de exportación por formato')
+CONTACT_STORE_HITS = Counter(
+    'ccb_contact_store_hits_total', 'Contactos tomados del almacén local sin pedirlos a la API')
+EXPORT_CACHE_REQUESTS = Counter(
+    'ccb_export_cache_requests_total', 'Consultas a la caché de exportaciones por resultado (hit, stale, miss)')
+JOB_QUEUE_DEPTH = Gauge(
+    'ccb_job_queue_depth', 'Trabajos de exportación en espera')
+JOBS_RUNNING = Gauge(
+    'ccb_jobs_running', 'Trabajos de exportación en ejecución')
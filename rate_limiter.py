@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Límite de peticiones a la API de Hilos compartido por todos los extractores y
+trabajos del proceso (y, opcionalmente, por varios procesos mediante SQLite).
+
+El límite es un token bucket (implementado como GCRA: cada petición reserva el
+siguiente hueco libre) cuya tasa se ajusta sola con AIMD: sube poco a poco
+mientras las respuestas llegan bien y rápido, y se reduce a la mitad ante un 429
+(o un 503), de modo que el total de peticiones se mantiene justo por debajo de la
+cuota de Hilos aunque haya varias exportaciones a la vez.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Respuestas que indican que se superó la cuota o que la API está saturada
+THROTTLE_STATUS_CODES = {429, 503}
+
+# Reducción de la tasa cuando las respuestas superan la latencia objetivo (más suave que un 429)
+SLOW_DECREASE = 0.9
+
+
+class MemoryRateState:
+    """Estado del límite en memoria (compartido solo por los hilos del proceso actual)"""
+
+    def __init__(self):
+        self._state = None
+        self._lock = threading.Lock()
+
+    def update(self, fn, initial: Dict[str, Any]) -> Any:
+        """
+        Leer y modificar el estado de forma atómica.
+
+        Args:
+            fn: Función que recibe el estado (diccionario), lo modifica y devuelve un resultado
+            initial: Estado inicial si todavía no existe
+
+        Returns:
+            Resultado de fn
+        """
+        with self._lock:
+            if self._state is None:
+                self._state = dict(initial)
+            return fn(self._state)
+
+
+class SQLiteRateState:
+    """
+    Estado del límite en SQLite: los procesos que usen el mismo archivo (workers de
+    gunicorn, CLI y servidor a la vez) comparten la tasa y los huecos reservados.
+    """
+
+    def __init__(self, path: str, name: str = 'hilos'):
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        # isolation_level=None: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                rate REAL NOT NULL,
+                next_at REAL NOT NULL,
+                decreased_at REAL NOT NULL
+            )
+        """)
+
+    def update(self, fn, initial: Dict[str, Any]) -> Any:
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT rate, next_at, decreased_at FROM rate_limits WHERE name = ?', (self.name,)
+                ).fetchone()
+                state = dict(zip(('rate', 'next_at', 'decreased_at'), row)) if row else dict(initial)
+                result = fn(state)
+                self._conn.execute("""
+                    INSERT INTO rate_limits (name, rate, next_at, decreased_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET rate = excluded.rate, next_at = excluded.next_at,
+                                                    decreased_at = excluded.decreased_at
+                """, (self.name, state['rate'], state['next_at'], state['decreased_at']))
+                self._conn.execute('COMMIT')
+                return result
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate: float = 10.0, min_rate: float = 1.0, max_rate: float = 30.0,
+                 burst: int = 5, increase: float = 0.5, decrease: float = 0.5,
+                 latency_target: float = 2.0, cooldown: float = 1.0, state=None):
+        """
+        Inicializar el límite de peticiones.
+
+        Args:
+            rate: Peticiones por segundo iniciales
+            min_rate: Tasa mínima a la que se puede reducir
+            max_rate: Tasa máxima a la que se puede subir (0 = sin límite)
+            burst: Peticiones que se pueden hacer seguidas sin esperar tras un periodo inactivo
+            increase: Peticiones por segundo que se suman por cada segundo de respuestas correctas
+            decrease: Factor por el que se multiplica la tasa ante un 429/503
+            latency_target: Segundos de latencia a partir de los cuales la tasa deja de subir
+                            y se reduce ligeramente (0 = no tener en cuenta la latencia)
+            cooldown: Segundos mínimos entre dos reducciones (los 429 de peticiones que
+                      estaban en vuelo a la vez cuentan como uno solo)
+            state: MemoryRateState o SQLiteRateState (por defecto, en memoria)
+        """
+        self.min_rate = max(0.01, min_rate)
+        self.max_rate = max_rate
+        self.burst = max(1, burst)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.state = state or MemoryRateState()
+        self._initial = {'rate': self._clamp(rate), 'next_at': 0.0, 'decreased_at': 0.0}
+
+    def _clamp(self, rate: float) -> float:
+        if self.max_rate:
+            rate = min(self.max_rate, rate)
+        return max(self.min_rate, rate)
+
+    def reserve(self) -> float:
+        """
+        Reservar el siguiente hueco para una petición.
+
+        Returns:
+            Segundos que hay que esperar antes de hacer la petición
+        """
+        def take(state):
+            now = time.time()
+            interval = 1.0 / state['rate']
+            # Tras un periodo sin peticiones se acumulan como máximo `burst` huecos
+            slot = max(state['next_at'], now - (self.burst - 1) * interval)
+            state['next_at'] = slot + interval
+            return max(0.0, slot - now)
+
+        return self.state.update(take, self._initial)
+
+    def acquire(self) -> float:
+        """
+        Esperar (si hace falta) hasta poder hacer una petición.
+
+        Returns:
+            Segundos esperados
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def record(self, status: Optional[int], latency: float, retry_after: float = 0.0):
+        """
+        Ajustar la tasa según el resultado de una petición.
+
+        Args:
+            status: Código HTTP de la respuesta (None si hubo un error de conexión)
+            latency: Segundos que tardó la respuesta
+            retry_after: Segundos indicados por la API en Retry-After (se pausan todas las peticiones)
+        """
+        throttled = status in THROTTLE_STATUS_CODES
+        slow = bool(self.latency_target) and latency > self.latency_target
+
+        def adjust(state):
+            now = time.time()
+            rate = state['rate']
+            if throttled or slow:
+                if now - state['decreased_at'] >= self.cooldown:
+                    factor = self.decrease if throttled else SLOW_DECREASE
+                    state['rate'] = self._clamp(rate * factor)
+                    state['decreased_at'] = now
+                if throttled and retry_after:
+                    # Nadie vuelve a pedir hasta que pase el Retry-After
+                    state['next_at'] = max(state['next_at'], now + retry_after)
+            elif status is not None and status < 400:
+                # Aumento aditivo: `increase` peticiones/s por cada segundo de respuestas correctas
+                state['rate'] = self._clamp(rate + self.increase / rate)
+            return rate, state['rate']
+
+        before, after = self.state.update(adjust, self._initial)
+        if after < before:
+            logger.warning(f"Límite de peticiones a Hilos reducido de {before:.2f} a {after:.2f}/s "
+                           f"({'respuesta ' + str(status) if throttled else f'latencia {latency:.1f}s'})")
+
+    @property
+    def rate(self) -> float:
+        """Peticiones por segundo permitidas actualmente"""
+        return self.state.update(lambda state: state['rate'], self._initial)
+
+    def reset(self):
+        """Volver a la tasa inicial y descartar los huecos reservados"""
+        def restore(state):
+            state.update(self._initial)
+
+        self.state.update(restore, self._initial)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """
+    Límite de peticiones del proceso, creado la primera vez a partir de las variables
+    de entorno HILOS_RATE_* (HILOS_RATE_STATE = archivo SQLite para compartirlo entre procesos).
+
+    Returns:
+        AdaptiveRateLimiter compartido por todos los extractores
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            state_path = os.getenv('HILOS_RATE_STATE', '')
+            _limiter = AdaptiveRateLimiter(
+                rate=float(os.getenv('HILOS_RATE_LIMIT', '10')),
+                min_rate=float(os.getenv('HILOS_RATE_MIN', '1')),
+                max_rate=float(os.getenv('HILOS_RATE_MAX', '30')),
+                burst=int(os.getenv('HILOS_RATE_BURST', '5')),
+                latency_target=float(os.getenv('HILOS_RATE_LATENCY_TARGET', '2')),
+                state=SQLiteRateState(state_path) if state_path else MemoryRateState()
+            )
+            metrics.HILOS_RATE_LIMIT.set_function(lambda: _limiter.rate)
+            logger.info(f"Límite de peticiones a Hilos: {_limiter.rate:.2f}/s"
+                        f"{f' compartido en {state_path}' if state_path else ''}")
+        return _limiter
@@ -0,0 +1,79 @@
+"""
+Versión de los contactos en el almacén local: la exportación completa y la delta
+deben calcular la misma versión para un contacto, para no sobrescribirse sus copias.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import ccb  # noqa: E402
+from contact_store import ContactStore  # noqa: E402
+from mock_hilos import MockHilosData, MockHilosServer  # noqa: E402
+from rate_limiter import AdaptiveRateLimiter  # noqa: E402
+
+
+def flow_record(record_id, updated_on, contact):
+    return {'id': record_id, 'created_on': updated_on, 'last_updated_on': updated_on, 'contact': contact}
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    monkeypatch.setenv('CCB_CONTACT_STORE', '')
+    return ccb.CCBDataExtractor('token', 'flow')
+
+
+def test_version_is_the_same_for_every_record_of_a_contact(extractor):
+    contact = {'id': 'c1', 'phone': '+573001112233', 'last_updated_on': '2025-03-01T10:00:00Z'}
+    oldest = flow_record('fec-1', '2025-01-01T00:00:00Z', contact)
+    newest = flow_record('fec-9', '2025-03-01T10:00:00Z', contact)
+
+    assert extractor.contact_version(oldest) == extractor.contact_version(newest)
+
+
+def test_version_changes_when_the_contact_changes(extractor):
+    before = flow_record('fec-1', '2025-01-01T00:00:00Z',
+                         {'id': 'c1', 'last_updated_on': '2025-01-01T00:00:00Z'})
+    after = flow_record('fec-1', '2025-01-01T00:00:00Z',
+                        {'id': 'c1', 'last_updated_on': '2025-03-01T10:00:00Z'})
+
+    assert extractor.contact_version(before) != extractor.contact_version(after)
+
+
+def test_version_without_last_updated_on_uses_contact_data(extractor):
+    first = flow_record('fec-1', '2025-01-01T00:00:00Z', {'id': 'c1', 'phone': '+1'})
+    second = flow_record('fec-2', '2025-02-01T00:00:00Z', {'id': 'c1', 'phone': '+1'})
+    changed = flow_record('fec-2', '2025-02-01T00:00:00Z', {'id': 'c1', 'phone': '+2'})
+
+    assert extractor.contact_version(first) == extractor.contact_version(second)
+    assert extractor.contact_version(first) != extractor.contact_version(changed)
+
+
+def test_full_and_delta_exports_share_stored_contacts(monkeypatch, tmp_path):
+    server = MockHilosServer(MockHilosData(contacts=60, duplicate_rate=0.4)).start()
+    try:
+        monkeypatch.setenv('HILOS_API_BASE_URL', server.base_url)
+        store = ContactStore(str(tmp_path / 'contacts.db'))
+        limiter = AdaptiveRateLimiter(rate=1000, max_rate=0, burst=100)
+
+        def detail_fetches(run):
+            before = server.stats['contact_requests']
+            run(ccb.CCBDataExtractor('token', 'bench-flow', store=store, rate_limiter=limiter))
+            return server.stats['contact_requests'] - before
+
+        full = lambda extractor: list(extractor.iter_processed_contacts())
+        delta = lambda extractor: extractor.get_changed_contacts(None)
+
+        assert detail_fetches(full) == 60
+        # Sin cambios, ninguna alternancia vuelve a pedir contactos
+        assert detail_fetches(delta) == 0
+        assert detail_fetches(full) == 0
+        assert detail_fetches(delta) == 0
+        store.close()
+    finally:
+        server.stop()
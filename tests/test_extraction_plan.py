@@ -0,0 +1,171 @@
+"""
+Paridad de ExtractionPlan con la extracción original campo por campo
+(CCBDataExtractor.extract_contact_data antes de compilar el plan).
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ccb import ExtractionPlan  # noqa: E402
+
+COLUMNS = ['phone', 'nombre', 'cedula', 'localidad', 'barrio', 'edad']
+
+
+def reference_extract(columns, contact_details):
+    """Extracción original: cada columna se busca en cada ubicación por separado"""
+    extracted_data = {col: '' for col in columns}
+
+    def extract_value(data, key):
+        if isinstance(data, dict):
+            return data.get(key, '')
+        elif isinstance(data, list):
+            for item in data:
+                if isinstance(item, dict) and key in item:
+                    return item[key]
+        return ''
+
+    extracted_data['phone'] = extract_value(contact_details, 'phone')
+
+    search_locations = [
+        contact_details,
+        contact_details.get('fields', {}),
+        contact_details.get('custom_fields', {}),
+        contact_details.get('responses', {}),
+        contact_details.get('data', {}),
+        contact_details.get('attributes', {}),
+        contact_details.get('meta', {}),
+    ]
+
+    for field_name in columns:
+        if field_name == 'phone':
+            continue
+        for location in search_locations:
+            if isinstance(location, dict):
+                value = extract_value(location, field_name)
+                if value:
+                    extracted_data[field_name] = value
+                    break
+
+    for key, value in contact_details.items():
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    for field_name in columns:
+                        if field_name in item and not extracted_data[field_name]:
+                            extracted_data[field_name] = item[field_name]
+
+    meta_data = contact_details.get('meta', {})
+    if isinstance(meta_data, dict):
+        for field_name in columns:
+            if field_name in meta_data and not extracted_data[field_name]:
+                extracted_data[field_name] = meta_data[field_name]
+
+    return extracted_data
+
+
+PAYLOADS = {
+    'raiz_gana_a_fields': {
+        'phone': '+573001112233',
+        'nombre': 'Raíz',
+        'fields': {'nombre': 'Fields', 'cedula': '123'},
+        'meta': {'nombre': 'Meta', 'cedula': '999', 'localidad': 'Suba'},
+    },
+    'raiz_vacia_cae_a_fields': {
+        'phone': '+573001112233',
+        'nombre': '',
+        'fields': {'nombre': 'Fields'},
+        'custom_fields': {'nombre': 'Custom', 'barrio': 'Custom'},
+    },
+    'orden_de_ubicaciones': {
+        'custom_fields': {'cedula': 'custom'},
+        'responses': {'cedula': 'responses', 'barrio': 'responses'},
+        'data': {'barrio': 'data', 'edad': 'data'},
+        'attributes': {'edad': 'attributes', 'localidad': 'attributes'},
+        'meta': {'localidad': 'meta'},
+    },
+    'listas_solo_para_vacios': {
+        'phone': '+573004445566',
+        'nombre': 'Raíz',
+        'answers': [
+            'texto',
+            {'nombre': 'Lista', 'barrio': 'Lista 1'},
+            {'barrio': 'Lista 2', 'edad': 0},
+        ],
+        'meta': {'edad': 30},
+    },
+    'meta_rellena_falsy': {
+        'fields': {'edad': 0},
+        'meta': {'edad': 0, 'cedula': None, 'phone': '+573007778899'},
+    },
+    'phone_solo_desde_raiz': {
+        'fields': {'phone': '+570000000000', 'nombre': 'Fields'},
+        'meta': {'phone': '+571111111111'},
+    },
+    'ubicaciones_no_dict': {
+        'phone': '+573001112233',
+        'fields': ['no', 'es', 'dict'],
+        'custom_fields': None,
+        'meta': 'texto',
+        'data': {'nombre': 'Data'},
+    },
+    'vacio': {},
+}
+
+
+@pytest.mark.parametrize('name', sorted(PAYLOADS))
+def test_extract_matches_reference(name):
+    payload = PAYLOADS[name]
+    plan = ExtractionPlan(COLUMNS)
+
+    assert plan.extract(payload) == reference_extract(COLUMNS, payload)
+    assert plan.extract_values(payload) == [reference_extract(COLUMNS, payload)[c] for c in COLUMNS]
+
+
+def test_root_then_fields_then_meta_precedence():
+    extracted = ExtractionPlan(COLUMNS).extract(PAYLOADS['raiz_gana_a_fields'])
+
+    assert extracted['nombre'] == 'Raíz'
+    assert extracted['cedula'] == '123'
+    assert extracted['localidad'] == 'Suba'
+    assert extracted['barrio'] == ''
+
+
+def test_first_non_empty_location_wins():
+    extracted = ExtractionPlan(COLUMNS).extract(PAYLOADS['orden_de_ubicaciones'])
+
+    assert extracted['cedula'] == 'custom'
+    assert extracted['barrio'] == 'responses'
+    assert extracted['edad'] == 'data'
+    assert extracted['localidad'] == 'attributes'
+
+
+def test_lists_and_meta_only_fill_empty_fields():
+    extracted = ExtractionPlan(COLUMNS).extract(PAYLOADS['listas_solo_para_vacios'])
+
+    # nombre ya venía de la raíz; barrio toma el primer diccionario de la lista
+    assert extracted['nombre'] == 'Raíz'
+    assert extracted['barrio'] == 'Lista 1'
+    # La lista deja edad en 0 (vacío), así que meta la rellena
+    assert extracted['edad'] == 30
+
+
+def test_meta_fill_in_copies_falsy_values_and_phone():
+    extracted = ExtractionPlan(COLUMNS).extract(PAYLOADS['meta_rellena_falsy'])
+
+    # La búsqueda principal ignora valores vacíos; el relleno desde meta los copia
+    assert extracted['edad'] == 0
+    assert extracted['cedula'] is None
+    # phone no se busca en fields, pero sí se rellena desde meta
+    assert extracted['phone'] == '+573007778899'
+
+
+def test_phone_ignores_nested_locations_when_root_has_it():
+    payload = dict(PAYLOADS['phone_solo_desde_raiz'], phone='+573001112233')
+    extracted = ExtractionPlan(COLUMNS).extract(payload)
+
+    assert extracted['phone'] == '+573001112233'
+    assert extracted['nombre'] == 'Fields'
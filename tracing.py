@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Perfilado opcional de una exportación: registra intervalos (spans) de cada etapa
+(páginas, detalle de contactos, extracción, deduplicación, escritura) y los
+exporta en formato Chrome trace (chrome://tracing, Perfetto) o como tabla resumen.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, Iterable, List
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTracer:
+    """Tracer que no registra nada (perfilado desactivado)"""
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name: str, category: str = '', **args) -> _NullSpan:
+        return self._span
+
+    def record(self, name: str, category: str, start: float, end: float, args: Dict[str, Any] = None):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer:
+    """Registro de spans de una ejecución, seguro entre hilos"""
+    enabled = True
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, category: str = '', **args) -> _Span:
+        """
+        Medir un bloque de código: with tracer.span('contact_fetch', 'network', contact_id=...)
+
+        Args:
+            name: Nombre de la etapa
+            category: Categoría (network, cpu, write, wait, ...)
+            args: Datos adicionales que se guardan con el span
+
+        Returns:
+            Context manager que registra el span al salir
+        """
+        return _Span(self, name, category, args)
+
+    def record(self, name: str, category: str, start: float, end: float, args: Dict[str, Any] = None):
+        """Registrar un span ya medido con time.perf_counter()"""
+        thread = threading.current_thread()
+        with self._lock:
+            self._events.append((name, category, start, end, thread.ident, args or None))
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Diccionario en formato Chrome trace-event (eventos completos 'X', tiempos en µs)
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+
+        trace_events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+            for tid, thread_name in threads.items()
+        ]
+        for name, category, start, end, tid, args in events:
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - self._origin) * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': pid,
+                'tid': tid
+            }
+            if args:
+                event['args'] = args
+            trace_events.append(event)
+
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filename: str):
+        """Guardar el trace en un archivo JSON que se puede abrir en chrome://tracing o Perfetto"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            Resumen por etapa (ver summarize)
+        """
+        return summarize(self.chrome_trace()['traceEvents'])
+
+
+def summarize(trace_events: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Agrupar los spans de un trace por etapa.
+
+    Args:
+        trace_events: Eventos en formato Chrome trace
+
+    Returns:
+        Lista con name, category, count, total_ms, mean_ms y max_ms de cada etapa,
+        ordenada por tiempo total (los spans de hilos en paralelo se suman)
+    """
+    stages = {}
+    for event in trace_events:
+        if event.get('ph') != 'X':
+            continue
+        stage = stages.setdefault(event['name'], {'name': event['name'], 'category': event.get('cat', ''),
+                                                  'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        duration = event['dur'] / 1000
+        stage['count'] += 1
+        stage['total_ms'] += duration
+        stage['max_ms'] = max(stage['max_ms'], duration)
+
+    rows = []
+    for stage in stages.values():
+        rows.append(dict(stage,
+                         total_ms=round(stage['total_ms'], 1),
+                         mean_ms=round(stage['total_ms'] / stage['count'], 3),
+                         max_ms=round(stage['max_ms'], 1)))
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+def format_summary(rows: List[Dict[str, Any]]) -> str:
+    """
+    Returns:
+        Tabla de texto con el resumen por etapa
+    """
+    lines = [f"{'etapa':<20} {'categoría':<10} {'veces':>8} {'total(ms)':>12} {'media(ms)':>10} {'máx(ms)':>10}"]
+    lines.append('-' * len(lines[0]))
+    for row in rows:
+        lines.append(f"{row['name']:<20} {row['category']:<10} {row['count']:>8} {row['total_ms']:>12.1f} "
+                     f"{row['mean_ms']:>10.3f} {row['max_ms']:>10.1f}")
+    return '\n'.join(lines)